@@ -5,12 +5,19 @@ import os
 import re
 import gzip
 import hashlib
+import csv
+import shlex
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
 from functools import partial
 
 from doit import task_params
 # https://groups.google.com/g/python-doit/c/GFtEuBp82xc/m/j7jFkvAGH1QJ
 from doit.action import CmdAction
+from doit.exceptions import TaskFailed
 from doit.tools import run_once, create_folder, result_dep, title_with_actions
 from doit.reporter import ConsoleReporter
 
@@ -147,6 +154,138 @@ def task_luts():
     }
 
 
+# nextpnr doesn't have a machine-readable timing report for iCE40, so scrape
+# the log. The last "Max frequency" line for a clock is post-route. The
+# critical path report starts at its "Source" and ends at a "Setup" (or
+# "Sink", for older nextpnr).
+FMAX_RE = re.compile(r"Max frequency for clock +'([^']+)': ([0-9.]+) MHz")
+CRIT_RE = re.compile(r"Critical path report for clock '([^']+)'")
+ENDPOINT_RE = re.compile(r"\b(Source|Setup|Sink) (\S+)")
+
+
+def parse_nextpnr_timing(tim):
+    fmax = dict()
+    paths = dict()
+    curr_path = None
+
+    with open(tim) as fp:
+        for line in fp:
+            if m := FMAX_RE.search(line):
+                fmax[m[1]] = float(m[2])
+                curr_path = None
+            elif m := CRIT_RE.search(line):
+                curr_path = paths[m[1]] = [None, None]
+            elif curr_path and (m := ENDPOINT_RE.search(line)):
+                if m[1] == "Source" and not curr_path[0]:
+                    curr_path[0] = m[2]
+                elif m[1] != "Source":
+                    curr_path[1] = m[2]
+
+    return fmax, paths
+
+
+# Rerun place-and-route with the same netlist and options that Amaranth used
+# for the demo, except for the seed. Placement is randomized, so fmax
+# of a single run is too noisy to compare across commits.
+def nextpnr_seed_cmd(build_dir, seed):
+    with open(build_dir / "build_top.sh") as fp:
+        script = fp.read().replace("\\\n", " ")
+
+    for line in script.splitlines():
+        if "nextpnr-ice40" in line:
+            args = shlex.split(line)
+            break
+    else:
+        raise ValueError(f"no nextpnr-ice40 invocation in {build_dir}")
+
+    cmd = [os.environ.get("NEXTPNR_ICE40", "nextpnr-ice40")]
+    it = iter(args[1:])
+    for arg in it:
+        if arg in ("--log", "--asc"):
+            next(it)
+        elif arg != "--quiet":
+            cmd.append(arg)
+
+    return cmd + ["--quiet", "--seed", str(seed),
+                  "--log", f"top.seed{seed}.tim"]
+
+
+def bench_fmax(build_dir, fmax_csv, seeds, tolerance, min_fmax):
+    def run_seed(seed):
+        subprocess.run(nextpnr_seed_cmd(build_dir, seed), cwd=build_dir,
+                       check=True)
+        return parse_nextpnr_timing(build_dir / f"top.seed{seed}.tim")
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+        results = list(ex.map(run_seed, range(1, seeds + 1)))
+
+    # The demo has a single clock domain; in a multi-clock design, the
+    # clock with the lowest fmax would be the one to watch anyway.
+    clk = min(results[0][0], key=results[0][0].get)
+    runs = sorted((r[0][clk], r[1].get(clk, (None, None))) for r in results)
+    median = statistics.median(f for f, _ in runs)
+    # Report the critical path of the run closest to the median.
+    _, (src, sink) = min(runs, key=lambda r: abs(r[0] - median))
+
+    commit = subprocess.run(["git", "rev-parse", "HEAD"], check=True,
+                            stdout=subprocess.PIPE).stdout.decode().strip()
+    prev = None
+    if fmax_csv.exists():
+        with open(fmax_csv, newline="") as fp:
+            rows = [r for r in csv.DictReader(fp) if r["commit"] != commit]
+            if rows:
+                prev = float(rows[-1]["median_mhz"])
+    else:
+        with open(fmax_csv, "w", newline="") as fp:
+            csv.writer(fp).writerow(["commit", "clock", "seeds",
+                                     "median_mhz", "min_mhz", "max_mhz",
+                                     "crit_source", "crit_sink"])
+
+    with open(fmax_csv, "a", newline="") as fp:
+        csv.writer(fp).writerow([commit, clk, seeds, f"{median:.2f}",
+                                 f"{runs[0][0]:.2f}", f"{runs[-1][0]:.2f}",
+                                 src, sink])
+
+    print(f"{clk}: median {median:.2f} MHz over {seeds} seeds "
+          f"({runs[0][0]:.2f}-{runs[-1][0]:.2f} MHz), critical path "
+          f"{src} -> {sink}")
+
+    if median < min_fmax:
+        return TaskFailed(f"median fmax {median:.2f} MHz is below "
+                          f"{min_fmax:.2f} MHz")
+    if prev and median < prev * (1 - tolerance / 100):
+        return TaskFailed(f"median fmax {median:.2f} MHz regressed more "
+                          f"than {tolerance}% from {prev:.2f} MHz")
+
+
+@task_params([{"name": "seeds", "short": "s", "type": int, "default": 8,
+               "help": "number of nextpnr seeds to run"},
+              {"name": "tolerance", "short": "t", "type": float,
+               "default": 5.0,
+               "help": "fail if median fmax drops more than this many "
+                       "percent from the last recorded commit"},
+              {"name": "min_fmax", "short": "m", "type": float,
+               "default": 0.0,
+               "help": "fail if median fmax is below this many MHz"}])
+def task_fmax(seeds, tolerance, min_fmax):
+    "build \"pdm demo\" bitstream (if out of date), record median fmax over several nextpnr seeds"  # noqa: E501
+    build_dir = Path("./build-bench")
+    fmax_csv = Path("./fmax.csv")
+    pyfiles = [s for s in Path("./src/sentinel").glob("*.py")] + \
+              [Path("./examples/attosoc.py")]
+
+    return {
+        "basename": "bench_fmax",
+        "actions": [(bench_fmax, (build_dir, fmax_csv, seeds, tolerance,
+                                  min_fmax))],
+        "targets": [fmax_csv],
+        "uptodate": [result_dep("_git_rev")],
+        "verbosity": 2,
+        "setup": ["_demo"],
+        "file_dep": pyfiles + [Path("./src/sentinel/microcode.asm")],
+    }
+
+
 def task_ucode():
     "assemble microcode and copy non-bin artifacts to root"
     ucode = Path("./src/sentinel/microcode.asm")
@@ -395,6 +534,10 @@ SBY_TESTS = (
     "csr_ill_30a_ch0", "csr_ill_31a_ch0"
 )
 
+# Checks that catch the most bugs per solver-second; with a time budget, run
+# these before anything else.
+SBY_PRIORITY = ("causal_ch0", "reg_ch0", "liveness_ch0")
+
 
 # This task is useful for when hacking on *.py files, but the RISC-V Formal
 # config files haven't actually changed (and thus genchecks.py need not be
@@ -421,40 +564,125 @@ def task__formal_gen_files():
     sentinel_dir = cores_dir / "sentinel"
 
     genchecks = formal_tests / "riscv-formal" / "checks" / "genchecks.py"
-    disasm_py = formal_tests / "disasm.py"
     checks_cfg = formal_tests / "checks.cfg"
     wrapper_sv = formal_tests / "wrapper.sv"
 
     return {
-        "actions": [(copy_, [disasm_py, sentinel_dir / disasm_py.name]),
-                    (copy_, [checks_cfg, sentinel_dir / checks_cfg.name]),
+        "actions": [(copy_, [checks_cfg, sentinel_dir / checks_cfg.name]),
                     (copy_, [wrapper_sv, sentinel_dir / wrapper_sv.name]),
                     CmdAction("python3 ../../checks/genchecks.py",
                               cwd=sentinel_dir)],
-        "file_dep": [disasm_py, checks_cfg, wrapper_sv, genchecks]
+        "file_dep": [checks_cfg, wrapper_sv, genchecks]
     }
 
 
 def maybe_disasm_move_vcd(sentinel_dir, root, sby_file):
+    # Only needed for failing tests; Verilog_VCD is a dev dependency.
+    from tests.formal.disasm import disasm_vcd
+
     sby_dir: Path = sby_file.with_suffix("")
     trace_names = [t for t in (sby_dir / "engine_0").glob("trace*.vcd")]
 
     id_re = re.compile("[0-9]*$")
     for tn in trace_names:
         num = id_re.search(str(tn.stem))
-        rel_tn = tn.relative_to(sentinel_dir)
         stem_id = sby_file.stem + num[0] if num else ""
         out_path = root / stem_id
 
         copy2(tn, out_path.with_suffix(".vcd"))
-        ret = subprocess.run(["python3", "disasm.py", rel_tn,
-                              stem_id], stdout=subprocess.PIPE,
-                             cwd=sentinel_dir)
-        ret.check_returncode()
+        disasm = disasm_vcd(str(tn))
+
+        print(disasm)
+        with open(out_path.with_suffix(".s"), "w") as fp:
+            fp.write(disasm)
+
+
+# Source locations and the generator version change without the netlist
+# changing, so leave them out of the netlist hash.
+VERILOG_NOISE_RE = re.compile(r"\(\* src = \"[^\"]*\" \*\)\s*|"
+                              r"^/\* Generated by .*\*/$", re.MULTILINE)
+
+
+# A check's result only depends on the contents of its .sby file and the
+# files it reads (wrapper.sv, sentinel.v, and RISC-V Formal's checks), so
+# use a hash of those as the key to a cache of passing results.
+def formal_cache_key(sby_file):
+    h = hashlib.sha256()
+
+    with open(sby_file, "rb") as fp:
+        sby = fp.read()
+    h.update(sby)
+
+    files = []
+    in_files = False
+    for line in sby.decode("utf-8").splitlines():
+        if line.startswith("["):
+            in_files = line.strip() == "[files]"
+        elif in_files and line.strip():
+            # "[files]" entries are either "src" or "dst src".
+            files.append(sby_file.parent / line.split()[-1])
+
+    for f in files:
+        h.update(str(f.name).encode("utf-8"))
+        if f.suffix == ".v":
+            with open(f, "r") as fp:
+                h.update(VERILOG_NOISE_RE.sub("", fp.read()).encode("utf-8"))
+        else:
+            with open(f, "rb") as fp:
+                h.update(fp.read())
+
+    return h.hexdigest()
+
+
+# Solver runtimes from previous runs, one file per check so that parallel
+# doit processes don't race.
+def sby_runtimes(cache_dir):
+    times = dict()
+    for c in SBY_TESTS:
+        try:
+            times[c] = float((cache_dir / "runtime" / c).read_text())
+        except (FileNotFoundError, ValueError):
+            pass
+
+    return times
+
+
+# Longest job first gives the best load balancing for independent jobs.
+# Checks that have never run might be slow, so start them first.
+def sby_schedule(times, budget=None):
+    order = sorted(SBY_TESTS, key=lambda c: -times.get(c, float("inf")))
+    if budget:
+        order = list(SBY_PRIORITY) + \
+                [c for c in order if c not in SBY_PRIORITY]
 
-        print(ret.stdout.decode("utf-8"))
-        with open(out_path.with_suffix(".s"), "wb") as fp:
-            fp.write(ret.stdout)
+    return order
+
+
+def run_sby_cached(sentinel_dir, root, sby_file, cache_dir):
+    key = formal_cache_key(sby_file)
+    cached = cache_dir / key
+    status = sby_file.with_suffix("") / "status"
+
+    if cached.exists():
+        create_folder(status.parent)
+        copy2(cached, status)
+        print(f"{sby_file.stem}: netlist unchanged, reusing PASS")
+        return
+
+    start = time.monotonic()
+    ret = subprocess.run(["sby", "-f", sby_file.name], cwd=sby_file.parent)
+    create_folder(cache_dir / "runtime")
+    (cache_dir / "runtime" / sby_file.stem).write_text(
+        f"{time.monotonic() - start:.1f}\n")
+    if ret.returncode:
+        return TaskFailed(f"sby exited with {ret.returncode}")
+    maybe_disasm_move_vcd(sentinel_dir, root, sby_file)
+
+    with open(status, "r") as fp:
+        res = fp.read()
+    if "PASS" in res and "FAIL" not in res:
+        create_folder(cache_dir)
+        copy2(status, cached)
 
 
 def task_run_sby():
@@ -468,6 +696,7 @@ def task_run_sby():
     disasm_py = formal_tests / "disasm.py"
     checks_cfg = formal_tests / "checks.cfg"
     wrapper_sv = formal_tests / "wrapper.sv"
+    cache_dir = formal_tests / "cache"
 
     # Expose this until I can figure out how to serialize the setup for
     # all the sby tasks when they run in parallel. If this line isn't
@@ -489,16 +718,16 @@ def task_run_sby():
                "parallel race conditions"
     }
 
-    for c in SBY_TESTS:
+    for c in sby_schedule(sby_runtimes(cache_dir)):
         sby_file = (sentinel_dir / "checks" / c).with_suffix(".sby")
         yield {
             "name": c,
             "title": partial(print_title,
                              title=f"Running RISC-V Formal Test {c}"),
-            "actions": [CmdAction(f"sby -f {sby_file.name}",
-                                  cwd=sentinel_dir / "checks"),
-                        (maybe_disasm_move_vcd, (sentinel_dir, root,
-                                                 sby_file))],
+            # Edits that don't change the netlist (comments, refactors)
+            # still rerun this task, but reuse a cached result.
+            "actions": [(run_sby_cached, (sentinel_dir, root, sby_file,
+                                          cache_dir))],
             "targets": [sentinel_dir / "checks" / c / "status"],
             "file_dep": pyfiles + [genchecks, disasm_py, checks_cfg,
                                    wrapper_sv,
@@ -508,6 +737,77 @@ def task_run_sby():
         }
 
 
+# doit schedules tasks in the order they're defined, and won't skip tasks
+# based on time left, so do the scheduling for "rvformal-all" here. The
+# runs are subprocesses, so threads are enough to keep all cores busy.
+def run_sby_all(sentinel_dir, root, cache_dir, jobs, budget):
+    times = sby_runtimes(cache_dir)
+    queue = sby_schedule(times, budget)
+    start = time.monotonic()
+    lock = threading.Lock()
+    failed = []
+    skipped = []
+
+    def worker():
+        while True:
+            with lock:
+                if not queue:
+                    return
+                c = queue.pop(0)
+                # Checks with no history are assumed to fit.
+                if budget and \
+                        times.get(c, 0) > budget - (time.monotonic() - start):
+                    skipped.append(c)
+                    continue
+
+            sby_file = (sentinel_dir / "checks" / c).with_suffix(".sby")
+            # An exception would otherwise end this thread, losing the check
+            # (and the rest of the queue once every thread is gone).
+            try:
+                ok = not run_sby_cached(sentinel_dir, root, sby_file,
+                                        cache_dir)
+            except Exception as e:
+                print(f"{c}: {e!r}")
+                ok = False
+            if not ok:
+                with lock:
+                    failed.append(c)
+
+    threads = [threading.Thread(target=worker) for _ in range(jobs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if skipped:
+        print(f"Skipped (over time budget): {', '.join(skipped)}")
+    # Left over only if every thread died, but don't report success then.
+    if queue:
+        print(f"Not run: {', '.join(queue)}")
+    if failed or queue:
+        return TaskFailed(f"Failed: {', '.join(failed + queue)}")
+
+
+@task_params([{"name": "jobs", "short": "j", "type": int,
+               "default": os.cpu_count(),
+               "help": "number of checks to run at once"},
+              {"name": "budget", "short": "b", "type": float, "default": 0,
+               "help": "don't start checks that are expected to finish "
+                       "after this many seconds (0 for no limit)"}])
+def task_rvformal_all(jobs, budget):
+    "run all RISC-V Formal tests, longest first based on previous runtimes"
+    formal_tests = Path("./tests/formal/")
+    sentinel_dir = formal_tests / "riscv-formal" / "cores" / "sentinel"
+
+    return {
+        "actions": [(run_sby_all, (sentinel_dir, Path("."),
+                                   formal_tests / "cache", jobs, budget))],
+        "task_dep": ["run_sby:setup"],
+        "uptodate": [False],
+        "verbosity": 2,
+    }
+
+
 # Customize the status task(s) to print all output on a single line.
 # Think like autoconf scripts "checking for foo... yes"!
 def echo_sby_status(checks_dir, c):
@@ -652,3 +952,68 @@ def task__replace_rust_firmware():
         "setup": ["_make_rand_firmware"],
         "file_dep": rs_files + [rand_asc]
     }
+
+
+# Microcode development
+def save_ucode_layout(layout):
+    return {"ucode_layout": layout}
+
+
+# The placeholder bitstream only needs to be rebuilt if the microcode ROM's
+# size or field layout changes, not whenever the microcode changes: the
+# gateware decodes each field from where microcode.asm puts it, so a field
+# that moves or an enum that's renumbered needs new gateware, even if the
+# ROM stays the same width.
+def ucode_layout_unchanged(task, values):
+    from sentinel.ucoderom import UCodeROM
+
+    rom = UCodeROM()
+    space = next(iter(rom.m5meta.spaces.values()))
+    # Lists and dicts, so it compares equal after a JSON round trip.
+    layout = {
+        "depth": rom.depth,
+        "width": rom.width,
+        "fields": [[name, f.origin, f.width, f.enum]
+                   for name, f in space.fields.items()],
+    }
+    task.value_savers.append(partial(save_ucode_layout, layout))
+    return values.get("ucode_layout") == layout
+
+
+@task_params([{"name": "platform", "short": "p",
+               "default": "icestick",
+               "help": "platform to build baseline gateware"}])
+def task__make_placeholder_ucode(platform):
+    "create a baseline gateware for microcode development"
+    pyfiles = [s for s in Path("./src/sentinel").glob("*.py")] + \
+              [Path("./examples/attosoc.py")]
+    build_dir = Path("./build-ucode")
+    rand_ucode_hex = build_dir / "rand_ucode.hex"
+    rand_asc = build_dir / "rand.asc"
+
+    return {
+        "actions": ["pdm demo -b build-ucode -u -y rand_ucode -p {platform}"],
+        "targets": [rand_ucode_hex, rand_asc],
+        "file_dep": pyfiles,
+        "uptodate": [partial(last_platform, platform=platform),
+                     ucode_layout_unchanged],
+    }
+
+
+def task_replace_ucode():
+    "assemble microcode and replace it inside baseline gateware"
+    build_dir = Path("./build-ucode")
+    rand_asc = build_dir / "rand.asc"
+    rand_ucode_hex = build_dir / "rand_ucode.hex"
+    ucode_hex = build_dir / "ucode.hex"
+    top_asc = build_dir / "top.asc"
+    top_bin = build_dir / "top.bin"
+
+    return {
+        "actions": ["pdm demo -b build-ucode -n -y ucode",
+                    f"icebram {rand_ucode_hex} {ucode_hex} < {rand_asc} > {top_asc}",  # noqa: E501
+                    f"icepack {top_asc} {top_bin}"],
+        "targets": [top_bin],
+        "setup": ["_make_placeholder_ucode"],
+        "file_dep": [Path("./src/sentinel/microcode.asm"), rand_asc]
+    }
@@ -12,7 +12,7 @@ from enum import auto
 
 from bronzebeard.asm import assemble
 from elftools.elf.elffile import ELFFile
-from amaranth import Module, Signal, Cat, C
+from amaranth import Module, Signal, Cat, C, Mux
 from amaranth_soc import wishbone
 from amaranth_soc import csr
 from amaranth_soc.csr.wishbone import WishboneCSRBridge
@@ -20,17 +20,49 @@ from amaranth_soc.memory import MemoryMap
 from amaranth.lib.wiring import In, Out, Component, Elaboratable, connect, \
     Signature, flipped
 from amaranth.lib.memory import Memory
+from amaranth.lib.fifo import SyncFIFOBuffered
 from amaranth.build import ResourceError, Resource, Pins
+from amaranth.utils import exact_log2
 from amaranth_boards import icestick, ice40_hx8k_b_evn
 from tabulate import tabulate
 
+from sentinel.icache import ICache
 from sentinel.top import Top
-
-
+from sentinel.trace import PAYLOAD_BITS, DELTA_BITS, DELTA_MAX
+
+
+# With zero_ws, the block RAM's read port is fed from Top's fetch_adr_next
+# (Top(early_fetch_adr=True)) rather than the bus, and reads are ACKed in the
+# same cycle they're requested if the RAM already holds the data from the
+# previous cycle. This is always the case for insn fetches. Other reads use
+# the bus address and take one wait state, and writes are always ACKed
+# immediately.
+#
+# With burst, the read port instead holds the word after the last insn fetch
+# (Top(wb_burst=True)), and INCR_BURST reads of that word are ACKed from it in
+# the same cycle they're requested. Other reads, including INCR_BURST reads of
+# any other address, take one wait state, after which the read port goes back
+# to the prefetched word. Both INCR_BURST and END_OF_BURST reads (but not
+# CLASSIC ones) prefetch the word after them. Top labels its fetches this way
+# across bus cycles: INCR_BURST when the PC has only been incremented since
+# the last fetch, END_OF_BURST on the first fetch after a jump, and CLASSIC
+# for data accesses. Since the address is checked, a master using CTI the
+# usual way (bursts within one bus cycle, ended by END_OF_BURST) also works,
+# just without the prefetch on the first beat.
+#
+# With harvard, a second bus, ibus, has its own read port for
+# Top(harvard=True)'s insn fetches, so fetches and data accesses don't wait on
+# each other. ibus is read-only, and only decodes RAM.
 class WBMemory(Component):
-    def __init__(self, *, sim=False, num_bytes=0x400):
+    def __init__(self, *, sim=False, num_bytes=0x400, zero_ws=False,
+                 burst=False, harvard=False):
+        if zero_ws + burst + harvard > 1:
+            raise ValueError("only one of zero_ws, burst, and harvard can be "
+                             "used")
+
+        features = {"cti", "bte"} if burst else set()
         bus_signature = wishbone.Signature(addr_width=23, data_width=32,
-                                           granularity=8)
+                                           granularity=8, features=features)
         sig = {
             "bus": In(bus_signature)
         }
@@ -39,9 +71,17 @@ class WBMemory(Component):
             sig["ctrl"] = Out(Signature({
                 "force_ws": Out(1)  # noqa: F821
             }))
+        if zero_ws:
+            sig["adr_next"] = In(23)
+        if harvard:
+            sig["ibus"] = In(wishbone.Signature(addr_width=23, data_width=32,
+                                                granularity=8))
 
         self.sim = sim
         self.num_bytes = num_bytes
+        self.zero_ws = zero_ws
+        self.burst = burst
+        self.harvard = harvard
         self._mem_set = False
 
         super().__init__(sig)
@@ -78,6 +118,80 @@ class WBMemory(Component):
         with m.If(self.bus.stb & self.bus.cyc & self.bus.we):
             m.d.comb += w_port.en.eq(self.bus.sel)
 
+        if self.harvard:
+            i_port = self.mem.read_port()
+
+            m.d.comb += [
+                i_port.addr.eq(self.ibus.adr),
+                self.ibus.dat_r.eq(i_port.data),
+                i_port.en.eq(self.ibus.stb & self.ibus.cyc),
+            ]
+
+            i_ack_cond = self.ibus.stb & self.ibus.cyc & ~self.ibus.ack
+            if self.sim:
+                i_ack_cond &= ~self.ctrl.force_ws
+            m.d.sync += self.ibus.ack.eq(i_ack_cond)
+
+        if self.zero_ws:
+            # Address of the data on the read port, if any.
+            r_adr = Signal.like(self.bus.adr)
+            r_valid = Signal()
+            hit = Signal()
+
+            m.d.sync += r_valid.eq(1)
+            m.d.comb += [
+                hit.eq(r_valid & (r_adr == self.bus.adr)),
+                r_port.en.eq(1),
+            ]
+            # On a miss, read the bus address instead; it'll hit next cycle.
+            with m.If(self.bus.stb & self.bus.cyc & ~self.bus.we & ~hit):
+                m.d.comb += r_port.addr.eq(self.bus.adr)
+            with m.Else():
+                m.d.comb += r_port.addr.eq(self.adr_next)
+            m.d.sync += r_adr.eq(r_port.addr)
+
+            ack = self.bus.stb & self.bus.cyc & (self.bus.we | hit)
+            if self.sim:
+                ack &= ~self.ctrl.force_ws
+            m.d.comb += self.bus.ack.eq(ack)
+
+            return m
+
+        if self.burst:
+            # Word after the last fetch, and whether the read port holds it.
+            pf_adr = Signal.like(self.bus.adr)
+            pf_valid = Signal()
+            # ACK for everything except burst fetches.
+            slow_ack = Signal()
+
+            read = self.bus.stb & self.bus.cyc & ~self.bus.we
+            incr = self.bus.cti == wishbone.CycleType.INCR_BURST
+            fetch = (incr |
+                     (self.bus.cti == wishbone.CycleType.END_OF_BURST))
+            # An INCR_BURST read of the prefetched word.
+            hit = read & incr & pf_valid & (self.bus.adr == pf_adr)
+
+            m.d.comb += r_port.en.eq(1)
+            with m.If(read & ~hit & ~slow_ack):
+                m.d.comb += r_port.addr.eq(self.bus.adr)
+            with m.Elif(read & fetch & self.bus.ack):
+                m.d.comb += r_port.addr.eq(self.bus.adr + 1)
+                m.d.sync += pf_adr.eq(self.bus.adr + 1)
+            with m.Else():
+                m.d.comb += r_port.addr.eq(pf_adr)
+            m.d.sync += pf_valid.eq(~(read & ~hit & ~slow_ack))
+
+            slow_ack_cond = self.bus.stb & self.bus.cyc & ~hit & ~slow_ack
+            fast_ack = hit
+            if self.sim:
+                slow_ack_cond &= ~self.ctrl.force_ws
+                fast_ack &= ~self.ctrl.force_ws
+
+            m.d.sync += slow_ack.eq(slow_ack_cond)
+            m.d.comb += self.bus.ack.eq(slow_ack | fast_ack)
+
+            return m
+
         if self.sim:
             ack_cond = self.bus.stb & self.bus.cyc & ~self.bus.ack & \
                       ~self.ctrl.force_ws
@@ -187,6 +301,66 @@ class RWStrobe(csr.FieldAction):
         return m
 
 
+# csr.Builder's addr_width counts data_width-wide words, but its offsets are
+# in bytes. Peripherals give their register map's size in bytes too, so they
+# have the same layout on 8- and 32-bit CSR buses.
+def csr_addr_width(byte_addr_width, data_width):
+    return byte_addr_width - exact_log2(data_width // 8)
+
+
+# Bridges Wishbone to a 32-bit CSR bus (AttoSoC(csr_data_width=32)) in a
+# single beat, instead of WishboneCSRBridge's one beat per CSR bus word. An
+# access takes one wait state, like the WB peripherals. (WishboneCSRBridge
+# can't be used here at all; its bus would have the CSR bus' 32-bit
+# granularity, which a byte-granular decoder won't take.)
+#
+# SEL is ignored, so a byte or halfword store writes the whole register,
+# with whatever is on the other byte lanes.
+class WBCSRBridge32(Component):
+    def __init__(self, csr_bus):
+        if csr_bus.data_width != 32:
+            raise ValueError("CSR bus must be 32 bits wide, not "
+                             f"{csr_bus.data_width}")
+
+        self.csr_bus = csr_bus
+
+        super().__init__({
+            "wb_bus": In(wishbone.Signature(addr_width=csr_bus.addr_width,
+                                            data_width=32, granularity=8)),
+        })
+
+        # A 32-bit memory map can't be a window in a byte-granular one, so
+        # list the CSR bus' registers at their byte addresses instead.
+        self.wb_bus.memory_map = MemoryMap(addr_width=csr_bus.addr_width + 2,
+                                           data_width=8)
+        for res in csr_bus.memory_map.all_resources():
+            self.wb_bus.memory_map.add_resource(
+                res.resource, name=tuple(n for name in res.path for n in name),
+                size=(res.end - res.start) * 4, addr=res.start * 4)
+
+    def elaborate(self, plat):
+        m = Module()
+
+        # The CSR bus' read data is valid the cycle after r_stb, which is
+        # when ACK is asserted; ADR is held until then.
+        m.d.comb += [
+            self.csr_bus.addr.eq(self.wb_bus.adr),
+            self.csr_bus.w_data.eq(self.wb_bus.dat_w),
+            self.wb_bus.dat_r.eq(self.csr_bus.r_data),
+        ]
+
+        with m.If(self.wb_bus.stb & self.wb_bus.cyc & ~self.wb_bus.ack):
+            m.d.comb += [
+                self.csr_bus.r_stb.eq(~self.wb_bus.we),
+                self.csr_bus.w_stb.eq(self.wb_bus.we),
+            ]
+            m.d.sync += self.wb_bus.ack.eq(1)
+        with m.Else():
+            m.d.sync += self.wb_bus.ack.eq(0)
+
+        return m
+
+
 class CSRLeds(Component):
     class Leds(csr.Register, access=csr.Element.Access.W):
         leds: csr.Field(csr.action.W, 8)
@@ -197,12 +371,13 @@ class CSRLeds(Component):
     class OE(csr.Register, access=csr.Element.Access.W):
         oe: csr.Field(csr.action.W, 8)
 
-    def __init__(self):
+    def __init__(self, *, data_width=8):
         self.leds_reg = self.Leds()
         self.inout_reg = self.InOut()
         self.oe_reg = self.OE()
 
-        builder = csr.Builder(addr_width=4, data_width=8, name="gpio")
+        builder = csr.Builder(addr_width=csr_addr_width(4, data_width),
+                              data_width=data_width, name="gpio")
         builder.add("leds", self.leds_reg)
         builder.add("inout", self.inout_reg, offset=4)
         builder.add("oe", self.oe_reg, offset=8)
@@ -289,10 +464,11 @@ class CSRTimer(Component):
     class IRQ(csr.Register, access=csr.Element.Access.R):
         irq: csr.Field(csr.action.R, 1)
 
-    def __init__(self):
+    def __init__(self, *, data_width=8):
         self.irq_reg = self.IRQ()
 
-        builder = csr.Builder(addr_width=3, data_width=8, name="timer")
+        builder = csr.Builder(addr_width=csr_addr_width(3, data_width),
+                              data_width=data_width, name="timer")
         builder.add("irq", self.irq_reg)
 
         mem_map = builder.as_memory_map()
@@ -334,13 +510,15 @@ class UART(Elaboratable):
     ----------
     divisor : int
         Set to ``round(clk-rate / baud-rate)``.
-        E.g. ``12e6 / 115200`` = ``104``.
+        E.g. ``12e6 / 115200`` = ``104``. This is the reset value of the
+        ``divisor`` signal, which can be driven to change it at runtime, and
+        must also be at least 4.
     """
     def __init__(self, divisor, data_bits=8):
         assert divisor >= 4
 
         self.data_bits = data_bits
-        self.divisor = divisor
+        self.divisor = Signal(16, init=divisor)
 
         self.tx_o = Signal()
         self.rx_i = Signal()
@@ -358,7 +536,7 @@ class UART(Elaboratable):
     def elaborate(self, platform):
         m = Module()
 
-        tx_phase = Signal(range(self.divisor))
+        tx_phase = Signal(16)
         tx_shreg = Signal(1 + self.data_bits + 1, reset=-1)
         tx_count = Signal(range(len(tx_shreg) + 1))
 
@@ -381,7 +559,7 @@ class UART(Elaboratable):
                     tx_phase.eq(self.divisor - 1),
                 ]
 
-        rx_phase = Signal(range(self.divisor))
+        rx_phase = Signal(16)
         rx_shreg = Signal(1 + self.data_bits + 1, reset=-1)
         rx_count = Signal(range(len(rx_shreg) + 1))
 
@@ -394,7 +572,7 @@ class UART(Elaboratable):
                         self.rx_rdy.eq(0),
                         self.rx_ovf.eq(0),
                         rx_count.eq(len(rx_shreg)),
-                        rx_phase.eq(self.divisor // 2),
+                        rx_phase.eq(self.divisor >> 1),
                     ]
                 with m.Else():
                     m.d.sync += self.rx_ovf.eq(1)
@@ -415,8 +593,167 @@ class UART(Elaboratable):
         return m
 
 
+# UART with RX and TX FIFOs, so firmware can move several bytes per
+# interrupt instead of one. Shared by WBSerial and CSRSerial, which map the
+# registers onto their buses.
+class BufferedUART(Elaboratable):
+    """
+    Parameters
+    ----------
+    divisor : int
+        Reset value of the ``divisor`` register; see UART.
+    depth : int
+        Entries in each of the RX and TX FIFOs, up to 255.
+    reset_irq : bool
+        Whether the TX interrupt is pending out of reset.
+
+    Registers (all 8-bit except ``divisor``):
+
+    * ``rxtx``: reading pops the RX FIFO; writing pushes to the TX FIFO, and
+      is dropped if it's full.
+    * ``irq`` (R/O): bit 0 (RX) is set while the RX FIFO holds at least
+      ``rx_thresh`` bytes, or has held some for ``timeout`` character times
+      without being read or receiving more. Bit 1 (TX) is set when the TX
+      FIFO drains to ``tx_thresh`` bytes. Bit 2 is set when a byte is
+      received while the RX FIFO is full, and dropped. Reading clears bits 1
+      and 2.
+    * ``rx_level``, ``tx_level`` (R/O): bytes in each FIFO.
+    * ``rx_thresh``: 1 out of reset. 0 disables the RX level interrupt.
+    * ``tx_thresh``: 0 out of reset.
+    * ``timeout``: 4 out of reset. 0 disables the RX timeout.
+    * ``divisor`` (16-bit): see UART.
+
+    ``dreq`` paces DMAEngine transfers: bit 0 is set while the TX FIFO has
+    room, and bit 1 while the RX FIFO holds data.
+    """
+    def __init__(self, *, divisor, depth=16, reset_irq=False):
+        assert 1 <= depth <= 255
+
+        self.depth = depth
+        self.reset_irq = reset_irq
+        self.uart = UART(divisor=divisor)
+
+        self.tx_o = Signal()
+        self.rx_i = Signal()
+        self.irq = Signal()
+        self.dreq = Signal(2)
+
+        self.rx_data = Signal(8)
+        self.rx_r_stb = Signal()
+        self.tx_w_stb = Signal()
+        self.irq_status = Signal(3)
+        self.irq_r_stb = Signal()
+        self.rx_level = Signal(8)
+        self.tx_level = Signal(8)
+        self.rx_thresh = Signal(8, init=1)
+        self.rx_thresh_w_stb = Signal()
+        self.tx_thresh = Signal(8)
+        self.tx_thresh_w_stb = Signal()
+        self.timeout = Signal(8, init=4)
+        self.timeout_w_stb = Signal()
+        self.divisor = Signal(16, init=divisor)
+        self.divisor_w_stb = Signal()
+        # Shared by all the writable registers.
+        self.w_data = Signal(16)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.uart = uart = self.uart
+        m.submodules.rx_fifo = rx_fifo = SyncFIFOBuffered(width=8,
+                                                          depth=self.depth)
+        m.submodules.tx_fifo = tx_fifo = SyncFIFOBuffered(width=8,
+                                                          depth=self.depth)
+
+        m.d.comb += [
+            self.tx_o.eq(uart.tx_o),
+            uart.rx_i.eq(self.rx_i),
+            uart.divisor.eq(self.divisor),
+
+            tx_fifo.w_data.eq(self.w_data),
+            tx_fifo.w_en.eq(self.tx_w_stb),
+            uart.tx_data.eq(tx_fifo.r_data),
+            uart.tx_rdy.eq(tx_fifo.r_rdy),
+            tx_fifo.r_en.eq(uart.tx_ack),
+
+            # Move received bytes straight into the FIFO.
+            rx_fifo.w_data.eq(uart.rx_data),
+            rx_fifo.w_en.eq(uart.rx_rdy),
+            uart.rx_ack.eq(uart.rx_rdy),
+            self.rx_data.eq(rx_fifo.r_data),
+            rx_fifo.r_en.eq(self.rx_r_stb),
+
+            self.rx_level.eq(rx_fifo.level),
+            self.tx_level.eq(tx_fifo.level),
+            self.dreq.eq(Cat(tx_fifo.w_rdy, rx_fifo.r_rdy)),
+        ]
+
+        # Character times (10 bits) the RX FIFO has been idle with data in
+        # it, counted in bit times.
+        idle_phase = Signal(16)
+        idle_bits = Signal(12)
+        timed_out = Signal()
+
+        # With reset_irq, tx_low_prev having a reset of 0 makes the TX
+        # interrupt pending at reset, as the FIFO starts empty.
+        tx_low = tx_fifo.level <= self.tx_thresh
+        tx_low_prev = Signal(init=not self.reset_irq)
+        tx_irq = Signal()
+        ovf_irq = Signal()
+        rx_irq = (((self.rx_thresh != 0) &
+                   (rx_fifo.level >= self.rx_thresh)) | timed_out)
+
+        m.d.comb += [
+            self.irq_status.eq(Cat(rx_irq, tx_irq, ovf_irq)),
+            self.irq.eq(self.irq_status != 0),
+        ]
+
+        m.d.sync += tx_low_prev.eq(tx_low)
+
+        with m.If(rx_fifo.w_en | self.rx_r_stb | ~rx_fifo.r_rdy):
+            m.d.sync += [
+                idle_phase.eq(0),
+                idle_bits.eq(0),
+                timed_out.eq(0),
+            ]
+        with m.Elif(~timed_out & (self.timeout != 0)):
+            m.d.sync += idle_phase.eq(idle_phase + 1)
+            with m.If(idle_phase == self.divisor - 1):
+                m.d.sync += [
+                    idle_phase.eq(0),
+                    idle_bits.eq(idle_bits + 1),
+                ]
+                with m.If(idle_bits == self.timeout * 10 - 1):
+                    m.d.sync += timed_out.eq(1)
+
+        with m.If(self.irq_r_stb):
+            m.d.sync += [
+                tx_irq.eq(0),
+                ovf_irq.eq(0),
+            ]
+
+        # Don't accidentally miss an IRQ
+        with m.If(tx_low & ~tx_low_prev):
+            m.d.sync += tx_irq.eq(1)
+        with m.If(rx_fifo.w_en & ~rx_fifo.w_rdy):
+            m.d.sync += ovf_irq.eq(1)
+
+        with m.If(self.rx_thresh_w_stb):
+            m.d.sync += self.rx_thresh.eq(self.w_data)
+        with m.If(self.tx_thresh_w_stb):
+            m.d.sync += self.tx_thresh.eq(self.w_data)
+        with m.If(self.timeout_w_stb):
+            m.d.sync += self.timeout.eq(self.w_data)
+        with m.If(self.divisor_w_stb):
+            m.d.sync += self.divisor.eq(self.w_data)
+
+        return m
+
+
+# Registers are at consecutive words, in the order listed in BufferedUART,
+# with divisor split into low and high bytes.
 class WBSerial(Component):
-    def __init__(self):
+    def __init__(self, *, divisor=12000000 // 9600, depth=16):
         bus_signature = wishbone.Signature(addr_width=30, data_width=8,
                                            granularity=8)
 
@@ -425,67 +762,76 @@ class WBSerial(Component):
             "rx": In(1),
             "tx": Out(1),
             "irq": Out(1),
+            "dreq": Out(2),
         })
         self.bus.memory_map = MemoryMap(addr_width=30, data_width=8,
                                         name="serial")
-        self.bus.memory_map.add_resource(Component({}), name=("rxtx",),
-                                         size=1)
-        self.bus.memory_map.add_resource(Component({}), name=("irq",), size=1)
-        self.serial = UART(divisor=12000000 // 9600)
+        for name in ("rxtx", "irq", "rx_level", "tx_level", "rx_thresh",
+                     "tx_thresh", "timeout", "divisor_lo", "divisor_hi"):
+            self.bus.memory_map.add_resource(Component({}), name=(name,),
+                                             size=1)
+        # The TX interrupt being pending at reset is used to detect WB vs
+        # CSR bus.
+        self.serial = BufferedUART(divisor=divisor, depth=depth,
+                                   reset_irq=True)
 
     def elaborate(self, plat):
         m = Module()
         m.submodules.ser_internal = self.serial
 
-        # rx_rdy_prev having reset of 0 will deliberately will trigger IRQ at
-        # reset. We use this to detect WB vs CSR bus.
-        rx_rdy_irq = Signal()
-        rx_rdy_prev = Signal()
-        tx_ack_irq = Signal()
-        tx_ack_prev = Signal()
-
         m.d.comb += [
-            self.irq.eq(rx_rdy_irq | tx_ack_irq),
+            self.irq.eq(self.serial.irq),
+            self.dreq.eq(self.serial.dreq),
             self.tx.eq(self.serial.tx_o),
-            self.serial.rx_i.eq(self.rx)
-        ]
-
-        m.d.sync += [
-            rx_rdy_prev.eq(self.serial.rx_rdy),
-            tx_ack_prev.eq(self.serial.tx_ack),
+            self.serial.rx_i.eq(self.rx),
+            self.serial.w_data.eq(self.bus.dat_w),
         ]
 
         with m.If(self.bus.stb & self.bus.cyc & self.bus.sel[0] &
-                  ~self.bus.adr[0]):
-            m.d.sync += self.bus.dat_r.eq(self.serial.rx_data)
-            with m.If(~self.bus.we):
-                m.d.comb += self.serial.rx_ack.eq(1)
-
-            with m.If(self.bus.ack & self.bus.we):
-                m.d.comb += [
-                    self.serial.tx_data.eq(self.bus.dat_w),
-                    self.serial.tx_rdy.eq(1)
-                ]
-
-        with m.If(self.bus.stb & self.bus.cyc & self.bus.sel[0] &
-                  self.bus.adr[0] & ~self.bus.we & ~self.bus.ack):
-            m.d.sync += [
-                self.bus.dat_r.eq(Cat(rx_rdy_irq, tx_ack_irq)),
-                rx_rdy_irq.eq(0),
-                tx_ack_irq.eq(0)
-            ]
+                  ~self.bus.ack):
+            with m.Switch(self.bus.adr[0:4]):
+                with m.Case(0):
+                    m.d.sync += self.bus.dat_r.eq(self.serial.rx_data)
+                    m.d.comb += [
+                        self.serial.rx_r_stb.eq(~self.bus.we),
+                        self.serial.tx_w_stb.eq(self.bus.we),
+                    ]
+                with m.Case(1):
+                    m.d.sync += self.bus.dat_r.eq(self.serial.irq_status)
+                    m.d.comb += self.serial.irq_r_stb.eq(~self.bus.we)
+                with m.Case(2):
+                    m.d.sync += self.bus.dat_r.eq(self.serial.rx_level)
+                with m.Case(3):
+                    m.d.sync += self.bus.dat_r.eq(self.serial.tx_level)
+                with m.Case(4):
+                    m.d.sync += self.bus.dat_r.eq(self.serial.rx_thresh)
+                    m.d.comb += self.serial.rx_thresh_w_stb.eq(self.bus.we)
+                with m.Case(5):
+                    m.d.sync += self.bus.dat_r.eq(self.serial.tx_thresh)
+                    m.d.comb += self.serial.tx_thresh_w_stb.eq(self.bus.we)
+                with m.Case(6):
+                    m.d.sync += self.bus.dat_r.eq(self.serial.timeout)
+                    m.d.comb += self.serial.timeout_w_stb.eq(self.bus.we)
+                with m.Case(7):
+                    m.d.sync += self.bus.dat_r.eq(self.serial.divisor[:8])
+                    m.d.comb += [
+                        self.serial.w_data.eq(Cat(self.bus.dat_w,
+                                                  self.serial.divisor[8:])),
+                        self.serial.divisor_w_stb.eq(self.bus.we),
+                    ]
+                with m.Case(8):
+                    m.d.sync += self.bus.dat_r.eq(self.serial.divisor[8:])
+                    m.d.comb += [
+                        self.serial.w_data.eq(Cat(self.serial.divisor[:8],
+                                                  self.bus.dat_w)),
+                        self.serial.divisor_w_stb.eq(self.bus.we),
+                    ]
 
         with m.If(self.bus.stb & self.bus.cyc & ~self.bus.ack):
             m.d.sync += self.bus.ack.eq(1)
         with m.Else():
             m.d.sync += self.bus.ack.eq(0)
 
-        # Don't accidentally miss an IRQ
-        with m.If(self.serial.rx_rdy & ~rx_rdy_prev):
-            m.d.sync += rx_rdy_irq.eq(1)
-        with m.If(self.serial.tx_ack & ~tx_ack_prev):
-            m.d.sync += tx_ack_irq.eq(1)
-
         return m
 
 
@@ -494,15 +840,38 @@ class CSRSerial(Component):
         txrx: csr.Field(RWStrobe, 8)
 
     class IRQ(csr.Register, access=csr.Element.Access.R):
-        irq: csr.Field(csr.action.R, 2)
+        irq: csr.Field(csr.action.R, 3)
 
-    def __init__(self):
+    class Level(csr.Register, access=csr.Element.Access.R):
+        level: csr.Field(csr.action.R, 8)
+
+    class Config(csr.Register, access=csr.Element.Access.RW):
+        config: csr.Field(RWStrobe, 8)
+
+    class Divisor(csr.Register, access=csr.Element.Access.RW):
+        divisor: csr.Field(RWStrobe, 16)
+
+    def __init__(self, *, divisor=12000000 // 9600, depth=16,
+                 data_width=8):
         self.txrx_reg = self.TXRX()
         self.irq_reg = self.IRQ()
-
-        builder = csr.Builder(addr_width=3, data_width=8, name="serial")
+        self.rx_level_reg = self.Level()
+        self.tx_level_reg = self.Level()
+        self.rx_thresh_reg = self.Config()
+        self.tx_thresh_reg = self.Config()
+        self.timeout_reg = self.Config()
+        self.divisor_reg = self.Divisor()
+
+        builder = csr.Builder(addr_width=csr_addr_width(5, data_width),
+                              data_width=data_width, name="serial")
         builder.add("txrx", self.txrx_reg)
         builder.add("irq", self.irq_reg, offset=4)
+        builder.add("rx_level", self.rx_level_reg, offset=8)
+        builder.add("tx_level", self.tx_level_reg, offset=0xC)
+        builder.add("rx_thresh", self.rx_thresh_reg, offset=0x10)
+        builder.add("tx_thresh", self.tx_thresh_reg, offset=0x14)
+        builder.add("timeout", self.timeout_reg, offset=0x18)
+        builder.add("divisor", self.divisor_reg, offset=0x1C)
 
         mem_map = builder.as_memory_map()
         self.bridge = csr.Bridge(mem_map)
@@ -511,11 +880,12 @@ class CSRSerial(Component):
             "bus": Out(self.bridge.bus.signature),
             "rx": In(1),
             "tx": Out(1),
-            "irq": Out(1)
+            "irq": Out(1),
+            "dreq": Out(2),
         }
 
         super().__init__(sig)
-        self.serial = UART(divisor=12000000 // 9600)
+        self.serial = BufferedUART(divisor=divisor, depth=depth)
         self.bus.memory_map = self.bridge.bus.memory_map
 
     def elaborate(self, plat):
@@ -525,46 +895,1378 @@ class CSRSerial(Component):
 
         connect(m, flipped(self.bus), self.bridge.bus)
 
-        # rx_rdy_prev having reset of 1 will suppress IRQ at reset. We use this
-        # to detect WB vs CSR bus.
-        rx_rdy_irq = Signal()
-        rx_rdy_prev = Signal(reset=1)
-        tx_ack_irq = Signal()
-        tx_ack_prev = Signal(reset=1)
-
         m.d.comb += [
-            self.irq.eq(rx_rdy_irq | tx_ack_irq),
+            self.irq.eq(self.serial.irq),
+            self.dreq.eq(self.serial.dreq),
             self.tx.eq(self.serial.tx_o),
-            self.serial.rx_i.eq(self.rx)
+            self.serial.rx_i.eq(self.rx),
+
+            self.txrx_reg.f.txrx.r_data.eq(self.serial.rx_data),
+            self.serial.rx_r_stb.eq(self.txrx_reg.f.txrx.r_stb),
+            self.serial.tx_w_stb.eq(self.txrx_reg.f.txrx.w_stb),
+            self.irq_reg.f.irq.r_data.eq(self.serial.irq_status),
+            self.serial.irq_r_stb.eq(self.irq_reg.f.irq.r_stb),
+            self.rx_level_reg.f.level.r_data.eq(self.serial.rx_level),
+            self.tx_level_reg.f.level.r_data.eq(self.serial.tx_level),
         ]
 
-        m.d.sync += [
-            rx_rdy_prev.eq(self.serial.rx_rdy),
-            tx_ack_prev.eq(self.serial.tx_ack),
+        for reg, value, w_stb in (
+            (self.rx_thresh_reg, self.serial.rx_thresh,
+             self.serial.rx_thresh_w_stb),
+            (self.tx_thresh_reg, self.serial.tx_thresh,
+             self.serial.tx_thresh_w_stb),
+            (self.timeout_reg, self.serial.timeout,
+             self.serial.timeout_w_stb),
+        ):
+            m.d.comb += [
+                reg.f.config.r_data.eq(value),
+                w_stb.eq(reg.f.config.w_stb),
+            ]
+            with m.If(reg.f.config.w_stb):
+                m.d.comb += self.serial.w_data.eq(reg.f.config.w_data)
+
+        m.d.comb += [
+            self.divisor_reg.f.divisor.r_data.eq(self.serial.divisor),
+            self.serial.divisor_w_stb.eq(self.divisor_reg.f.divisor.w_stb),
         ]
+        with m.If(self.divisor_reg.f.divisor.w_stb):
+            m.d.comb += self.serial.w_data.eq(
+                self.divisor_reg.f.divisor.w_data)
+        with m.If(self.txrx_reg.f.txrx.w_stb):
+            m.d.comb += self.serial.w_data.eq(self.txrx_reg.f.txrx.w_data)
+
+        return m
+
+
+# Records fetched PCs, or microcode address changes, into a block RAM ring
+# buffer, so that firmware can dump what the core was doing with real-world
+# interrupt timing. See sentinel.trace for the entry format and a host-side
+# decoder.
+class TraceBuffer(Elaboratable):
+    """
+    Parameters
+    ----------
+    depth : int
+        Number of entries. Must be a power of 2.
+
+    Registers (byte offsets, all 32-bit):
+
+    * 0x0 ``ctrl``: bit 0 enables tracing; writing 1 when it was 0 clears the
+      buffer. Bit 1 traces microcode addresses instead of PCs. Bit 2 waits
+      until the insn at ``trigger`` is fetched before recording.
+    * 0x4 ``status`` (R/O): bit 0 is set while recording, and bit 1 once the
+      buffer has wrapped. Bits 16 and up are the next entry to be written,
+      which is the oldest entry if the buffer has wrapped.
+    * 0x8 ``trigger``: byte address of the trigger insn.
+    * 0xC ``data`` (R/O): the entry at the read index. Reading increments the
+      read index.
+    * 0x10 ``index`` (W/O): sets the read index.
+    """
+    def __init__(self, depth=256):
+        assert depth & (depth - 1) == 0
+
+        self.depth = depth
+
+        self.fetch = Signal()
+        self.pc = Signal(30)
+        self.upc = Signal(PAYLOAD_BITS)
+
+        self.ctrl = Signal(3)
+        self.ctrl_w_data = Signal(3)
+        self.ctrl_w_stb = Signal()
+        self.trigger = Signal(32)
+        self.trigger_w_data = Signal(32)
+        self.trigger_w_stb = Signal()
+        self.status = Signal(32)
+        self.data = Signal(32)
+        self.data_r_stb = Signal()
+        self.index_w_data = Signal(16)
+        self.index_w_stb = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.mem = mem = Memory(shape=32, depth=self.depth, init=[])
+        w_port = mem.write_port()
+        r_port = mem.read_port(transparent_for=(w_port,))
+
+        wr_ptr = Signal(range(self.depth))
+        rd_ptr = Signal(range(self.depth))
+        wrapped = Signal()
+        triggered = Signal()
+        delta = Signal(DELTA_BITS)
+        prev_upc = Signal.like(self.upc)
+
+        en = self.ctrl[0]
+        upc_mode = self.ctrl[1]
+        trig = self.ctrl[2]
+
+        recording = en & (~trig | triggered)
+        # Record the trigger insn itself too.
+        trig_hit = en & trig & self.fetch & (self.pc == self.trigger[2:])
+        event = Mux(upc_mode, self.upc != prev_upc, self.fetch)
+        payload = Mux(upc_mode, self.upc, self.pc[:PAYLOAD_BITS])
 
         m.d.comb += [
-            self.serial.tx_data.eq(self.txrx_reg.f.txrx.w_data),
-            self.txrx_reg.f.txrx.r_data.eq(self.serial.rx_data),
-            self.irq_reg.f.irq.r_data.eq(Cat(rx_rdy_irq, tx_ack_irq))
+            self.status.eq(Cat(recording, wrapped, C(0, 14), wr_ptr)),
+            self.data.eq(r_port.data),
+            r_port.addr.eq(rd_ptr),
+            w_port.addr.eq(wr_ptr),
+            w_port.data.eq(Cat(payload, delta)),
         ]
 
-        with m.If(self.txrx_reg.f.txrx.w_stb):
-            m.d.comb += self.serial.tx_rdy.eq(1)
-        with m.If(self.txrx_reg.f.txrx.r_stb):
-            m.d.comb += self.serial.rx_ack.eq(1)
+        m.d.sync += prev_upc.eq(self.upc)
 
-        with m.If(self.irq_reg.f.irq.r_stb):
+        with m.If(delta != DELTA_MAX):
+            m.d.sync += delta.eq(delta + 1)
+
+        with m.If(trig_hit):
+            m.d.sync += triggered.eq(1)
+
+        with m.If((recording | trig_hit) & event):
+            m.d.comb += w_port.en.eq(1)
             m.d.sync += [
-                rx_rdy_irq.eq(0),
-                tx_ack_irq.eq(0)
+                wr_ptr.eq(wr_ptr + 1),
+                delta.eq(1)
             ]
+            with m.If(wr_ptr == self.depth - 1):
+                m.d.sync += wrapped.eq(1)
 
-        # Don't accidentally miss an IRQ
-        with m.If(self.serial.rx_rdy & ~rx_rdy_prev):
-            m.d.sync += rx_rdy_irq.eq(1)
-        with m.If(self.serial.tx_ack & ~tx_ack_prev):
-            m.d.sync += tx_ack_irq.eq(1)
+        with m.If(self.ctrl_w_stb):
+            m.d.sync += self.ctrl.eq(self.ctrl_w_data)
+            with m.If(self.ctrl_w_data[0] & ~en):
+                m.d.sync += [
+                    wr_ptr.eq(0),
+                    wrapped.eq(0),
+                    triggered.eq(0),
+                    delta.eq(0)
+                ]
+
+        with m.If(self.trigger_w_stb):
+            m.d.sync += self.trigger.eq(self.trigger_w_data)
+
+        with m.If(self.data_r_stb):
+            m.d.sync += rd_ptr.eq(rd_ptr + 1)
+        with m.If(self.index_w_stb):
+            m.d.sync += rd_ptr.eq(self.index_w_data)
+
+        return m
+
+
+class WBTrace(Component):
+    def __init__(self, depth=256):
+        bus_signature = wishbone.Signature(addr_width=23, data_width=32,
+                                           granularity=8)
+
+        super().__init__({
+            "bus": In(bus_signature),
+            "fetch": In(1),
+            "pc": In(30),
+            "upc": In(PAYLOAD_BITS),
+        })
+
+        self.bus.memory_map = MemoryMap(addr_width=25, data_width=8,
+                                        name="trace")
+        for name in ("ctrl", "status", "trigger", "data", "index"):
+            self.bus.memory_map.add_resource(Component({}), name=(name,),
+                                             size=4)
+        self.trace = TraceBuffer(depth)
+
+    def elaborate(self, plat):
+        m = Module()
+        m.submodules.trace_internal = self.trace
+
+        m.d.comb += [
+            self.trace.fetch.eq(self.fetch),
+            self.trace.pc.eq(self.pc),
+            self.trace.upc.eq(self.upc),
+            self.trace.ctrl_w_data.eq(self.bus.dat_w),
+            self.trace.trigger_w_data.eq(self.bus.dat_w),
+            self.trace.index_w_data.eq(self.bus.dat_w),
+        ]
+
+        with m.If(self.bus.stb & self.bus.cyc & ~self.bus.ack):
+            with m.Switch(self.bus.adr[0:3]):
+                with m.Case(0):
+                    m.d.sync += self.bus.dat_r.eq(self.trace.ctrl)
+                    m.d.comb += self.trace.ctrl_w_stb.eq(self.bus.we)
+                with m.Case(1):
+                    m.d.sync += self.bus.dat_r.eq(self.trace.status)
+                with m.Case(2):
+                    m.d.sync += self.bus.dat_r.eq(self.trace.trigger)
+                    m.d.comb += self.trace.trigger_w_stb.eq(self.bus.we)
+                with m.Case(3):
+                    m.d.sync += self.bus.dat_r.eq(self.trace.data)
+                    m.d.comb += self.trace.data_r_stb.eq(~self.bus.we)
+                with m.Case(4):
+                    m.d.comb += self.trace.index_w_stb.eq(self.bus.we)
+
+        with m.If(self.bus.stb & self.bus.cyc & ~self.bus.ack):
+            m.d.sync += self.bus.ack.eq(1)
+        with m.Else():
+            m.d.sync += self.bus.ack.eq(0)
+
+        return m
+
+
+class CSRTrace(Component):
+    class Ctrl(csr.Register, access=csr.Element.Access.RW):
+        ctrl: csr.Field(RWStrobe, 3)
+
+    class Status(csr.Register, access=csr.Element.Access.R):
+        status: csr.Field(csr.action.R, 32)
+
+    class Trigger(csr.Register, access=csr.Element.Access.RW):
+        trigger: csr.Field(RWStrobe, 32)
+
+    class Data(csr.Register, access=csr.Element.Access.R):
+        data: csr.Field(csr.action.R, 32)
+
+    class Index(csr.Register, access=csr.Element.Access.W):
+        index: csr.Field(csr.action.W, 16)
+
+    def __init__(self, depth=256, *, data_width=8):
+        self.ctrl_reg = self.Ctrl()
+        self.status_reg = self.Status()
+        self.trigger_reg = self.Trigger()
+        self.data_reg = self.Data()
+        self.index_reg = self.Index()
+
+        builder = csr.Builder(addr_width=csr_addr_width(5, data_width),
+                              data_width=data_width, name="trace")
+        builder.add("ctrl", self.ctrl_reg)
+        builder.add("status", self.status_reg, offset=4)
+        builder.add("trigger", self.trigger_reg, offset=8)
+        builder.add("data", self.data_reg, offset=0xC)
+        builder.add("index", self.index_reg, offset=0x10)
+
+        mem_map = builder.as_memory_map()
+        self.bridge = csr.Bridge(mem_map)
+
+        sig = {
+            "bus": Out(self.bridge.bus.signature),
+            "fetch": In(1),
+            "pc": In(30),
+            "upc": In(PAYLOAD_BITS),
+        }
+
+        super().__init__(sig)
+        self.trace = TraceBuffer(depth)
+        self.bus.memory_map = self.bridge.bus.memory_map
+
+    def elaborate(self, plat):
+        m = Module()
+        m.submodules.trace_internal = self.trace
+        m.submodules.bridge = self.bridge
+
+        connect(m, flipped(self.bus), self.bridge.bus)
+
+        m.d.comb += [
+            self.trace.fetch.eq(self.fetch),
+            self.trace.pc.eq(self.pc),
+            self.trace.upc.eq(self.upc),
+
+            self.ctrl_reg.f.ctrl.r_data.eq(self.trace.ctrl),
+            self.trace.ctrl_w_data.eq(self.ctrl_reg.f.ctrl.w_data),
+            self.trace.ctrl_w_stb.eq(self.ctrl_reg.f.ctrl.w_stb),
+            self.status_reg.f.status.r_data.eq(self.trace.status),
+            self.trigger_reg.f.trigger.r_data.eq(self.trace.trigger),
+            self.trace.trigger_w_data.eq(self.trigger_reg.f.trigger.w_data),
+            self.trace.trigger_w_stb.eq(self.trigger_reg.f.trigger.w_stb),
+            self.data_reg.f.data.r_data.eq(self.trace.data),
+            self.trace.data_r_stb.eq(self.data_reg.f.data.r_stb),
+            self.trace.index_w_data.eq(self.index_reg.f.index.w_data),
+            self.trace.index_w_stb.eq(self.index_reg.f.index.w_stb),
+        ]
+
+        return m
+
+
+# Copies between memory and peripherals over its own Wishbone initiator, so
+# firmware doesn't pay for a load and a store per word. AttoSoC arbitrates
+# it with the core's bus. Each transfer is a read then a write, holding CYC
+# in between; CYC is dropped after the write, so the core gets a turn.
+class DMAEngine(Component):
+    """
+    Registers (byte offsets, all 32-bit):
+
+    * 0x0 ``src``, 0x4 ``dst``: byte addresses of the next transfer.
+    * 0x8 ``count``: transfers remaining, up to 65535.
+    * 0xC ``ctrl``: writing bit 0 when idle starts; it reads as busy. Bit 1
+      transfers bytes instead of words. Bits 2 and 3 keep ``src`` and
+      ``dst`` fixed, e.g. for a peripheral FIFO. Bit 4 enables the
+      interrupt. Bits 5-6 pace transfers: if 1 or 2, each waits for ``dreq``
+      bit 0 or 1 respectively.
+    * 0x10 ``status`` (R/O): bit 0 is busy, and bit 1 is set when done.
+      Reading clears bit 1.
+
+    Writes to ``src``, ``dst``, and ``count`` while busy are ignored.
+    """
+    def __init__(self, *, features=frozenset()):
+        bus_signature = wishbone.Signature(addr_width=30, data_width=32,
+                                           granularity=8, features=features)
+
+        super().__init__({
+            "bus": Out(bus_signature),
+            "dreq": In(2),
+            "irq": Out(1),
+        })
+
+        self.src = Signal(32)
+        self.dst = Signal(32)
+        self.count = Signal(16)
+        self.ctrl = Signal(7)
+        self.status = Signal(2)
+        self.src_w_stb = Signal()
+        self.dst_w_stb = Signal()
+        self.count_w_stb = Signal()
+        self.ctrl_w_stb = Signal()
+        self.status_r_stb = Signal()
+        # Shared by all the writable registers.
+        self.w_data = Signal(32)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        busy = Signal()
+        done = Signal()
+        data = Signal(32)
+
+        byte = self.ctrl[1]
+        src_fixed = self.ctrl[2]
+        dst_fixed = self.ctrl[3]
+        irq_en = self.ctrl[4]
+        pace = self.ctrl[5:7]
+
+        step = Mux(byte, 1, 4)
+        ready = ((pace == 0) | ((pace == 1) & self.dreq[0]) |
+                 ((pace == 2) & self.dreq[1]))
+
+        m.d.comb += [
+            self.status.eq(Cat(busy, done)),
+            self.irq.eq(done & irq_en),
+        ]
+
+        with m.If(self.status_r_stb):
+            m.d.sync += done.eq(0)
+
+        with m.FSM():
+            with m.State("IDLE"):
+                with m.If(self.src_w_stb):
+                    m.d.sync += self.src.eq(self.w_data)
+                with m.If(self.dst_w_stb):
+                    m.d.sync += self.dst.eq(self.w_data)
+                with m.If(self.count_w_stb):
+                    m.d.sync += self.count.eq(self.w_data)
+                with m.If(self.ctrl_w_stb):
+                    m.d.sync += self.ctrl.eq(self.w_data)
+                    with m.If(self.w_data[0]):
+                        m.d.sync += [
+                            busy.eq(1),
+                            done.eq(0),
+                        ]
+                        m.next = "NEXT"
+
+            with m.State("NEXT"):
+                with m.If(self.count == 0):
+                    m.d.sync += [
+                        busy.eq(0),
+                        done.eq(1),
+                        self.ctrl[0].eq(0),
+                    ]
+                    m.next = "IDLE"
+                with m.Elif(ready):
+                    m.next = "READ"
+
+            with m.State("READ"):
+                m.d.comb += [
+                    self.bus.cyc.eq(1),
+                    self.bus.stb.eq(1),
+                    self.bus.adr.eq(self.src[2:]),
+                    self.bus.sel.eq(Mux(byte, 1 << self.src[:2], 0xf)),
+                ]
+                with m.If(self.bus.ack):
+                    with m.If(byte):
+                        m.d.sync += data.eq(
+                            self.bus.dat_r.word_select(self.src[:2], 8)
+                            .replicate(4))
+                    with m.Else():
+                        m.d.sync += data.eq(self.bus.dat_r)
+                    m.next = "WRITE"
+
+            with m.State("WRITE"):
+                m.d.comb += [
+                    self.bus.cyc.eq(1),
+                    self.bus.stb.eq(1),
+                    self.bus.we.eq(1),
+                    self.bus.adr.eq(self.dst[2:]),
+                    self.bus.sel.eq(Mux(byte, 1 << self.dst[:2], 0xf)),
+                    self.bus.dat_w.eq(data),
+                ]
+                with m.If(self.bus.ack):
+                    m.d.sync += self.count.eq(self.count - 1)
+                    with m.If(~src_fixed):
+                        m.d.sync += self.src.eq(self.src + step)
+                    with m.If(~dst_fixed):
+                        m.d.sync += self.dst.eq(self.dst + step)
+                    m.next = "NEXT"
+
+        return m
+
+
+class WBDMA(Component):
+    def __init__(self, *, features=frozenset()):
+        bus_signature = wishbone.Signature(addr_width=23, data_width=32,
+                                           granularity=8)
+
+        self.dma = DMAEngine(features=features)
+
+        super().__init__({
+            "bus": In(bus_signature),
+            "master": Out(self.dma.bus.signature),
+            "dreq": In(2),
+            "irq": Out(1),
+        })
+
+        self.bus.memory_map = MemoryMap(addr_width=25, data_width=8,
+                                        name="dma")
+        for name in ("src", "dst", "count", "ctrl", "status"):
+            self.bus.memory_map.add_resource(Component({}), name=(name,),
+                                             size=4)
+
+    def elaborate(self, plat):
+        m = Module()
+        m.submodules.dma_internal = self.dma
+
+        connect(m, self.dma.bus, flipped(self.master))
+
+        m.d.comb += [
+            self.dma.dreq.eq(self.dreq),
+            self.irq.eq(self.dma.irq),
+            self.dma.w_data.eq(self.bus.dat_w),
+        ]
+
+        with m.If(self.bus.stb & self.bus.cyc & ~self.bus.ack):
+            with m.Switch(self.bus.adr[0:3]):
+                with m.Case(0):
+                    m.d.sync += self.bus.dat_r.eq(self.dma.src)
+                    m.d.comb += self.dma.src_w_stb.eq(self.bus.we)
+                with m.Case(1):
+                    m.d.sync += self.bus.dat_r.eq(self.dma.dst)
+                    m.d.comb += self.dma.dst_w_stb.eq(self.bus.we)
+                with m.Case(2):
+                    m.d.sync += self.bus.dat_r.eq(self.dma.count)
+                    m.d.comb += self.dma.count_w_stb.eq(self.bus.we)
+                with m.Case(3):
+                    m.d.sync += self.bus.dat_r.eq(self.dma.ctrl)
+                    m.d.comb += self.dma.ctrl_w_stb.eq(self.bus.we)
+                with m.Case(4):
+                    m.d.sync += self.bus.dat_r.eq(self.dma.status)
+                    m.d.comb += self.dma.status_r_stb.eq(~self.bus.we)
+
+        with m.If(self.bus.stb & self.bus.cyc & ~self.bus.ack):
+            m.d.sync += self.bus.ack.eq(1)
+        with m.Else():
+            m.d.sync += self.bus.ack.eq(0)
+
+        return m
+
+
+class CSRDMA(Component):
+    class Addr(csr.Register, access=csr.Element.Access.RW):
+        addr: csr.Field(RWStrobe, 32)
+
+    class Count(csr.Register, access=csr.Element.Access.RW):
+        count: csr.Field(RWStrobe, 16)
+
+    class Ctrl(csr.Register, access=csr.Element.Access.RW):
+        ctrl: csr.Field(RWStrobe, 7)
+
+    class Status(csr.Register, access=csr.Element.Access.R):
+        status: csr.Field(csr.action.R, 2)
+
+    def __init__(self, *, features=frozenset(), data_width=8):
+        self.src_reg = self.Addr()
+        self.dst_reg = self.Addr()
+        self.count_reg = self.Count()
+        self.ctrl_reg = self.Ctrl()
+        self.status_reg = self.Status()
+
+        builder = csr.Builder(addr_width=csr_addr_width(5, data_width),
+                              data_width=data_width, name="dma")
+        builder.add("src", self.src_reg)
+        builder.add("dst", self.dst_reg, offset=4)
+        builder.add("count", self.count_reg, offset=8)
+        builder.add("ctrl", self.ctrl_reg, offset=0xC)
+        builder.add("status", self.status_reg, offset=0x10)
+
+        mem_map = builder.as_memory_map()
+        self.bridge = csr.Bridge(mem_map)
+        self.dma = DMAEngine(features=features)
+
+        sig = {
+            "bus": Out(self.bridge.bus.signature),
+            "master": Out(self.dma.bus.signature),
+            "dreq": In(2),
+            "irq": Out(1),
+        }
+
+        super().__init__(sig)
+        self.bus.memory_map = self.bridge.bus.memory_map
+
+    def elaborate(self, plat):
+        m = Module()
+        m.submodules.dma_internal = self.dma
+        m.submodules.bridge = self.bridge
+
+        connect(m, flipped(self.bus), self.bridge.bus)
+        connect(m, self.dma.bus, flipped(self.master))
+
+        m.d.comb += [
+            self.dma.dreq.eq(self.dreq),
+            self.irq.eq(self.dma.irq),
+            self.status_reg.f.status.r_data.eq(self.dma.status),
+            self.dma.status_r_stb.eq(self.status_reg.f.status.r_stb),
+        ]
+
+        for field, value, w_stb in (
+            (self.src_reg.f.addr, self.dma.src, self.dma.src_w_stb),
+            (self.dst_reg.f.addr, self.dma.dst, self.dma.dst_w_stb),
+            (self.count_reg.f.count, self.dma.count, self.dma.count_w_stb),
+            (self.ctrl_reg.f.ctrl, self.dma.ctrl, self.dma.ctrl_w_stb),
+        ):
+            m.d.comb += [
+                field.r_data.eq(value),
+                w_stb.eq(field.w_stb),
+            ]
+            with m.If(field.w_stb):
+                m.d.comb += self.dma.w_data.eq(field.w_data)
+
+        return m
+
+
+# The RISC-V machine timer, as in a CLINT: a free-running 64-bit mtime,
+# counting clock cycles, and mtimecmp. timer_irq is level-triggered, and
+# pending while mtime >= mtimecmp; firmware clears it by writing a later
+# deadline to mtimecmp. AttoSoC wires it to Top.timer_irq (mip.MTIP), not
+# irq.
+class MTimer(Elaboratable):
+    """
+    Registers (byte offsets, all 32-bit):
+
+    * 0x0 ``mtime``, 0x4 ``mtimeh``: writable, e.g. to synchronise with an
+      RTC. The count carries between them, so read ``mtimeh``, ``mtime``,
+      then ``mtimeh`` again and retry if it changed.
+    * 0x8 ``mtimecmp``, 0xC ``mtimecmph``: all ones out of reset, so the
+      timer doesn't interrupt until it's first set. To avoid a spurious
+      interrupt, write all ones to ``mtimecmp`` before writing ``mtimecmph``
+      and then the low word.
+    """
+    def __init__(self):
+        self.irq = Signal()
+
+        self.mtime = Signal(64)
+        self.mtimecmp = Signal(64, init=-1)
+        self.mtime_lo_w_stb = Signal()
+        self.mtime_hi_w_stb = Signal()
+        self.mtimecmp_lo_w_stb = Signal()
+        self.mtimecmp_hi_w_stb = Signal()
+        # Shared by all the registers.
+        self.w_data = Signal(32)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.d.sync += [
+            self.mtime.eq(self.mtime + 1),
+            self.irq.eq(self.mtime >= self.mtimecmp),
+        ]
+
+        with m.If(self.mtime_lo_w_stb):
+            m.d.sync += self.mtime[:32].eq(self.w_data)
+        with m.If(self.mtime_hi_w_stb):
+            m.d.sync += self.mtime[32:].eq(self.w_data)
+        with m.If(self.mtimecmp_lo_w_stb):
+            m.d.sync += self.mtimecmp[:32].eq(self.w_data)
+        with m.If(self.mtimecmp_hi_w_stb):
+            m.d.sync += self.mtimecmp[32:].eq(self.w_data)
+
+        return m
+
+
+class WBMTimer(Component):
+    def __init__(self):
+        bus_signature = wishbone.Signature(addr_width=23, data_width=32,
+                                           granularity=8)
+
+        super().__init__({
+            "bus": In(bus_signature),
+            "irq": Out(1),
+        })
+
+        self.bus.memory_map = MemoryMap(addr_width=25, data_width=8,
+                                        name="mtimer")
+        for name in ("mtime", "mtimeh", "mtimecmp", "mtimecmph"):
+            self.bus.memory_map.add_resource(Component({}), name=(name,),
+                                             size=4)
+        self.mtimer = MTimer()
+
+    def elaborate(self, plat):
+        m = Module()
+        m.submodules.mtimer_internal = self.mtimer
+
+        m.d.comb += [
+            self.irq.eq(self.mtimer.irq),
+            self.mtimer.w_data.eq(self.bus.dat_w),
+        ]
+
+        with m.If(self.bus.stb & self.bus.cyc & ~self.bus.ack):
+            with m.Switch(self.bus.adr[0:2]):
+                with m.Case(0):
+                    m.d.sync += self.bus.dat_r.eq(self.mtimer.mtime[:32])
+                    m.d.comb += self.mtimer.mtime_lo_w_stb.eq(self.bus.we)
+                with m.Case(1):
+                    m.d.sync += self.bus.dat_r.eq(self.mtimer.mtime[32:])
+                    m.d.comb += self.mtimer.mtime_hi_w_stb.eq(self.bus.we)
+                with m.Case(2):
+                    m.d.sync += self.bus.dat_r.eq(self.mtimer.mtimecmp[:32])
+                    m.d.comb += self.mtimer.mtimecmp_lo_w_stb.eq(
+                        self.bus.we)
+                with m.Case(3):
+                    m.d.sync += self.bus.dat_r.eq(self.mtimer.mtimecmp[32:])
+                    m.d.comb += self.mtimer.mtimecmp_hi_w_stb.eq(
+                        self.bus.we)
+
+        with m.If(self.bus.stb & self.bus.cyc & ~self.bus.ack):
+            m.d.sync += self.bus.ack.eq(1)
+        with m.Else():
+            m.d.sync += self.bus.ack.eq(0)
+
+        return m
+
+
+class CSRMTimer(Component):
+    class Word(csr.Register, access=csr.Element.Access.RW):
+        word: csr.Field(RWStrobe, 32)
+
+    def __init__(self, *, data_width=8):
+        self.mtime_reg = self.Word()
+        self.mtimeh_reg = self.Word()
+        self.mtimecmp_reg = self.Word()
+        self.mtimecmph_reg = self.Word()
+
+        builder = csr.Builder(addr_width=csr_addr_width(4, data_width),
+                              data_width=data_width, name="mtimer")
+        builder.add("mtime", self.mtime_reg)
+        builder.add("mtimeh", self.mtimeh_reg, offset=4)
+        builder.add("mtimecmp", self.mtimecmp_reg, offset=8)
+        builder.add("mtimecmph", self.mtimecmph_reg, offset=0xC)
+
+        mem_map = builder.as_memory_map()
+        self.bridge = csr.Bridge(mem_map)
+
+        sig = {
+            "bus": Out(self.bridge.bus.signature),
+            "irq": Out(1),
+        }
+
+        super().__init__(sig)
+        self.mtimer = MTimer()
+        self.bus.memory_map = self.bridge.bus.memory_map
+
+    def elaborate(self, plat):
+        m = Module()
+        m.submodules.mtimer_internal = self.mtimer
+        m.submodules.bridge = self.bridge
+
+        connect(m, flipped(self.bus), self.bridge.bus)
+
+        m.d.comb += self.irq.eq(self.mtimer.irq)
+
+        for reg, value, w_stb in (
+            (self.mtime_reg, self.mtimer.mtime[:32],
+             self.mtimer.mtime_lo_w_stb),
+            (self.mtimeh_reg, self.mtimer.mtime[32:],
+             self.mtimer.mtime_hi_w_stb),
+            (self.mtimecmp_reg, self.mtimer.mtimecmp[:32],
+             self.mtimer.mtimecmp_lo_w_stb),
+            (self.mtimecmph_reg, self.mtimer.mtimecmp[32:],
+             self.mtimer.mtimecmp_hi_w_stb),
+        ):
+            m.d.comb += [
+                reg.f.word.r_data.eq(value),
+                w_stb.eq(reg.f.word.w_stb),
+            ]
+            with m.If(reg.f.word.w_stb):
+                m.d.comb += self.mtimer.w_data.eq(reg.f.word.w_data)
+
+        return m
+
+
+# A small PLIC-like interrupt controller, so an ISR can find the source to
+# service with one load instead of querying each peripheral. Sources are
+# level-triggered, and numbered from 1; irq (for Top.irq) is raised while any
+# enabled source is pending with a priority above the threshold.
+class IRQController(Elaboratable):
+    """
+    Parameters
+    ----------
+    num_sources : int
+        Interrupt sources, up to 31.
+    priority_bits : int
+        Width of each source's priority register. If 0, every source has
+        priority 1 and there are no priority registers.
+
+    Registers (byte offsets, all 32-bit):
+
+    * 0x0 ``pending`` (R/O): bit ``n - 1`` is set while source ``n`` is
+      asserted and hasn't been claimed.
+    * 0x4 ``enable``: bit ``n - 1`` enables source ``n``. 0 out of reset.
+    * 0x8 ``threshold``: only sources with a priority above this interrupt.
+      0 out of reset.
+    * 0xC ``claim``: reading returns the enabled, pending source with the
+      highest priority (the lowest-numbered of any tied), or 0 if there are
+      none, and marks it claimed. Writing a source's number completes it,
+      and it can pend again.
+    * 0x10 + 4 * (``n`` - 1) ``priority`` (with ``priority_bits``): source
+      ``n``'s priority. 0 never interrupts. 1 out of reset.
+    """
+    def __init__(self, *, num_sources, priority_bits=0):
+        assert 1 <= num_sources <= 31
+
+        self.num_sources = num_sources
+        self.priority_bits = priority_bits
+
+        self.sources = Signal(num_sources)
+        self.irq = Signal()
+
+        self.pending = Signal(num_sources)
+        self.enable = Signal(num_sources)
+        self.enable_w_stb = Signal()
+        self.threshold = Signal(max(priority_bits, 1))
+        self.threshold_w_stb = Signal()
+        self.claim = Signal(range(num_sources + 1))
+        self.claim_r_stb = Signal()
+        self.complete_w_stb = Signal()
+        self.priority = [Signal(max(priority_bits, 1), init=1,
+                                name=f"priority{n + 1}")
+                         for n in range(num_sources)]
+        self.priority_w_stb = Signal(num_sources)
+        # Shared by all the writable registers.
+        self.w_data = Signal(32)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        claimed = Signal(self.num_sources)
+
+        m.d.comb += self.pending.eq(self.sources & ~claimed)
+
+        # Later sources only win with a strictly higher priority, so ties go
+        # to the lowest number.
+        claim = C(0, self.claim.shape())
+        best = self.threshold
+        for n in range(self.num_sources):
+            cand = (self.pending[n] & self.enable[n] &
+                    (self.priority[n] > best))
+            claim = Mux(cand, n + 1, claim)
+            best = Mux(cand, self.priority[n], best)
+
+        m.d.comb += [
+            self.claim.eq(claim),
+            self.irq.eq(self.claim != 0),
+        ]
+
+        for n in range(self.num_sources):
+            with m.If(self.claim_r_stb & (self.claim == n + 1)):
+                m.d.sync += claimed[n].eq(1)
+            with m.If(self.complete_w_stb & (self.w_data == n + 1)):
+                m.d.sync += claimed[n].eq(0)
+
+        with m.If(self.enable_w_stb):
+            m.d.sync += self.enable.eq(self.w_data)
+        with m.If(self.threshold_w_stb):
+            m.d.sync += self.threshold.eq(self.w_data)
+
+        if self.priority_bits:
+            for n, priority in enumerate(self.priority):
+                with m.If(self.priority_w_stb[n]):
+                    m.d.sync += priority.eq(self.w_data)
+
+        return m
+
+
+class WBIRQController(Component):
+    def __init__(self, *, num_sources, priority_bits=0):
+        bus_signature = wishbone.Signature(addr_width=23, data_width=32,
+                                           granularity=8)
+
+        super().__init__({
+            "bus": In(bus_signature),
+            "sources": In(num_sources),
+            "irq": Out(1),
+        })
+
+        self.bus.memory_map = MemoryMap(addr_width=25, data_width=8,
+                                        name="irqc")
+        names = ["pending", "enable", "threshold", "claim"]
+        if priority_bits:
+            names += [f"priority{n + 1}" for n in range(num_sources)]
+        for name in names:
+            self.bus.memory_map.add_resource(Component({}), name=(name,),
+                                             size=4)
+        self.irqc = IRQController(num_sources=num_sources,
+                                  priority_bits=priority_bits)
+
+    def elaborate(self, plat):
+        m = Module()
+        m.submodules.irqc_internal = self.irqc
+
+        m.d.comb += [
+            self.irqc.sources.eq(self.sources),
+            self.irq.eq(self.irqc.irq),
+            self.irqc.w_data.eq(self.bus.dat_w),
+        ]
+
+        with m.If(self.bus.stb & self.bus.cyc & ~self.bus.ack):
+            with m.Switch(self.bus.adr[0:6]):
+                with m.Case(0):
+                    m.d.sync += self.bus.dat_r.eq(self.irqc.pending)
+                with m.Case(1):
+                    m.d.sync += self.bus.dat_r.eq(self.irqc.enable)
+                    m.d.comb += self.irqc.enable_w_stb.eq(self.bus.we)
+                with m.Case(2):
+                    m.d.sync += self.bus.dat_r.eq(self.irqc.threshold)
+                    m.d.comb += self.irqc.threshold_w_stb.eq(self.bus.we)
+                with m.Case(3):
+                    m.d.sync += self.bus.dat_r.eq(self.irqc.claim)
+                    m.d.comb += [
+                        self.irqc.claim_r_stb.eq(~self.bus.we),
+                        self.irqc.complete_w_stb.eq(self.bus.we),
+                    ]
+                if self.irqc.priority_bits:
+                    for n, priority in enumerate(self.irqc.priority):
+                        with m.Case(4 + n):
+                            m.d.sync += self.bus.dat_r.eq(priority)
+                            m.d.comb += self.irqc.priority_w_stb[n].eq(
+                                self.bus.we)
+
+        with m.If(self.bus.stb & self.bus.cyc & ~self.bus.ack):
+            m.d.sync += self.bus.ack.eq(1)
+        with m.Else():
+            m.d.sync += self.bus.ack.eq(0)
+
+        return m
+
+
+class CSRIRQController(Component):
+    class Word(csr.Register, access=csr.Element.Access.RW):
+        word: csr.Field(RWStrobe, 32)
+
+    class Pending(csr.Register, access=csr.Element.Access.R):
+        pending: csr.Field(csr.action.R, 32)
+
+    def __init__(self, *, num_sources, priority_bits=0, data_width=8):
+        self.pending_reg = self.Pending()
+        self.enable_reg = self.Word()
+        self.threshold_reg = self.Word()
+        self.claim_reg = self.Word()
+        self.priority_regs = []
+        if priority_bits:
+            self.priority_regs = [self.Word() for _ in range(num_sources)]
+
+        builder = csr.Builder(addr_width=csr_addr_width(8, data_width),
+                              data_width=data_width, name="irqc")
+        builder.add("pending", self.pending_reg)
+        builder.add("enable", self.enable_reg, offset=4)
+        builder.add("threshold", self.threshold_reg, offset=8)
+        builder.add("claim", self.claim_reg, offset=0xC)
+        for n, reg in enumerate(self.priority_regs):
+            builder.add(f"priority{n + 1}", reg, offset=0x10 + 4 * n)
+
+        mem_map = builder.as_memory_map()
+        self.bridge = csr.Bridge(mem_map)
+
+        sig = {
+            "bus": Out(self.bridge.bus.signature),
+            "sources": In(num_sources),
+            "irq": Out(1),
+        }
+
+        super().__init__(sig)
+        self.irqc = IRQController(num_sources=num_sources,
+                                  priority_bits=priority_bits)
+        self.bus.memory_map = self.bridge.bus.memory_map
+
+    def elaborate(self, plat):
+        m = Module()
+        m.submodules.irqc_internal = self.irqc
+        m.submodules.bridge = self.bridge
+
+        connect(m, flipped(self.bus), self.bridge.bus)
+
+        m.d.comb += [
+            self.irqc.sources.eq(self.sources),
+            self.irq.eq(self.irqc.irq),
+            self.pending_reg.f.pending.r_data.eq(self.irqc.pending),
+            self.claim_reg.f.word.r_data.eq(self.irqc.claim),
+            self.irqc.claim_r_stb.eq(self.claim_reg.f.word.r_stb),
+            self.irqc.complete_w_stb.eq(self.claim_reg.f.word.w_stb),
+        ]
+        with m.If(self.claim_reg.f.word.w_stb):
+            m.d.comb += self.irqc.w_data.eq(self.claim_reg.f.word.w_data)
+
+        regs = [
+            (self.enable_reg, self.irqc.enable, self.irqc.enable_w_stb),
+            (self.threshold_reg, self.irqc.threshold,
+             self.irqc.threshold_w_stb),
+        ]
+        regs += [(reg, priority, self.irqc.priority_w_stb[n])
+                 for n, (reg, priority) in enumerate(zip(self.priority_regs,
+                                                         self.irqc.priority))]
+        for reg, value, w_stb in regs:
+            m.d.comb += [
+                reg.f.word.r_data.eq(value),
+                w_stb.eq(reg.f.word.w_stb),
+            ]
+            with m.If(reg.f.word.w_stb):
+                m.d.comb += self.irqc.w_data.eq(reg.f.word.w_data)
+
+        return m
+
+
+# Where AttoSoC maps WBFlash, regardless of which other peripherals are
+# present, so firmware can be linked for it. This is clear of the Wishbone
+# timer and serial windows, which start at 0x40000000.
+FLASH_ADDR = 0x20000000
+
+
+# Execute-in-place controller for the SPI flash the iCE40 configures itself
+# from, mapped read-only so the core can run firmware too large for block
+# RAM. Writes are ACKed and ignored.
+#
+# CS is left asserted after each read, so the flash keeps streaming from the
+# following address; a read of that address then costs only the clocks for
+# its data. Once a requested word has been read, the next one is prefetched
+# into a one-word buffer, which answers a sequential read with one wait
+# state, like block RAM. Any other read deselects the flash and starts a new
+# command, aborting a prefetch if need be.
+#
+# SCK runs at half the system clock.
+class WBFlash(Component):
+    """
+    Parameters
+    ----------
+    offset : int
+        Flash address at the start of the window. The bitstream usually
+        occupies the start of flash.
+    size : int
+        Bytes of flash mapped, from ``offset``. Must be a power of 2.
+    width : int
+        1 for Fast Read (0x0B) on COPI/CIPO; 4 for Quad I/O Fast Read (0xEB)
+        on all of DQ0-3, which needs the flash's QE bit set. In quad mode,
+        the flash is put into continuous read mode with the first read, so
+        later reads skip the command byte. Since the flash may still be in
+        that mode after a reset, WBFlash starts by clocking 0xFF on all of
+        DQ0-3 to take it out, as spimemio does.
+    dummy_cycles : int
+        Dummy clocks before data (after the mode bits for 0xEB). The default
+        is 8 for 0x0B and 4 for 0xEB, as on Winbond W25Q parts.
+    """
+    FAST_READ = 0x0B
+    QUAD_IO_READ = 0xEB
+    # M5-4 = 0b10 keeps the flash in continuous read mode.
+    CONTINUOUS = 0xA0
+
+    def __init__(self, *, offset=0, size=0x100000, width=1,
+                 dummy_cycles=None):
+        if width not in (1, 4):
+            raise ValueError(f"width must be 1 or 4, not {width}")
+        if size < 4 or size & (size - 1):
+            raise ValueError(f"size must be a power of 2, not {size}")
+        if offset + size > 1 << 24:
+            raise ValueError("flash addresses are 24 bits")
+
+        bus_signature = wishbone.Signature(addr_width=23, data_width=32,
+                                           granularity=8)
+
+        super().__init__({
+            "bus": In(bus_signature),
+            "cs": Out(1),
+            "sck": Out(1),
+            "dq_o": Out(4),
+            # Covers all of DQ0-3. With width=1, only DQ0 (COPI, always an
+            # output) and DQ1 (CIPO) are connected, and dq_oe isn't used.
+            "dq_oe": Out(1),
+            "dq_i": In(4),
+        })
+
+        self.bus.memory_map = MemoryMap(addr_width=25, data_width=8,
+                                        name="flash")
+        self.bus.memory_map.add_resource(self, name=("xip",), size=size)
+
+        self.offset = offset
+        self.size = size
+        self.width = width
+        self.dummy_cycles = dummy_cycles
+
+    def elaborate(self, plat):
+        m = Module()
+
+        w = self.width
+        quad = w == 4
+        if self.dummy_cycles is not None:
+            dummy_cycles = self.dummy_cycles
+        else:
+            dummy_cycles = 4 if quad else 8
+
+        # Flash address of the word being read, or that the flash streams
+        # next while selected.
+        adr = Signal(24)
+        selected = Signal()
+        # The flash is in continuous read mode.
+        xip = Signal()
+        # The word being read is for the pending bus read, not a prefetch.
+        want = Signal()
+        pf_dat = Signal(32)
+        pf_valid = Signal()
+
+        # SCK is low in phase 0 of each clock and high in phase 1; DQ is
+        # sampled at the end of phase 1.
+        phase = Signal()
+        count = Signal(range(max(32, dummy_cycles) + 1), init=2)
+        sr_o = Signal(32)
+        sr_i = Signal(32)
+
+        bus = self.bus
+        req = bus.cyc & bus.stb & ~bus.ack
+        req_adr = (Cat(C(0, 2), bus.adr)[:exact_log2(self.size)] +
+                   self.offset)[:24]
+
+        sr_i_next = Cat(self.dq_i[1] if w == 1 else self.dq_i, sr_i[:-w])
+        # Bytes arrive in address order, MSB first.
+        word = Cat(sr_i_next[24:], sr_i_next[16:24], sr_i_next[8:16],
+                   sr_i_next[:8])
+
+        m.d.comb += [
+            self.cs.eq(selected),
+            self.sck.eq(phase),
+        ]
+        m.d.sync += bus.ack.eq(0)
+
+        def clock():
+            m.d.sync += phase.eq(~phase)
+            with m.If(phase):
+                m.d.sync += count.eq(count - 1)
+            return phase
+
+        def drive(value, *, width=w):
+            m.d.comb += self.dq_oe.eq(1)
+            if width == 4:
+                m.d.comb += self.dq_o.eq(value[-4:])
+            else:
+                # dq_oe drives DQ2-3 (WP# and HOLD#) too when they're
+                # connected, i.e. for the command in quad mode, so keep them
+                # high. With width=1 they aren't connected, and are left to
+                # the board to hold high.
+                m.d.comb += self.dq_o.eq(Cat(value[-1], C(0b111, 3)))
+
+        with m.FSM():
+            with m.State("RESET"):
+                # We may have been reset mid-read, so deselect first.
+                m.d.sync += count.eq(count - 1)
+                with m.If(count == 1):
+                    m.d.sync += [
+                        selected.eq(1),
+                        count.eq(8),
+                    ]
+                    m.next = "EXIT_XIP"
+
+            with m.State("EXIT_XIP"):
+                # 8 clocks of 0xFF: in continuous read mode, the address and
+                # mode bits are all ones, which exits it. Otherwise, it's an
+                # unknown command and ignored.
+                drive(C(0b1111, 4), width=4)
+                with m.If(clock() & (count == 1)):
+                    m.d.sync += selected.eq(0)
+                    m.next = "IDLE"
+
+            with m.State("IDLE"):
+                with m.If(req & bus.we):
+                    m.d.sync += bus.ack.eq(1)
+                with m.Elif(req & pf_valid & (req_adr == (adr - 4)[:24])):
+                    m.d.sync += [
+                        bus.ack.eq(1),
+                        bus.dat_r.eq(pf_dat),
+                        pf_valid.eq(0),
+                    ]
+                with m.Elif(req & selected & (req_adr == adr)):
+                    m.d.sync += [
+                        want.eq(1),
+                        pf_valid.eq(0),
+                        count.eq(32 // w),
+                    ]
+                    m.next = "DATA"
+                with m.Elif(req):
+                    m.d.sync += [
+                        adr.eq(req_adr),
+                        want.eq(1),
+                        selected.eq(0),
+                        pf_valid.eq(0),
+                        count.eq(2),
+                    ]
+                    m.next = "DESELECT"
+                with m.Elif(selected & ~pf_valid):
+                    m.d.sync += [
+                        want.eq(0),
+                        count.eq(32 // w),
+                    ]
+                    m.next = "DATA"
+
+            with m.State("DESELECT"):
+                m.d.sync += count.eq(count - 1)
+                with m.If(count == 1):
+                    m.d.sync += selected.eq(1)
+                    with m.If(xip):
+                        m.d.sync += [
+                            sr_o.eq(Cat(C(0, 8), adr)),
+                            count.eq(24 // w),
+                        ]
+                        m.next = "ADDR"
+                    with m.Else():
+                        cmd = self.QUAD_IO_READ if quad else self.FAST_READ
+                        m.d.sync += [
+                            sr_o.eq(cmd << 24),
+                            count.eq(8),
+                        ]
+                        m.next = "CMD"
+
+            with m.State("CMD"):
+                drive(sr_o, width=1)
+                with m.If(clock()):
+                    m.d.sync += sr_o.eq(sr_o << 1)
+                    with m.If(count == 1):
+                        m.d.sync += [
+                            sr_o.eq(Cat(C(0, 8), adr)),
+                            count.eq(24 // w),
+                        ]
+                        m.next = "ADDR"
+
+            with m.State("ADDR"):
+                drive(sr_o)
+                with m.If(clock()):
+                    m.d.sync += sr_o.eq(sr_o << w)
+                    with m.If(count == 1):
+                        if quad:
+                            m.d.sync += [
+                                sr_o.eq(self.CONTINUOUS << 24),
+                                count.eq(2),
+                                xip.eq(1),
+                            ]
+                            m.next = "MODE"
+                        else:
+                            m.d.sync += count.eq(dummy_cycles)
+                            m.next = "DUMMY"
+
+            if quad:
+                with m.State("MODE"):
+                    drive(sr_o)
+                    with m.If(clock()):
+                        m.d.sync += sr_o.eq(sr_o << w)
+                        with m.If(count == 1):
+                            m.d.sync += count.eq(dummy_cycles)
+                            m.next = "DUMMY"
+
+            with m.State("DUMMY"):
+                with m.If(clock() & (count == 1)):
+                    m.d.sync += count.eq(32 // w)
+                    m.next = "DATA"
+
+            with m.State("DATA"):
+                with m.If(clock()):
+                    m.d.sync += sr_i.eq(sr_i_next)
+                    with m.If(count == 1):
+                        m.d.sync += [
+                            adr.eq(adr + 4),
+                            want.eq(0),
+                            count.eq(32 // w),
+                        ]
+                        with m.If(want):
+                            # Carry on to prefetch the next word.
+                            m.d.sync += [
+                                bus.ack.eq(1),
+                                bus.dat_r.eq(word),
+                            ]
+                        with m.Else():
+                            m.d.sync += [
+                                pf_dat.eq(word),
+                                pf_valid.eq(1),
+                            ]
+                            m.next = "IDLE"
+
+                # A read of the word being prefetched waits for it; anything
+                # else abandons it.
+                with m.If(req & ~want):
+                    with m.If(bus.we):
+                        m.d.sync += bus.ack.eq(1)
+                    with m.Elif(req_adr == adr):
+                        m.d.sync += want.eq(1)
+                    with m.Else():
+                        m.d.sync += [
+                            adr.eq(req_adr),
+                            want.eq(1),
+                            selected.eq(0),
+                            pf_valid.eq(0),
+                            phase.eq(0),
+                            count.eq(2),
+                        ]
+                        m.next = "DESELECT"
+
+        return m
+
+
+# Behavioural model of a SPI NOR flash for simulating WBFlash, supporting
+# Fast Read (0x0B) and Quad I/O Fast Read (0xEB) with continuous read mode,
+# as on Winbond W25Q parts. It samples on rising SCK and changes its outputs
+# right after, which WBFlash doesn't mind. Addresses wrap at num_bytes.
+class SPIFlashModel(Elaboratable):
+    def __init__(self, *, num_bytes=0x10000, fast_read_dummy=8,
+                 quad_dummy=4):
+        self.num_bytes = num_bytes
+        self.fast_read_dummy = fast_read_dummy
+        self.quad_dummy = quad_dummy
+
+        self.cs = Signal()
+        self.sck = Signal()
+        self.dq_i = Signal(4)
+        self.dq_o = Signal(4)
+
+        self.mem = Memory(shape=8, depth=num_bytes, init=[])
+
+    @property
+    def init(self):
+        return self.mem.init
+
+    @init.setter
+    def init(self, data):
+        self.mem.init[:len(data)] = data
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.mem = self.mem
+        r_port = self.mem.read_port(domain="comb")
+
+        adr = Signal(24)
+        quad = Signal()
+        xip = Signal()
+        sr = Signal(24)
+        # Bits received in this phase, or of the current byte sent.
+        count = Signal(5)
+
+        sck_prev = Signal()
+        m.d.sync += sck_prev.eq(self.sck)
+        rise = self.sck & ~sck_prev
+
+        step = Mux(quad, 4, 1)
+        sr_next = Mux(quad, Cat(self.dq_i, sr), Cat(self.dq_i[0], sr))
+
+        m.d.comb += r_port.addr.eq(adr)
+
+        with m.FSM():
+            with m.State("IDLE"):
+                m.d.sync += count.eq(0)
+                with m.If(self.cs):
+                    with m.If(xip):
+                        m.next = "ADDR"
+                    with m.Else():
+                        m.d.sync += quad.eq(0)
+                        m.next = "CMD"
+
+            with m.State("CMD"):
+                with m.If(~self.cs):
+                    m.next = "IDLE"
+                with m.Elif(rise):
+                    m.d.sync += [
+                        sr.eq(sr_next),
+                        count.eq(count + 1),
+                    ]
+                    with m.If(count == 7):
+                        m.d.sync += count.eq(0)
+                        with m.Switch(sr_next[:8]):
+                            with m.Case(WBFlash.FAST_READ):
+                                m.next = "ADDR"
+                            with m.Case(WBFlash.QUAD_IO_READ):
+                                m.d.sync += quad.eq(1)
+                                m.next = "ADDR"
+                            with m.Default():
+                                m.next = "IGNORE"
+
+            with m.State("ADDR"):
+                with m.If(~self.cs):
+                    m.next = "IDLE"
+                with m.Elif(rise):
+                    m.d.sync += [
+                        sr.eq(sr_next),
+                        count.eq(count + step),
+                    ]
+                    with m.If(count + step == 24):
+                        m.d.sync += [
+                            adr.eq(sr_next),
+                            count.eq(0),
+                        ]
+                        with m.If(quad):
+                            m.next = "MODE"
+                        with m.Else():
+                            m.next = "DUMMY"
+
+            with m.State("MODE"):
+                with m.If(~self.cs):
+                    m.next = "IDLE"
+                with m.Elif(rise):
+                    m.d.sync += [
+                        sr.eq(sr_next),
+                        count.eq(count + 4),
+                    ]
+                    with m.If(count == 4):
+                        m.d.sync += [
+                            xip.eq(sr_next[4:6] == 0b10),
+                            count.eq(0),
+                        ]
+                        m.next = "DUMMY"
+
+            with m.State("DUMMY"):
+                dummy = Mux(quad, self.quad_dummy, self.fast_read_dummy)
+                with m.If(~self.cs):
+                    m.next = "IDLE"
+                with m.Elif(rise):
+                    m.d.sync += count.eq(count + 1)
+                    with m.If(count == dummy - 1):
+                        m.d.sync += count.eq(0)
+                        m.next = "DATA"
+
+            with m.State("DATA"):
+                byte = r_port.data
+                with m.If(quad):
+                    m.d.comb += self.dq_o.eq(Mux(count[2], byte[:4],
+                                                 byte[4:]))
+                with m.Else():
+                    m.d.comb += self.dq_o[1].eq(byte.bit_select(~count[:3],
+                                                                1))
+
+                with m.If(~self.cs):
+                    m.next = "IDLE"
+                with m.Elif(rise):
+                    m.d.sync += count.eq(count[:3] + step)
+                    with m.If(count[:3] + step == 8):
+                        m.d.sync += [
+                            adr.eq(adr + 1),
+                            count.eq(0),
+                        ]
+
+            with m.State("IGNORE"):
+                with m.If(~self.cs):
+                    m.next = "IDLE"
 
         return m
 
@@ -579,13 +2281,92 @@ class BusType(enum.Enum):
 class AttoSoC(Elaboratable):
     # CSR is the default because it's what's encouraged. However, the default
     # for the demo is WB because that's what fits on the ICE40HX1K!
-    def __init__(self, *, sim=False, num_bytes=0x400, bus_type=BusType.CSR):
-        self.cpu = Top()
-        self.mem = WBMemory(sim=sim, num_bytes=num_bytes)
+    # With local_irqs, the timer and serial interrupts are additionally
+    # routed to their own local interrupt lines (mcause 16 and 17
+    # respectively), so ISRs don't have to probe each peripheral.
+    # With trace, a trace buffer peripheral (see TraceBuffer) is added after
+    # all the others, even in simulation.
+    # With zero_ws, insn fetches from RAM take no wait states; see WBMemory.
+    # With burst, straight-line insn fetches from RAM use Wishbone
+    # incrementing bursts, and take no wait states.
+    # With harvard, the core fetches insns from RAM over its own bus and
+    # read port, concurrently with data accesses. Only one of zero_ws, burst,
+    # and harvard can be used.
+    # With icache_lines, an ICache of that many icache_line_words-word lines
+    # sits between the core and the interconnect. It can't be used with
+    # zero_ws, burst, or harvard, which assume insns come from block RAM.
+    # With flash_offset, a WBFlash maps SPI flash from that offset at
+    # FLASH_ADDR, using quad I/O if flash_width is 4 and the board has the
+    # pins for it. In simulation, an SPIFlashModel holds flash_rom instead.
+    # harvard can't be used, since ibus only reaches RAM.
+    # With dma, a DMAEngine peripheral is added after the trace buffer, and
+    # shares the bus with the core through a round-robin arbiter. Outside of
+    # simulation its transfers can be paced by the serial FIFOs, and its
+    # interrupt is routed like the others (mcause 18 with local_irqs).
+    # With mtimer, an MTimer peripheral is added after the DMA engine, even in
+    # simulation, and drives the core's machine timer interrupt.
+    # With irq_controller, an IRQController is added after that, and drives
+    # irq instead of ORing the interrupts together. The timer, serial, and
+    # DMA interrupts are its sources 1, 2, and 3; in simulation, the timer
+    # and serial sources are left for the testbench to drive. Firmware that
+    # expects irq to be pending out of reset won't work with it.
+    # irq_priority_bits is IRQController's priority_bits.
+    # csr_data_width is the width of the CSR peripheral bus. With 8, each
+    # access through WishboneCSRBridge takes a CSR bus beat per byte of the
+    # 32-bit Wishbone bus; with 32, WBCSRBridge32 makes it a single beat.
+    # Register addresses are the same either way.
+    def __init__(self, *, sim=False, num_bytes=0x400, bus_type=BusType.CSR,
+                 local_irqs=False, m_extension=False, hw_multiplier=False,
+                 custom_ucode=None, fast_sequencer=False,
+                 ucode_placeholder=False, num_hpm_counters=0, trace=False,
+                 zero_ws=False, burst=False, harvard=False, icache_lines=0,
+                 icache_line_words=4, flash_offset=None, flash_width=4,
+                 dma=False, mtimer=False, irq_controller=False,
+                 irq_priority_bits=0, csr_data_width=8):
+        if csr_data_width not in (8, 32):
+            raise ValueError("csr_data_width must be 8 or 32, not "
+                             f"{csr_data_width}")
+        if icache_lines and (zero_ws or burst or harvard):
+            raise ValueError("icache_lines can't be used with zero_ws, "
+                             "burst, or harvard")
+        if flash_offset is not None and harvard:
+            raise ValueError("flash_offset can't be used with harvard")
+
+        num_local_irqs = 0
+        if local_irqs:
+            num_local_irqs = 3 if dma else 2
+
+        self.cpu = Top(num_local_irqs=num_local_irqs,
+                       m_extension=m_extension, hw_multiplier=hw_multiplier,
+                       custom_ucode=custom_ucode,
+                       fast_sequencer=fast_sequencer,
+                       ucode_placeholder=ucode_placeholder,
+                       num_hpm_counters=num_hpm_counters,
+                       early_fetch_adr=zero_ws, wb_burst=burst,
+                       harvard=harvard, fetch_tag=bool(icache_lines))
+        self.mem = WBMemory(sim=sim, num_bytes=num_bytes, zero_ws=zero_ws,
+                            burst=burst, harvard=harvard)
+        # Peripherals other than memory don't have CTI/BTE, and the decoder
+        # doesn't forward them to those.
+        features = {"cti", "bte"} if burst else set()
         self.decoder = wishbone.Decoder(addr_width=30, data_width=32,
-                                        granularity=8, alignment=25)
+                                        granularity=8, features=features,
+                                        alignment=25)
+        self.icache = None
+        if icache_lines:
+            self.icache = ICache(num_lines=icache_lines,
+                                 line_words=icache_line_words)
+        self.flash = None
+        self.flash_model = None
+        if flash_offset is not None:
+            self.flash = WBFlash(offset=flash_offset, width=flash_width)
+            if sim:
+                self.flash_model = SPIFlashModel(num_bytes=self.flash.size)
+        self._flash_rom = b""
         self.sim = sim
         self.bus_type = bus_type
+        self.local_irqs = local_irqs
+        self.csr_data_width = csr_data_width
 
         match bus_type:
             case BusType.WB:
@@ -595,11 +2376,50 @@ class AttoSoC(Elaboratable):
                     self.timer = WBTimer()
                     self.serial = WBSerial()
             case BusType.CSR:
-                self.leds = CSRLeds()
+                self.leds = CSRLeds(data_width=csr_data_width)
 
                 if not self.sim:
-                    self.timer = CSRTimer()
-                    self.serial = CSRSerial()
+                    self.timer = CSRTimer(data_width=csr_data_width)
+                    self.serial = CSRSerial(data_width=csr_data_width)
+
+        self.trace = None
+        if trace:
+            match bus_type:
+                case BusType.WB:
+                    self.trace = WBTrace()
+                case BusType.CSR:
+                    self.trace = CSRTrace(data_width=csr_data_width)
+
+        self.dma = None
+        self.arbiter = None
+        if dma:
+            match bus_type:
+                case BusType.WB:
+                    self.dma = WBDMA(features=features)
+                case BusType.CSR:
+                    self.dma = CSRDMA(features=features,
+                                      data_width=csr_data_width)
+            self.arbiter = wishbone.Arbiter(addr_width=30, data_width=32,
+                                            granularity=8, features=features)
+
+        self.mtimer = None
+        if mtimer:
+            match bus_type:
+                case BusType.WB:
+                    self.mtimer = WBMTimer()
+                case BusType.CSR:
+                    self.mtimer = CSRMTimer(data_width=csr_data_width)
+
+        self.irq_controller = None
+        if irq_controller:
+            match bus_type:
+                case BusType.WB:
+                    self.irq_controller = WBIRQController(
+                        num_sources=3, priority_bits=irq_priority_bits)
+                case BusType.CSR:
+                    self.irq_controller = CSRIRQController(
+                        num_sources=3, priority_bits=irq_priority_bits,
+                        data_width=csr_data_width)
 
     @property
     def rom(self):
@@ -619,6 +2439,34 @@ class AttoSoC(Elaboratable):
         else:
             self.mem.init = source_or_list
 
+    @property
+    def flash_rom(self):
+        return self._flash_rom
+
+    @flash_rom.setter
+    def flash_rom(self, source_or_list):
+        if isinstance(source_or_list, str):
+            self._flash_rom = bytes(assemble(source_or_list))
+        elif isinstance(source_or_list, (bytes, bytearray)):
+            self._flash_rom = bytes(source_or_list)
+        else:
+            self._flash_rom = b"".join(w.to_bytes(4, byteorder="little")
+                                       for w in source_or_list)
+
+        if self.flash and len(self._flash_rom) > self.flash.size:
+            raise ValueError(f"flash_rom is {len(self._flash_rom):#x} bytes, "
+                             f"but the flash window is {self.flash.size:#x}")
+
+        if self.flash_model:
+            # The model is the size of the window, so it wraps at the same
+            # place the window does.
+            size = self.flash_model.num_bytes
+            start = self.flash.offset % size
+            rom = [0] * start + list(self._flash_rom)
+            if len(rom) > size:
+                rom = rom[size:] + rom[len(rom) - size:size]
+            self.flash_model.init = rom
+
     def elaborate(self, plat):
         m = Module()
 
@@ -650,6 +2498,19 @@ class AttoSoC(Elaboratable):
                 ]
 
         self.decoder.add(flipped(self.mem.bus))
+        if self.mem.zero_ws:
+            m.d.comb += self.mem.adr_next.eq(self.cpu.fetch_adr_next)
+        if self.mem.harvard:
+            # ibus only reaches RAM, which aliases throughout the address
+            # space.
+            m.d.comb += [
+                self.mem.ibus.cyc.eq(self.cpu.ibus.cyc),
+                self.mem.ibus.stb.eq(self.cpu.ibus.stb),
+                self.mem.ibus.adr.eq(self.cpu.ibus.adr),
+                self.mem.ibus.sel.eq(self.cpu.ibus.sel),
+                self.cpu.ibus.dat_r.eq(self.mem.ibus.dat_r),
+                self.cpu.ibus.ack.eq(self.mem.ibus.ack),
+            ]
 
         if self.bus_type == BusType.WB:
             self.decoder.add(flipped(self.leds.bus), sparse=True)
@@ -661,10 +2522,25 @@ class AttoSoC(Elaboratable):
                 m.submodules.serial = self.serial
                 self.decoder.add(flipped(self.serial.bus), sparse=True)
 
+            if self.trace:
+                self.decoder.add(flipped(self.trace.bus))
+
+            if self.dma:
+                self.decoder.add(flipped(self.dma.bus))
+
+            if self.mtimer:
+                self.decoder.add(flipped(self.mtimer.bus))
+
+            if self.irq_controller:
+                self.decoder.add(flipped(self.irq_controller.bus))
+
         elif self.bus_type == BusType.CSR:
             # CSR (has to be done first other mem map "frozen" errors?)
-            periph_decode = csr.Decoder(addr_width=25, data_width=8,
-                                        alignment=23, name="periph")
+            data_width = self.csr_data_width
+            periph_decode = csr.Decoder(
+                addr_width=csr_addr_width(25, data_width),
+                data_width=data_width,
+                alignment=csr_addr_width(23, data_width), name="periph")
             periph_decode.add(self.leds.bus, addr=0)
 
             if not self.sim:
@@ -673,13 +2549,67 @@ class AttoSoC(Elaboratable):
                 m.submodules.timer = self.timer
                 m.submodules.serial = self.serial
 
+            if self.trace:
+                periph_decode.add(self.trace.bus)
+
+            if self.dma:
+                periph_decode.add(self.dma.bus)
+
+            if self.mtimer:
+                periph_decode.add(self.mtimer.bus)
+
+            if self.irq_controller:
+                periph_decode.add(self.irq_controller.bus)
+
             # Connect peripherals to Wishbone
-            periph_wb = WishboneCSRBridge(periph_decode.bus, data_width=32)
+            if data_width == 32:
+                periph_wb = WBCSRBridge32(periph_decode.bus)
+            else:
+                periph_wb = WishboneCSRBridge(periph_decode.bus,
+                                              data_width=32)
             self.decoder.add(flipped(periph_wb.wb_bus))
 
             m.submodules.periph_bus = periph_decode
             m.submodules.periph_wb = periph_wb
 
+        if self.flash:
+            m.submodules.flash = self.flash
+            self.decoder.add(flipped(self.flash.bus), addr=FLASH_ADDR)
+
+            if self.flash_model:
+                m.submodules.flash_model = self.flash_model
+                m.d.comb += [
+                    self.flash_model.cs.eq(self.flash.cs),
+                    self.flash_model.sck.eq(self.flash.sck),
+                    self.flash_model.dq_i.eq(self.flash.dq_o),
+                    self.flash.dq_i.eq(self.flash_model.dq_o),
+                ]
+            elif plat:
+                flash = None
+                if self.flash.width == 4:
+                    try:
+                        flash = plat.request("spi_flash_4x")
+                    except ResourceError:
+                        self.flash.width = 1
+                if flash is None:
+                    flash = plat.request("spi_flash_1x")
+
+                m.d.comb += [
+                    flash.cs.o.eq(self.flash.cs),
+                    flash.clk.o.eq(self.flash.sck),
+                ]
+                if self.flash.width == 4:
+                    m.d.comb += [
+                        flash.dq.o.eq(self.flash.dq_o),
+                        flash.dq.oe.eq(self.flash.dq_oe),
+                        self.flash.dq_i.eq(flash.dq.i),
+                    ]
+                else:
+                    m.d.comb += [
+                        flash.copi.o.eq(self.flash.dq_o[0]),
+                        self.flash.dq_i[1].eq(flash.cipo.i),
+                    ]
+
         if not self.sim:
             if plat:
                 m.d.comb += [
@@ -687,7 +2617,44 @@ class AttoSoC(Elaboratable):
                     ser.tx.o.eq(self.serial.tx)
                 ]
 
-            m.d.comb += self.cpu.irq.eq(self.timer.irq | self.serial.irq)
+            irqs = [self.timer.irq, self.serial.irq]
+            if self.dma:
+                irqs.append(self.dma.irq)
+                m.d.comb += self.dma.dreq.eq(self.serial.dreq)
+
+            if self.irq_controller:
+                m.d.comb += self.irq_controller.sources.eq(Cat(*irqs))
+            else:
+                m.d.comb += self.cpu.irq.eq(Cat(*irqs).any())
+
+            if self.local_irqs:
+                m.d.comb += self.cpu.local_irq.eq(Cat(*irqs))
+        elif self.dma:
+            if self.irq_controller:
+                m.d.comb += self.irq_controller.sources[2].eq(self.dma.irq)
+            else:
+                m.d.comb += self.cpu.irq.eq(self.dma.irq)
+
+            if self.local_irqs:
+                m.d.comb += self.cpu.local_irq[2].eq(self.dma.irq)
+
+        if self.irq_controller:
+            m.submodules.irq_controller = self.irq_controller
+            m.d.comb += self.cpu.irq.eq(self.irq_controller.irq)
+
+        if self.mtimer:
+            m.submodules.mtimer = self.mtimer
+            m.d.comb += self.cpu.timer_irq.eq(self.mtimer.irq)
+
+        if self.trace:
+            m.submodules.trace = self.trace
+            # Tap the core directly; there's nothing to trace on the bus
+            # that identifies microcode or insn boundaries.
+            m.d.comb += [
+                self.trace.fetch.eq(self.cpu.decode.do_decode),
+                self.trace.pc.eq(self.cpu.datapath.pc.dat_r),
+                self.trace.upc.eq(self.cpu.control.sequencer.adr),
+            ]
 
         def destruct_res(res):
             ls = []
@@ -706,7 +2673,24 @@ class AttoSoC(Elaboratable):
                            self.decoder.bus.memory_map.all_resources()),
                        intfmt=("", "#010x", "#010x", ""),
                        headers=["name", "start", "end", "width"]))
-        connect(m, self.cpu.bus, self.decoder.bus)
+        if self.mem.harvard:
+            cpu_bus = self.cpu.dbus
+        elif self.icache:
+            m.submodules.icache = self.icache
+            connect(m, self.cpu.bus, self.icache.cpu)
+            m.d.comb += self.icache.insn_fetch.eq(self.cpu.insn_fetch)
+            cpu_bus = self.icache.mem
+        else:
+            cpu_bus = self.cpu.bus
+
+        if self.dma:
+            m.submodules.dma = self.dma
+            m.submodules.arbiter = self.arbiter
+            self.arbiter.add(cpu_bus)
+            self.arbiter.add(self.dma.master)
+            connect(m, self.arbiter.bus, self.decoder.bus)
+        else:
+            connect(m, cpu_bus, self.decoder.bus)
 
         return m
 
@@ -774,8 +2758,22 @@ def demo(args):
             ret
     """
 
-    asoc = AttoSoC(num_bytes=0x1000, bus_type=bus_type)
-    asoc.rom = rom
+    asoc = AttoSoC(num_bytes=0x1000, bus_type=bus_type, local_irqs=args.l,
+                   fast_sequencer=args.f, ucode_placeholder=args.u,
+                   num_hpm_counters=args.e, trace=args.t, zero_ws=args.z,
+                   burst=args.w, harvard=args.v, icache_lines=args.c,
+                   flash_offset=args.q, dma=args.d, mtimer=args.m,
+                   irq_controller=args.k,
+                   csr_data_width=32 if args.a else 8)
+    if args.q is not None:
+        # Boot straight into the firmware in flash.
+        asoc.flash_rom = rom
+        asoc.rom = f"""
+            lui     t0,{FLASH_ADDR >> 12:#x}
+            jalr    x0,0(t0)
+    """
+    else:
+        asoc.rom = rom
 
     match args.p:
         case "ice40_hx8k_b_evn":
@@ -804,7 +2802,8 @@ def demo(args):
                 Resource("gpio", 1, Pins("4", dir="io", conn=("pmod", 0)))
             ])
 
-    plan = plat.build(asoc, name="rand" if args.r else "top", do_build=False,
+    plan = plat.build(asoc, name="rand" if args.r or args.u else "top",
+                      do_build=False,
                       debug_verilog=True,
                       # Optimize for area, not speed.
                       # https://libera.irclog.whitequark.org/yosys/2023-11-20#1700497858-1700497760;  # noqa: E501
@@ -857,6 +2856,15 @@ def demo(args):
         with open(Path(local_path) / Path(args.x).with_suffix(".hex"), "w") as fp:  # noqa: E501
             fp.writelines(f"{i:08x}\n" for i in asoc.rom)
 
+    if args.q is not None:
+        # Program with e.g. iceprog -o OFFSET.
+        with open(Path(local_path) / "flash.bin", "wb") as fp:
+            fp.write(asoc.flash_rom)
+
+    if args.y:
+        asoc.cpu.control.ucoderom.write_hex(
+            Path(local_path) / Path(args.y).with_suffix(".hex"))
+
 
 def main():
     parser = argparse.ArgumentParser(description="Sentinel AttoSoC Demo generator")  # noqa: E501
@@ -870,6 +2878,48 @@ def main():
     parser.add_argument("-i", help="peripheral interconnect type",
                         choices=("wishbone", "csr"),
                         default="wishbone")
+    parser.add_argument("-l", help="also route timer and serial interrupts "
+                                   "to local interrupt lines",
+                        action="store_true")
+    parser.add_argument("-f", help="use the fmax-oriented microcode "
+                                   "sequencer (larger ROM)",
+                        action="store_true")
+    parser.add_argument("-e", help="number of mhpmcounter3+ performance "
+                                   "event counters (default %(default)s)",
+                        type=int, choices=range(6), default=0,
+                        metavar="COUNTERS")
+    parser.add_argument("-t", help="add a PC/microcode trace buffer "
+                                   "peripheral",
+                        action="store_true")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("-z", help="fetch insns from RAM without wait "
+                                  "states",
+                       action="store_true")
+    group.add_argument("-w", help="fetch straight-line insns from RAM using "
+                                  "Wishbone incrementing bursts",
+                       action="store_true")
+    group.add_argument("-v", help="fetch insns from RAM on a separate bus "
+                                  "(Harvard architecture)",
+                       action="store_true")
+    group.add_argument("-c", help="add an insn cache with this many 4-word "
+                                  "lines",
+                       type=int, default=0, metavar="LINES")
+    parser.add_argument("-q", help="run firmware in place from SPI flash "
+                                   "at this offset (written to flash.bin in "
+                                   "build dir); not with -v",
+                        type=lambda x: int(x, 0), default=None,
+                        metavar="OFFSET")
+    parser.add_argument("-d", help="add a DMA engine peripheral",
+                        action="store_true")
+    parser.add_argument("-m", help="add a machine timer (mtime/mtimecmp) "
+                                   "peripheral",
+                        action="store_true")
+    parser.add_argument("-k", help="add an interrupt controller peripheral "
+                                   "in front of irq",
+                        action="store_true")
+    parser.add_argument("-a", help="use a 32-bit CSR peripheral bus (with "
+                                   "-i csr)",
+                        action="store_true")
     group = parser.add_mutually_exclusive_group()
     # Remote firmware override/random file generation is not supported;
     # Amaranth does not have provisions for supporting adding your own build
@@ -886,6 +2936,13 @@ def main():
                                    "dir (use with {ice,ecp}bram)",
                         metavar="BASENAME",
                         default=None)
+    parser.add_argument("-u", help="fill the microcode ROM with a placeholder "
+                                   "pattern (use with -y)",
+                        action="store_true")
+    parser.add_argument("-y", help="generate a hex file of the microcode ROM "
+                                   "in build dir (use with icebram)",
+                        metavar="BASENAME",
+                        default=None)
     args = parser.parse_args()
     demo(args)
 
@@ -0,0 +1,48 @@
+// Example user microcode for CUSTOM_0 insns, assembled after Sentinel's own
+// microcode when passed as Top(custom_ucode=...).
+//
+// The routine for map slot n (n = funct7[0] * 8 + funct3) is labeled
+// "custom0_<n>". On entry, the PC has already been incremented, RS1 is
+// latched into A and B, and RS2 is on the GP read port. Routines end by
+// putting the result in the ALU output and jumping to fast_epilog, which
+// writes it to RD. All of Sentinel's macros are available.
+
+// andn rd, rs1, rs2 (funct3 = 0, funct7 = 0): rd = rs1 & ~rs2.
+custom0_0:    a_src => neg_one, latch_a => 1, b_src => gp, latch_b => 1, \
+                  READ_RS1;
+              alu_op => sub, b_src => gp, latch_b => 1;
+              a_src => alu_o, latch_a => 1;
+              alu_op => and, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
+
+// brev rd, rs1 (funct3 = 1, funct7 = 0): rd = rs1 with its bits reversed.
+#define BREV_X 0x1
+#define BREV_R 0x2
+#define BREV_CNT 0x3
+#define BREV_BIT 0x6
+
+custom0_1:    alu_op => or;
+              WRITE_SCRATCH(BREV_X), a_src => zero, latch_a => 1;
+              alu_op => and, a_src => thirty_one, latch_a => 1, b_src => one, \
+                  latch_b => 1;
+              WRITE_SCRATCH(BREV_R), alu_op => add;
+              WRITE_SCRATCH(BREV_CNT);
+brev_loop:    READ_SCRATCH(BREV_X);
+              a_src => gp, latch_a => 1, b_src => one, latch_b => 1;
+              alu_op => and;
+              WRITE_SCRATCH(BREV_BIT), alu_op => srl;
+              WRITE_SCRATCH(BREV_X);
+              READ_SCRATCH(BREV_R);
+              a_src => gp, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => add;
+              a_src => alu_o, latch_a => 1, READ_SCRATCH(BREV_BIT);
+              b_src => gp, latch_b => 1;
+              alu_op => or;
+              WRITE_SCRATCH(BREV_R);
+              READ_SCRATCH(BREV_CNT);
+              a_src => gp, latch_a => 1, b_src => one, latch_b => 1;
+              alu_op => sub;
+              WRITE_SCRATCH(BREV_CNT), alu_op => sub;
+              jmp_type => direct, CONDTEST_ALU_NONZERO, target => brev_loop;
+              READ_SCRATCH(BREV_R);
+              a_src => zero, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => add, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
@@ -1,6 +1,6 @@
 from .ucodefields import OpType, ALUIMod, ALUOMod
 
-from amaranth import Elaboratable, Signal, Module
+from amaranth import Elaboratable, Signal, Module, Cat
 from amaranth.lib.wiring import Component, Signature, In, Out
 
 
@@ -57,6 +57,37 @@ class ShiftArithmeticRight(Unit):
         super().__init__(width, lambda a, _: a.as_signed() >> 1)
 
 
+class Multiplier(Elaboratable):
+    """Single-cycle multiplier for the M extension.
+
+    Operands are sign- or zero-extended to width + 1 bits according to
+    signed_a/signed_b, so one signed multiply covers MUL, MULH, MULHSU and
+    MULHU.
+    """
+    def __init__(self, width):
+        self.width = width
+        self.a = Signal(width)
+        self.b = Signal(width)
+        self.signed_a = Signal()
+        self.signed_b = Signal()
+        self.lo = Signal(width)
+        self.hi = Signal(width)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        ext_a = Cat(self.a, self.signed_a & self.a[-1]).as_signed()
+        ext_b = Cat(self.b, self.signed_b & self.b[-1]).as_signed()
+        prod = Signal(2 * self.width)
+        m.d.comb += [
+            prod.eq(ext_a * ext_b),
+            self.lo.eq(prod[:self.width]),
+            self.hi.eq(prod[self.width:]),
+        ]
+
+        return m
+
+
 AluCtrlSignature = Signature({
     "op": Out(OpType),
     "imod": Out(ALUIMod),
@@ -67,8 +98,9 @@ AluCtrlSignature = Signature({
 
 class ALU(Component):
     # Assumes: op is held steady for duration of op.
-    def __init__(self, width: int):
+    def __init__(self, width: int, *, multiplier=False):
         self.width = width
+        self.multiplier = multiplier
         super().__init__(Signature({
             "a": Out(self.width),
             "b": Out(self.width),
@@ -88,6 +120,8 @@ class ALU(Component):
         self.sll = ShiftLogicalLeft(width)
         self.srl = ShiftLogicalRight(width)
         self.sar = ShiftArithmeticRight(width)
+        if self.multiplier:
+            self.mul = Multiplier(width)
 
     def elaborate(self, platform):
         m = Module()
@@ -99,6 +133,15 @@ class ALU(Component):
         m.submodules.sll = self.sll
         m.submodules.srl = self.srl
         m.submodules.sal = self.sar
+        if self.multiplier:
+            m.submodules.mul = self.mul
+            m.d.comb += [
+                self.mul.a.eq(self.a),
+                self.mul.b.eq(self.b),
+                self.mul.signed_a.eq((self.ctrl.op == OpType.MULH) |
+                                     (self.ctrl.op == OpType.MULHSU)),
+                self.mul.signed_b.eq(self.ctrl.op == OpType.MULH),
+            ]
 
         mod_a = Signal.like(self.a)
         mod_b = Signal.like(self.b)
@@ -140,6 +183,11 @@ class ALU(Component):
                 m.d.comb += self.o_mux.eq(self.sar.o)
             with m.Case(OpType.CMP_LTU):
                 m.d.comb += self.o_mux.eq(self.sub.o[32])
+            if self.multiplier:
+                with m.Case(OpType.MUL):
+                    m.d.comb += self.o_mux.eq(self.mul.lo)
+                with m.Case(OpType.MULH, OpType.MULHSU, OpType.MULHU):
+                    m.d.comb += self.o_mux.eq(self.mul.hi)
 
         m.d.sync += self.o.eq(self.o_mux)
         with m.If(self.ctrl.omod == ALUOMod.INV_LSB_O):
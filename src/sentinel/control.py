@@ -1,4 +1,4 @@
-from amaranth import Signal, Elaboratable, Module
+from amaranth import Signal, Elaboratable, Module, Cat
 from amaranth.lib.wiring import Component, Signature, In, Out
 
 from .decode import OpcodeType
@@ -7,7 +7,7 @@ from .ucoderom import UCodeROM
 from .datapath import GPControlSignature, PCControlSignature, \
     CSRControlSignature
 
-from .ucodefields import JmpType, CondTest
+from .ucodefields import JmpType, CondTest, MULTIWAY_TESTS
 
 from typing import TextIO, Optional
 
@@ -22,10 +22,19 @@ ControlSignature = Signature({
 
 
 class Control(Component):
-    def __init__(self, ucode: Optional[TextIO] = None):
-        self.ucoderom = UCodeROM(main_file=ucode)
+    def __init__(self, ucode: Optional[TextIO] = None, defines=(),
+                 custom_ucode=None, fast_sequencer=False,
+                 ucode_placeholder=False):
+        self.fast_sequencer = fast_sequencer
+        self.ucoderom = UCodeROM(main_file=ucode, defines=defines,
+                                 custom_file=custom_ucode,
+                                 predecode=fast_sequencer,
+                                 placeholder=ucode_placeholder)
         # Enums from microcode ROM.
-        self.sequencer = Sequencer(self.ucoderom)
+        if fast_sequencer:
+            self.sequencer = PredecodedSequencer(self.ucoderom)
+        else:
+            self.sequencer = Sequencer(self.ucoderom)
 
         # Control inputs
         self.vec_adr = Signal.like(self.ucoderom.fields.target)
@@ -122,9 +131,24 @@ class Control(Component):
             self.sequencer.jmp_type.eq(self.jmp_type)
         ]
 
+        if self.fast_sequencer:
+            m.d.comb += [
+                self.sequencer.taken_adr.eq(self.ucoderom.fields.seq_taken),
+                self.sequencer.fall_adr.eq(self.ucoderom.fields.seq_fall),
+                self.sequencer.map.eq(self.ucoderom.fields.seq_map),
+                self.sequencer.multiway.eq(self.ucoderom.fields.seq_multiway)
+            ]
+        else:
+            is_multiway_test = 0
+            for t in MULTIWAY_TESTS:
+                is_multiway_test |= self.cond_test == t
+            m.d.comb += self.sequencer.multiway.eq(
+                (self.jmp_type == JmpType.CONT) & is_multiway_test)
+
         # Connect sequencer to Control.
         m.d.comb += [
             self.sequencer.test.eq(self.test),
+            self.sequencer.test_vec.eq(Cat(self.test, self.exception)),
             self.sequencer.opcode_adr.eq(self.requested_op),
             self.sequencer.vec_adr.eq(self.vec_adr),
         ]
@@ -166,6 +190,11 @@ class Sequencer(Elaboratable):
         # If test succeeds, branch in target/vec_adr is taken, otherwise
         # next_adr.
         self.test = Signal()
+        # For MULTIWAY, OR'd into the 2 LSBs of target: the test result and
+        # whether there's an exception.
+        self.test_vec = Signal(2)
+        # MULTIWAY shares CONT's encoding; this tells them apart.
+        self.multiway = Signal()
 
     def elaborate(self, platform):
         m = Module()
@@ -174,9 +203,12 @@ class Sequencer(Elaboratable):
         m.d.sync += self.ice40_rst_guard.eq(0)
 
         with m.Switch(self.jmp_type):
-            # Also handles JumpType.NOP
+            # Also handles JumpType.NOP and JumpType.MULTIWAY
             with m.Case(JmpType.CONT):
-                m.d.comb += self.adr.eq(self.next_adr)
+                with m.If(self.multiway):
+                    m.d.comb += self.adr.eq(self.target | self.test_vec)
+                with m.Else():
+                    m.d.comb += self.adr.eq(self.next_adr)
             with m.Case(JmpType.MAP):
                 with m.If(self.test):
                     m.d.comb += self.adr.eq(self.target)
@@ -267,3 +299,37 @@ class Sequencer(Elaboratable):
             m.d.comb += self.adr.eq(self.next_adr)
 
         return m
+
+
+# Microprogram address generation for higher fmax. Sequencer decodes jmp_type
+# between the ucode ROM's read outputs and its address input, which is the
+# critical path on iCE40. Instead, UCodeROM(predecode=True) works out each
+# uinsn's possible next addresses ahead of time, so only the test result
+# selects between them here.
+class PredecodedSequencer(Sequencer):
+    def __init__(self, ucoderom):
+        super().__init__(ucoderom)
+
+        self.taken_adr = Signal.like(self.adr)
+        self.fall_adr = Signal.like(self.adr)
+        self.map = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.d.sync += self.ice40_rst_guard.eq(0)
+
+        # See Sequencer for why the reset guard is needed. There's no
+        # next_adr here; the guard holds self.adr at the reset uinsn instead.
+        with m.If(self.ice40_rst_guard):
+            m.d.comb += self.adr.eq(self.adr.init)
+        with m.Elif(self.multiway):
+            m.d.comb += self.adr.eq(self.target | self.test_vec)
+        with m.Elif(self.test):
+            m.d.comb += self.adr.eq(self.taken_adr)
+        with m.Elif(self.map):
+            m.d.comb += self.adr.eq(self.opcode_adr)
+        with m.Else():
+            m.d.comb += self.adr.eq(self.fall_adr)
+
+        return m
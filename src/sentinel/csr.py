@@ -19,7 +19,7 @@ class MStatus(Struct):
 class MTVec(Struct):
     class Mode(Enum, shape=unsigned(2)):
         DIRECT = 0
-        VECTORED = 1  # Not implemented
+        VECTORED = 1  # Interrupts only; exceptions always go to BASE.
 
     mode: Mode
     base: unsigned(30)
@@ -29,20 +29,24 @@ class MIP(Struct):
     _padding0: unsigned(3)
     msip: unsigned(1)  # Not implemented
     _padding1: unsigned(3)
-    mtip: unsigned(1)  # Not implemented
+    mtip: unsigned(1)
     _padding2: unsigned(3)
     meip: unsigned(1)
-    _padding3: unsigned(20)
+    _padding3: unsigned(4)
+    # Platform-specific local interrupts; only the low Top.num_local_irqs
+    # bits are implemented.
+    platform: unsigned(16)
 
 
 class MIE(Struct):
     _padding0: unsigned(3)
     msie: unsigned(1)  # Not implemented
     _padding1: unsigned(3)
-    mtie: unsigned(1)  # Not implemented
+    mtie: unsigned(1)
     _padding2: unsigned(3)
     meie: unsigned(1)
-    _padding3: unsigned(20)
+    _padding3: unsigned(4)
+    platform: unsigned(16)
 
 
 class MCause(Struct):
@@ -67,3 +71,19 @@ class MCause(Struct):
 
     cause: Cause
     interrupt: unsigned(1)
+
+
+# Events that mhpmcounter3 and up can count, selected by writing the event's
+# value to the corresponding mhpmevent. mhpmevent is WARL; only the low 3
+# bits are implemented, and values with no event count nothing.
+class MHPMEvent(Enum, shape=unsigned(3)):
+    NONE = 0
+    # Wishbone wait states (mem_req & ~ack), including insn fetches.
+    MEM_WAIT = 1
+    # Wishbone wait states during insn fetch only.
+    FETCH_WAIT = 2
+    # Microinstructions shifting by one bit, i.e. shift loop iterations.
+    # The M extension's microcode also counts here.
+    SHIFT = 3
+    EXCEPTION = 4
+    INTERRUPT = 5
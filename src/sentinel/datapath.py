@@ -5,7 +5,7 @@ from amaranth.lib.wiring import Component, Signature, In, Out, connect, flipped
 
 from .ucodefields import PcAction, CSROp, ExceptCtl
 
-from .csr import MStatus, MTVec, MIP, MIE, MCause
+from .csr import MStatus, MTVec, MIP, MIE, MCause, MHPMEvent
 
 
 PCControlSignature = Signature({
@@ -43,11 +43,16 @@ CSRSignature = Signature({
     "mip_w": Out(MIP),
     "mip_r": In(MIP),
     "mie_r": In(MIE),
+    # Which MHPMEvents happened this cycle, indexed by event.
+    "hpm_events": Out(len(MHPMEvent)),
     # These 4 are mainly for peeking in simulation.
     "mscratch_r": In(32),
     "mepc_r": In(30),
     "mtvec_r": In(MTVec),
-    "mcause_r": In(MCause)
+    "mcause_r": In(MCause),
+    # And these are for FormalTop.
+    "mhpmcounter3_r": In(32),
+    "mhpmevent3_r": In(MHPMEvent)
 })
 
 
@@ -152,6 +157,16 @@ class CSRFile(Component):
     MEPC = 0x9
     MCAUSE = 0xA
     MIP = 0xC
+    # Decode sets bit 4 of the address for mhpmevent3 and up, and bits 3
+    # and 4 for mhpmcounter3 and up. The low 3 bits are the low 3 bits of the
+    # CSR address.
+    MHPMEVENT3 = 0x13
+    MHPMCOUNTER3 = 0x1B
+
+    def __init__(self, *, num_local_irqs=0, num_hpm_counters=0):
+        self.num_local_irqs = num_local_irqs
+        self.num_hpm_counters = num_hpm_counters
+        super().__init__()
 
     def elaborate(self, platform):
         m = Module()
@@ -162,6 +177,17 @@ class CSRFile(Component):
 
         read_buf = Signal(32)
 
+        # Writes below take priority over counting.
+        hpm_counters = []
+        hpm_events = []
+        for i in range(self.num_hpm_counters):
+            counter = Signal(32, name=f"mhpmcounter{i + 3}")
+            event = Signal(MHPMEvent, name=f"mhpmevent{i + 3}")
+            with m.If(self.pub.hpm_events.bit_select(event.as_value(), 1)):
+                m.d.sync += counter.eq(counter + 1)
+            hpm_counters.append(counter)
+            hpm_events.append(event)
+
         m.d.comb += [
             self.pub.mstatus_r.eq(mstatus),
             self.pub.mip_r.eq(mip),
@@ -182,10 +208,22 @@ class CSRFile(Component):
                 ]
             with m.If(self.pub.adr == self.MIE):
                 mie_in = View(MIE, self.pub.dat_w)
-                m.d.sync += mie.meie.eq(mie_in.meie)
+                m.d.sync += [
+                    mie.mtie.eq(mie_in.mtie),
+                    mie.meie.eq(mie_in.meie),
+                ]
+                if self.num_local_irqs:
+                    n = self.num_local_irqs
+                    m.d.sync += mie.platform[:n].eq(mie_in.platform[:n])
             # with m.If(self.pub.adr == self.MIP):
             #     mip_in = View(MIP, self.pub.dat_w)
             #     m.d.sync += mip.meip.eq(mip_in.meip)
+            for i, (counter, event) in enumerate(zip(hpm_counters,
+                                                     hpm_events)):
+                with m.If(self.pub.adr == self.MHPMCOUNTER3 + i):
+                    m.d.sync += counter.eq(self.pub.dat_w)
+                with m.If(self.pub.adr == self.MHPMEVENT3 + i):
+                    m.d.sync += event.eq(self.pub.dat_w[:3])
 
         with m.If(self.pub.ctrl.op == CSROp.READ_CSR):
             with m.If(self.pub.adr == self.MSTATUS):
@@ -200,14 +238,24 @@ class CSRFile(Component):
                 mie_buf = View(MIE, read_buf)
                 m.d.sync += [
                     read_buf.eq(0),
-                    mie_buf.meie.eq(mie.meie)
+                    mie_buf.mtie.eq(mie.mtie),
+                    mie_buf.meie.eq(mie.meie),
+                    mie_buf.platform.eq(mie.platform)
                 ]
             with m.If(self.pub.adr == self.MIP):
                 mip_buf = View(MIP, read_buf)
                 m.d.sync += [
                     read_buf.eq(0),
-                    mip_buf.meip.eq(mip.meip)
+                    mip_buf.mtip.eq(mip.mtip),
+                    mip_buf.meip.eq(mip.meip),
+                    mip_buf.platform.eq(mip.platform)
                 ]
+            for i, (counter, event) in enumerate(zip(hpm_counters,
+                                                     hpm_events)):
+                with m.If(self.pub.adr == self.MHPMCOUNTER3 + i):
+                    m.d.sync += read_buf.eq(counter)
+                with m.If(self.pub.adr == self.MHPMEVENT3 + i):
+                    m.d.sync += read_buf.eq(event.as_value())
 
         prev_csr_adr = Signal.like(self.pub.adr)
         m.d.sync += prev_csr_adr.eq(self.pub.adr)
@@ -216,22 +264,36 @@ class CSRFile(Component):
         # but preempt reads from CSRs which can't be block RAM.
         with m.If(~((prev_csr_adr == CSRFile.MSTATUS) |
                   (prev_csr_adr == CSRFile.MIP) |
-                  (prev_csr_adr == CSRFile.MIE))):
+                  (prev_csr_adr == CSRFile.MIE) |
+                  prev_csr_adr[4])):
             m.d.comb += self.pub.dat_r.eq(self.priv.dat_r)
 
-        # For MTVEC, only Direct Mode is supported, and field is WARL,
-        # so honor that.
+        # For MTVEC, only Direct and Vectored Modes are supported, and field
+        # is WARL, so honor that.
         # MEPC is also WARL, and says low 2 bits are always zero for
         # only-IALIGN=32.
         # By contrast, MCAUSE is WLRL ("anything goes if illegal value is
         # written"), and MSCRATCH can hold anything.
-        with m.If((self.pub.adr == CSRFile.MTVEC) |
-                  (self.pub.adr == CSRFile.MEPC)):
+        with m.If(self.pub.adr == CSRFile.MTVEC):
+            m.d.comb += self.priv.dat_w[1].eq(0)
+        with m.If(self.pub.adr == CSRFile.MEPC):
             m.d.comb += self.priv.dat_w[0:2].eq(0)
 
+        if self.num_hpm_counters:
+            m.d.comb += [
+                self.pub.mhpmcounter3_r.eq(hpm_counters[0]),
+                self.pub.mhpmevent3_r.eq(hpm_events[0])
+            ]
+
         # Make sure we don't lose interrupts.
         # with m.If(self.pub.mip_w.meip):
-        m.d.comb += mip.meip.eq(self.pub.mip_w.meip)
+        m.d.comb += [
+            mip.mtip.eq(self.pub.mip_w.mtip),
+            mip.meip.eq(self.pub.mip_w.meip),
+        ]
+        if self.num_local_irqs:
+            n = self.num_local_irqs
+            m.d.comb += mip.platform[:n].eq(self.pub.mip_w.platform[:n])
 
         # This stack is probably rather difficult to orchestrate in
         # microcode for little gain.
@@ -254,12 +316,14 @@ class DataPath(Component):
     csr: In(CSRSignature)
     pc: In(PcSignature)
 
-    def __init__(self, *, formal=False):
+    def __init__(self, *, formal=False, num_local_irqs=0,
+                 num_hpm_counters=0):
         super().__init__()
 
         self.pc_mod = ProgramCounter()
         self.regfile = RegFile(formal=formal)
-        self.csrfile = CSRFile()
+        self.csrfile = CSRFile(num_local_irqs=num_local_irqs,
+                               num_hpm_counters=num_hpm_counters)
 
     def elaborate(self, platform):
         m = Module()
@@ -36,8 +36,16 @@ class DecodeException(Struct):
 
 
 class Decode(Component):
-    def __init__(self, *, formal=False):
+    def __init__(self, *, formal=False, m_extension=False, custom_slots=(),
+                 num_hpm_counters=0):
         self.formal = formal
+        self.m_extension = m_extension
+        # mhpmcounter3 and up (with matching mhpmevent) that are implemented.
+        # All others are read-only zero.
+        self.num_hpm_counters = num_hpm_counters
+        # CUSTOM_0 map slots (Cat(funct3, funct7[0])) that have user
+        # microcode. All others are illegal.
+        self.custom_slots = custom_slots
 
         sig = {
             "do_decode": Out(1),
@@ -53,8 +61,9 @@ class Decode(Component):
             # ID to index into ucode ROM. Chosen through trial and error.
             "requested_op": In(8),
             # Squash CSR encoding down to only bits that vary between
-            # the 7 implemented CSRs.
-            "csr_encoding": In(4)
+            # the 7 implemented CSRs. Bit 4 is set for the HPM CSRs; see
+            # CSRFile.
+            "csr_encoding": In(5)
         }
 
         if self.formal:
@@ -94,24 +103,25 @@ class Decode(Component):
             self.src_a_unreg.eq(rs1)
         ]
 
-        csr_map = Signal(2)
+        # Look up the class of the CSR being accessed combinationally, so that
+        # the dispatch ROM below can resolve legality and the final microcode
+        # routine in the same cycle as the rest of decode.
+        csr_class = Signal(2)
         with m.Switch(Cat(funct12[0:8], funct12[10:12])):
-            for i, v in enumerate(self.mmode_csr_quadrant_init()):
-                with m.Case(i):
-                    m.d.sync += csr_map.eq(v)
+            for i, v in enumerate(self.csr_class_init()):
+                if v != self.CSR_CLASS_ILLEGAL:
+                    with m.Case(i):
+                        m.d.comb += csr_class.eq(v)
+            with m.Default():
+                m.d.comb += csr_class.eq(self.CSR_CLASS_ILLEGAL)
 
-        forward_csr = Signal()
-        csr_quadrant = Signal(2)
-        csr_op = Signal.like(funct3)
-        csr_ro_space = Signal()
+        # Only Machine Mode CSRs exist.
+        with m.If(funct12[8:10] != 0b11):
+            m.d.comb += csr_class.eq(self.CSR_CLASS_ILLEGAL)
 
         m.d.sync += [
-            forward_csr.eq(0),
             self.exception.e_type.eq(MCause.Cause.ILLEGAL_INSN),
             self.exception.valid.eq(0),
-            csr_quadrant.eq(funct12[8:10]),
-            csr_op.eq(funct3),
-            csr_ro_space.eq(funct12[10:12] == 0b11)
         ]
 
         with m.If(self.do_decode):
@@ -148,7 +158,16 @@ class Decode(Component):
                     m.d.sync += self.requested_op.eq(0x50)
                 with m.Case(OpcodeType.OP):
                     op_map = Cat(funct3, funct7[-2], C(0xC))
-                    with m.If((funct3 == 0) | (funct3 == 5)):
+                    # M extension ops live right after the OP block, at
+                    # 0xE8-0xEF.
+                    m_op = Signal()
+                    if self.m_extension:
+                        m.d.comb += m_op.eq(funct7 == 1)
+
+                    with m.If(m_op):
+                        m.d.sync += self.requested_op.eq(
+                            Cat(funct3, C(0b11101, 5)))
+                    with m.Elif((funct3 == 0) | (funct3 == 5)):
                         with m.If((funct7 != 0) & (funct7 != 0b0100000)):
                             m.d.sync += self.exception.valid.eq(1)
                         m.d.sync += self.requested_op.eq(op_map)
@@ -186,7 +205,17 @@ class Decode(Component):
                     with m.If(funct3 >= 3):
                         m.d.sync += self.exception.valid.eq(1)
                 with m.Case(OpcodeType.CUSTOM_0):
-                    m.d.sync += self.exception.valid.eq(1)
+                    custom_slot = Cat(funct3, funct7[0])
+                    custom_valid = Signal()
+                    with m.Switch(custom_slot):
+                        for slot in self.custom_slots:
+                            with m.Case(slot):
+                                m.d.comb += custom_valid.eq(1)
+
+                    with m.If(~custom_valid | (funct7[1:] != 0)):
+                        m.d.sync += self.exception.valid.eq(1)
+                    m.d.sync += self.requested_op.eq(Cat(custom_slot,
+                                                         C(0b0111, 4)))
                 with m.Case(OpcodeType.MISC_MEM):
                     # RS1 and RD should be ignored for FENCE insn in a base
                     # impl.
@@ -221,18 +250,30 @@ class Decode(Component):
                         with m.Case(4):
                             pass
                         with m.Default():
-                            # CSR ops take two cycles to decode. Rather than
-                            # penalize the rest of the core, have the microcode
-                            # jump to a temporary location. The next cycle
-                            # will have the microcode jump to the _real_ CSR
-                            # routine.
-                            csr_encode = Cat(funct12[0:3], funct12[6])
-                            m.d.sync += [
-                                self.requested_op.eq(0x24),
-                                forward_csr.eq(1),
-                                self.exception.valid.eq(0),
-                                self.csr_encoding.eq(csr_encode)
-                            ]
+                            # mhpmcounter3-7 and mhpmevent3-7. This also
+                            # catches mcycle, minstret, and mcountinhibit,
+                            # but those are read-only zero.
+                            with m.If((funct12[3:] == (0xB00 >> 3)) |
+                                      (funct12[3:] == (0x320 >> 3))):
+                                csr_encode = Cat(funct12[0:3], funct12[11],
+                                                 C(1))
+                                m.d.sync += self.csr_encoding.eq(csr_encode)
+                            with m.Else():
+                                csr_encode = Cat(funct12[0:3], funct12[6])
+                                m.d.sync += self.csr_encoding.eq(csr_encode)
+
+                            with m.Switch(Cat(rd == 0, rs1 == 0, funct3,
+                                              csr_class)):
+                                for i, (op, illegal) in \
+                                        enumerate(self.csr_dispatch_init()):
+                                    if op is None:
+                                        continue
+
+                                    with m.Case(i):
+                                        m.d.sync += [
+                                            self.requested_op.eq(op),
+                                            self.exception.valid.eq(illegal)
+                                        ]
 
                 with m.Default():
                     # Catch-all for all ones.
@@ -242,91 +283,6 @@ class Decode(Component):
             with m.If(self.insn[0:2] != 0b11):
                 m.d.sync += self.exception.valid.eq(1)
 
-        # Second decode cycle if this is a CSR access.
-        with m.If(forward_csr):
-            ro0 = Signal()
-            illegal = Signal()
-
-            m.d.comb += illegal.eq(csr_map[0])
-            m.d.comb += ro0.eq(csr_map[1])
-            m.d.sync += self.exception.e_type.eq(MCause.Cause.ILLEGAL_INSN)
-            m.d.sync += self.exception.valid.eq(0)
-
-            with m.Switch(csr_quadrant):
-                # Machine Mode CSRs.
-                with m.Case(0b11):
-                    # Most CSR accesses.
-                    with m.If(illegal):
-                        m.d.sync += self.exception.valid.eq(1)
-
-                    # Read-only Zero CSRs. Includes CSRs that are in actually
-                    # read-only space (top 2 bits set), all of which are 0
-                    # for this core.
-                    with m.Elif(ro0):
-                        # AFAICT, writing to ro0 registers outside of the
-                        # read-only space should succeed (but the write is
-                        # ignored).
-                        # None of the ro0 registers have side effects either?
-                        # csrro0
-                        m.d.sync += self.requested_op.eq(0x25)
-                        with m.If(csr_ro_space):
-                            # CSRRW and CSRRWI don't have a mechanism to only
-                            # read a register.
-                            with m.If((csr_op == 1) |
-                                      (csr_op == 5) |
-                                      (self.src_a != 0)):
-                                m.d.sync += self.exception.valid.eq(1)
-
-                    with m.Else():
-                        # Jump to microcode routines for actual, implemented
-                        # CSR registers.
-                        with m.If((csr_op == 1) & (self.dst == 0)):
-                            # csrw
-                            m.d.sync += self.requested_op.eq(0x26)
-                        with m.Elif((csr_op == 1) & (self.dst != 0)):
-                            # csrrw
-                            m.d.sync += self.requested_op.eq(0x27)
-                        with m.Elif((csr_op == 2) & (self.src_a == 0)):
-                            # csrr
-                            m.d.sync += self.requested_op.eq(0x28)
-                        with m.Elif((csr_op == 2) & (self.src_a != 0)):
-                            # csrrs
-                            m.d.sync += self.requested_op.eq(0x29)
-                        with m.Elif((csr_op == 3) & (self.src_a == 0)):
-                            # csrrc, no write
-                            m.d.sync += self.requested_op.eq(0x28)
-                        with m.Elif((csr_op == 3) & (self.src_a != 0)):
-                            # csrrc
-                            m.d.sync += self.requested_op.eq(0x2a)
-                        with m.Elif((csr_op == 5) & (self.dst == 0)):
-                            # csrwi
-                            m.d.sync += self.requested_op.eq(0x2b)
-                        with m.Elif((csr_op == 5) & (self.dst != 0)):
-                            # csrrwi
-                            m.d.sync += self.requested_op.eq(0x2c)
-                        with m.Elif((csr_op == 6) & (self.src_a == 0)):
-                            # csrrsi, no write
-                            m.d.sync += self.requested_op.eq(0x28)
-                        with m.Elif((csr_op == 6) & (self.src_a != 0)):
-                            # csrrsi
-                            m.d.sync += self.requested_op.eq(0x2d)
-                        with m.Elif((csr_op == 7) & (self.src_a == 0)):
-                            # csrrci, no write
-                            m.d.sync += self.requested_op.eq(0x28)
-                        with m.Elif((csr_op == 7) & (self.src_a != 0)):
-                            # csrrci
-                            m.d.sync += self.requested_op.eq(0x2e)
-                        with m.Else():
-                            # TODO: cover via rvformal.
-                            # This might be reachable, but not while
-                            # requested_op has a meaningful value in it.
-                            # Make sure this is actually the case.
-                            pass
-
-                # Other Modes (User, Supervisor).
-                with m.Default():
-                    m.d.sync += self.exception.valid.eq(1)
-
         if self.formal:
             m.d.comb += [
                 self.rvfi.rs1.eq(rs1),
@@ -364,6 +320,90 @@ class Decode(Component):
                            self.insn[20], self.insn[12:20],
                            Value.replicate(sign, 12))
 
+    # Classes of M-Mode CSRs, by address.
+    CSR_CLASS_IMPL = 0
+    CSR_CLASS_ILLEGAL = 1
+    # Read-only zero CSRs. Writes are ignored...
+    CSR_CLASS_RO0 = 2
+    # ...except for CSRs in the read-only space (top 2 bits set), where
+    # writes are illegal.
+    CSR_CLASS_RO0_RO_SPACE = 3
+
+    def csr_class_init(self):
+        init = []
+
+        for i, v in enumerate(self.mmode_csr_quadrant_init()):
+            if v == 1:
+                init.append(self.CSR_CLASS_ILLEGAL)
+            elif v == 2:
+                # Index bits 8 and 9 are CSR address bits 10 and 11.
+                if (i >> 8) == 0b11:
+                    init.append(self.CSR_CLASS_RO0_RO_SPACE)
+                else:
+                    init.append(self.CSR_CLASS_RO0)
+            else:
+                init.append(self.CSR_CLASS_IMPL)
+
+        return init
+
+    # Map from Cat(rd == 0, rs1 == 0, funct3, csr_class) to the microcode
+    # routine for the CSR access and whether the access is illegal. funct3
+    # values 0 and 4 are not CSR ops; their entries are None.
+    def csr_dispatch_init(self):
+        init = []
+
+        for i in range(128):
+            rd_zero = i & 1
+            rs1_zero = (i >> 1) & 1
+            funct3 = (i >> 2) & 0b111
+            csr_class = i >> 5
+
+            if funct3 in (0, 4):
+                init.append((None, None))
+                continue
+
+            match csr_class:
+                case self.CSR_CLASS_ILLEGAL:
+                    init.append((0, 1))
+                case self.CSR_CLASS_RO0:
+                    # AFAICT, writing to ro0 registers outside of the
+                    # read-only space should succeed (but the write is
+                    # ignored). None of the ro0 registers have side effects
+                    # either?
+                    # csrro0
+                    init.append((0x25, 0))
+                case self.CSR_CLASS_RO0_RO_SPACE:
+                    # CSRRW and CSRRWI don't have a mechanism to only read a
+                    # register.
+                    illegal = funct3 in (1, 5) or not rs1_zero
+                    init.append((0x25, int(illegal)))
+                case self.CSR_CLASS_IMPL:
+                    # Microcode routines for actual, implemented CSR
+                    # registers. rs1 doubles as the immediate for
+                    # csrr[wsc]i.
+                    match (funct3, rd_zero, rs1_zero):
+                        case (1, 1, _):
+                            op = 0x26  # csrw
+                        case (1, 0, _):
+                            op = 0x27  # csrrw
+                        case (2 | 3 | 6 | 7, _, 1):
+                            op = 0x28  # csrr (csrr[sc][i], no write)
+                        case (2, _, 0):
+                            op = 0x29  # csrrs
+                        case (3, _, 0):
+                            op = 0x2a  # csrrc
+                        case (5, 1, _):
+                            op = 0x2b  # csrwi
+                        case (5, 0, _):
+                            op = 0x2c  # csrrwi
+                        case (6, _, 0):
+                            op = 0x2d  # csrrsi
+                        case (7, _, 0):
+                            op = 0x2e  # csrrci
+                    init.append((op, 0))
+
+        return init
+
     def mmode_csr_quadrant_init(self):
         def idx(csr_addr):
             return (csr_addr & 0xff) + ((csr_addr & 0xc00) >> 2)
@@ -413,6 +453,10 @@ class Decode(Component):
         init[idx(0x320)] = 2  # mcountinhibit
         for i in range(0x323, 0x340):
             init[idx(i)] = 2  # mhpmevent3-31
+        for i in range(self.num_hpm_counters):
+            # Implemented counters are 32-bit; mhpmcounterNh stays zero.
+            init[idx(0xB03 + i)] = 0
+            init[idx(0x323 + i)] = 0
         init[idx(0x7A0)] = 1  # tselect
         init[idx(0x7A1)] = 1
         init[idx(0x7A2)] = 1
@@ -0,0 +1,193 @@
+from .decode import InsnImmFormat, OpcodeType
+
+# Pure-Python RV32I_Zicsr (and M) disassembler, mainly for looking at RISC-V
+# Formal counterexamples without a toolchain. Output follows
+# "objdump -M numeric,no-aliases": registers are always xN, and pseudo-insns
+# are spelled out.
+
+
+CSR_NAMES = {
+    0x300: "mstatus",
+    0x301: "misa",
+    0x302: "medeleg",
+    0x303: "mideleg",
+    0x304: "mie",
+    0x305: "mtvec",
+    0x306: "mcounteren",
+    0x30A: "menvcfg",
+    0x310: "mstatush",
+    0x31A: "menvcfgh",
+    0x320: "mcountinhibit",
+    0x340: "mscratch",
+    0x341: "mepc",
+    0x342: "mcause",
+    0x343: "mtval",
+    0x344: "mip",
+    0x34A: "mtinst",
+    0x34B: "mtval2",
+    0xB00: "mcycle",
+    0xB02: "minstret",
+    0xB80: "mcycleh",
+    0xB82: "minstreth",
+    0xF11: "mvendorid",
+    0xF12: "marchid",
+    0xF13: "mimpid",
+    0xF14: "mhartid",
+    0xF15: "mconfigptr",
+}
+CSR_NAMES.update({0xB00 + i: f"mhpmcounter{i}" for i in range(3, 32)})
+CSR_NAMES.update({0xB80 + i: f"mhpmcounter{i}h" for i in range(3, 32)})
+CSR_NAMES.update({0x320 + i: f"mhpmevent{i}" for i in range(3, 32)})
+
+
+OP_IMM = ("addi", "slli", "slti", "sltiu", "xori", "srli", "ori", "andi")
+OP = ("add", "sll", "slt", "sltu", "xor", "srl", "or", "and")
+OP_M = ("mul", "mulh", "mulhsu", "mulhu", "div", "divu", "rem", "remu")
+BRANCH = ("beq", "bne", None, None, "blt", "bge", "bltu", "bgeu")
+LOAD = ("lb", "lh", "lw", None, "lbu", "lhu", None, None)
+STORE = ("sb", "sh", "sw", None, None, None, None, None)
+CSR = (None, "csrrw", "csrrs", "csrrc", None, "csrrwi", "csrrsi", "csrrci")
+
+
+# Python counterpart of Decode.imm_bits; immediates are returned signed.
+def imm_bits(insn, imm_type):
+    def bits(lo, hi):
+        return (insn >> lo) & ((1 << (hi - lo)) - 1)
+
+    match imm_type:
+        case InsnImmFormat.I:
+            imm, width = bits(20, 32), 12
+        case InsnImmFormat.S:
+            imm, width = bits(7, 12) | bits(25, 32) << 5, 12
+        case InsnImmFormat.B:
+            imm, width = (bits(8, 12) << 1 | bits(25, 31) << 5 |
+                          bits(7, 8) << 11 | bits(31, 32) << 12), 13
+        case InsnImmFormat.U:
+            return bits(12, 32) << 12
+        case InsnImmFormat.J:
+            imm, width = (bits(21, 31) << 1 | bits(20, 21) << 11 |
+                          bits(12, 20) << 12 | bits(31, 32) << 20), 21
+
+    if imm >> (width - 1):
+        imm -= 1 << width
+    return imm
+
+
+def csr_name(csr):
+    return CSR_NAMES.get(csr, f"0x{csr:x}")
+
+
+# Branch and jump targets are absolute if pc is known, and relative to the
+# current insn (like in GNU as) otherwise.
+def target(pc, offset):
+    if pc is None:
+        return f".{offset:+d}"
+    return f"0x{(pc + offset) & 0xffffffff:x}"
+
+
+def disassemble(insn, pc=None):
+    """Disassemble a single 32-bit instruction to a string.
+
+    Encodings that Sentinel doesn't know about are returned as ".word".
+    """
+    unknown = f".word\t0x{insn:08x}"
+
+    if insn & 0b11 != 0b11:
+        return unknown
+
+    try:
+        opcode = OpcodeType(insn >> 2 & 0b11111)
+    except ValueError:
+        return unknown
+
+    rd = insn >> 7 & 0b11111
+    funct3 = insn >> 12 & 0b111
+    rs1 = insn >> 15 & 0b11111
+    rs2 = insn >> 20 & 0b11111
+    funct7 = insn >> 25
+    funct12 = insn >> 20
+
+    match opcode:
+        case OpcodeType.OP_IMM:
+            imm = imm_bits(insn, InsnImmFormat.I)
+            if funct3 == 1 and funct7 == 0:
+                return f"slli\tx{rd},x{rs1},{rs2}"
+            elif funct3 == 5 and funct7 in (0, 0b0100000):
+                mnem = "srai" if funct7 else "srli"
+                return f"{mnem}\tx{rd},x{rs1},{rs2}"
+            elif funct3 in (1, 5):
+                return unknown
+            return f"{OP_IMM[funct3]}\tx{rd},x{rs1},{imm}"
+
+        case OpcodeType.OP:
+            if funct7 == 0:
+                mnem = OP[funct3]
+            elif funct7 == 0b0100000 and funct3 in (0, 5):
+                mnem = "sub" if funct3 == 0 else "sra"
+            elif funct7 == 1:
+                mnem = OP_M[funct3]
+            else:
+                return unknown
+            return f"{mnem}\tx{rd},x{rs1},x{rs2}"
+
+        case OpcodeType.LUI | OpcodeType.AUIPC:
+            mnem = "lui" if opcode == OpcodeType.LUI else "auipc"
+            return f"{mnem}\tx{rd},0x{insn >> 12:x}"
+
+        case OpcodeType.JAL:
+            offset = imm_bits(insn, InsnImmFormat.J)
+            return f"jal\tx{rd},{target(pc, offset)}"
+
+        case OpcodeType.JALR:
+            if funct3 != 0:
+                return unknown
+            imm = imm_bits(insn, InsnImmFormat.I)
+            return f"jalr\tx{rd},{imm}(x{rs1})"
+
+        case OpcodeType.BRANCH:
+            if not BRANCH[funct3]:
+                return unknown
+            offset = imm_bits(insn, InsnImmFormat.B)
+            return f"{BRANCH[funct3]}\tx{rs1},x{rs2},{target(pc, offset)}"
+
+        case OpcodeType.LOAD:
+            if not LOAD[funct3]:
+                return unknown
+            imm = imm_bits(insn, InsnImmFormat.I)
+            return f"{LOAD[funct3]}\tx{rd},{imm}(x{rs1})"
+
+        case OpcodeType.STORE:
+            if not STORE[funct3]:
+                return unknown
+            imm = imm_bits(insn, InsnImmFormat.S)
+            return f"{STORE[funct3]}\tx{rs2},{imm}(x{rs1})"
+
+        case OpcodeType.MISC_MEM:
+            if funct3 == 1:
+                return "fence.i"
+            elif funct3 != 0:
+                return unknown
+
+            def iorw(bits):
+                return "".join(c for i, c in enumerate("wroi")
+                               if bits >> i & 1)[::-1] or "0"
+
+            return f"fence\t{iorw(funct12 >> 4 & 0xf)},{iorw(funct12 & 0xf)}"
+
+        case OpcodeType.SYSTEM:
+            if funct3 == 0:
+                if rd != 0 or rs1 != 0:
+                    return unknown
+                return {0x000: "ecall", 0x001: "ebreak", 0x302: "mret",
+                        0x105: "wfi"}.get(funct12, unknown)
+            elif not CSR[funct3]:
+                return unknown
+            elif funct3 & 0b100:
+                return f"{CSR[funct3]}\tx{rd},{csr_name(funct12)},{rs1}"
+            return f"{CSR[funct3]}\tx{rd},{csr_name(funct12)},x{rs1}"
+
+        case OpcodeType.CUSTOM_0:
+            return (f"custom0\tx{rd},x{rs1},x{rs2},"
+                    f"funct3={funct3},funct7={funct7}")
+
+    return unknown
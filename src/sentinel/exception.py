@@ -8,6 +8,10 @@ from .ucodefields import MemSel, ExceptCtl
 
 SrcSignature = Signature({
     "alu_lo": Out(2),
+    # The PC is word-aligned, so a branch target is misaligned iff its
+    # offset is.
+    "imm_lo": Out(2),
+    "branch_taken": Out(1),
     "csr": Out(Signature({
         "mstatus": Out(MStatus),
         "mip": Out(MIP),
@@ -31,6 +35,10 @@ class ExceptionRouter(Component):
     src: In(SrcSignature)
     out: Out(OutSignature)
 
+    def __init__(self, *, num_local_irqs=0):
+        self.num_local_irqs = num_local_irqs
+        super().__init__()
+
     def elaborate(self, platform):
         m = Module()
 
@@ -45,7 +53,20 @@ class ExceptionRouter(Component):
         with m.If(self.src.ctrl.except_ctl == ExceptCtl.LATCH_DECODER):
             with m.If(self.src.decode.valid):
                 m.d.comb += exception.eq(1)
-                m.d.sync += mcause_latch.cause.eq(self.src.decode.e_type)
+                m.d.sync += [
+                    mcause_latch.cause.eq(self.src.decode.e_type),
+                    mcause_latch.interrupt.eq(0)
+                ]
+
+            # External interrupts take priority over timer interrupts
+            # (later assignments win).
+            with m.If(self.src.csr.mstatus.mie & self.src.csr.mip.mtip &
+                      self.src.csr.mie.mtie):
+                m.d.comb += exception.eq(1)
+                m.d.sync += [
+                    mcause_latch.cause.eq(MCause.Cause.MTIMER_INT),
+                    mcause_latch.interrupt.eq(1)
+                ]
 
             with m.If(self.src.csr.mstatus.mie & self.src.csr.mip.meip &
                       self.src.csr.mie.meie):
@@ -54,6 +75,19 @@ class ExceptionRouter(Component):
                     mcause_latch.cause.eq(11),
                     mcause_latch.interrupt.eq(1)
                 ]
+
+            # Local interrupts take priority over external interrupts, and
+            # higher-numbered local interrupts take priority over
+            # lower-numbered ones (later assignments win).
+            for i in range(self.num_local_irqs):
+                with m.If(self.src.csr.mstatus.mie &
+                          self.src.csr.mip.platform[i] &
+                          self.src.csr.mie.platform[i]):
+                    m.d.comb += exception.eq(1)
+                    m.d.sync += [
+                        mcause_latch.cause.eq(16 + i),
+                        mcause_latch.interrupt.eq(1)
+                    ]
         with m.Elif(self.src.ctrl.except_ctl == ExceptCtl.LATCH_STORE_ADR):
             with m.If((((self.src.ctrl.mem_sel == MemSel.HWORD) &
                         self.src.alu_lo[0] == 1)) |
@@ -61,8 +95,10 @@ class ExceptionRouter(Component):
                       ((self.src.alu_lo[0] == 1) |
                        (self.src.alu_lo[1] == 1)))):
                 m.d.comb += exception.eq(1)
-                m.d.sync += mcause_latch.cause.eq(
-                    MCause.Cause.STORE_MISALIGNED)
+                m.d.sync += [
+                    mcause_latch.cause.eq(MCause.Cause.STORE_MISALIGNED),
+                    mcause_latch.interrupt.eq(0)
+                ]
         with m.Elif(self.src.ctrl.except_ctl == ExceptCtl.LATCH_LOAD_ADR):
             with m.If((((self.src.ctrl.mem_sel == MemSel.HWORD) &
                         self.src.alu_lo[0] == 1)) |
@@ -70,10 +106,24 @@ class ExceptionRouter(Component):
                       ((self.src.alu_lo[0] == 1) |
                        (self.src.alu_lo[1] == 1)))):
                 m.d.comb += exception.eq(1)
-                m.d.sync += mcause_latch.cause.eq(MCause.Cause.LOAD_MISALIGNED)
+                m.d.sync += [
+                    mcause_latch.cause.eq(MCause.Cause.LOAD_MISALIGNED),
+                    mcause_latch.interrupt.eq(0)
+                ]
         with m.Elif(self.src.ctrl.except_ctl == ExceptCtl.LATCH_JAL):
             with m.If(self.src.alu_lo[1] == 1):
                 m.d.comb += exception.eq(1)
-                m.d.sync += mcause_latch.cause.eq(MCause.Cause.INSN_MISALIGNED)
+                m.d.sync += [
+                    mcause_latch.cause.eq(MCause.Cause.INSN_MISALIGNED),
+                    mcause_latch.interrupt.eq(0)
+                ]
+        with m.Elif(self.src.ctrl.except_ctl == ExceptCtl.LATCH_BRANCH):
+            # Not-taken branches don't care about their target.
+            with m.If(self.src.branch_taken & (self.src.imm_lo[1] == 1)):
+                m.d.comb += exception.eq(1)
+                m.d.sync += [
+                    mcause_latch.cause.eq(MCause.Cause.INSN_MISALIGNED),
+                    mcause_latch.interrupt.eq(0)
+                ]
 
         return m
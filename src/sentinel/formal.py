@@ -5,15 +5,17 @@ from amaranth_soc import wishbone
 
 from .top import Top
 from .datapath import CSRFile
+from .decode import OpcodeType
 from .ucodefields import CSROp
 
 
 class FormalTop(Component):
     CHECK_INT_ADDR = 1
-    CSR_DECODE_VALIDITY_ADDR = 0x24
     EXCEPTION_HANDLER_ADDR = 240
 
-    def __init__(self):
+    # Only mhpmcounter3/mhpmevent3 have RVFI ports, so by default only
+    # implement that pair.
+    def __init__(self, *, num_hpm_counters=1):
         rvfi_sig = {
             "valid": Out(1),
             "order": Out(64),
@@ -67,11 +69,12 @@ class FormalTop(Component):
             "bus": Out(wishbone.Signature(addr_width=30, data_width=32,
                                           granularity=8)),
             "rvfi": Out(Signature(rvfi_sig)),
-            "irq": In(1)
+            "irq": In(1),
+            "timer_irq": In(1)
         }
 
         super().__init__(sig)
-        self.cpu = Top(formal=True)
+        self.cpu = Top(formal=True, num_hpm_counters=num_hpm_counters)
 
     def elaborate(self, plat):
         m = Module()
@@ -79,7 +82,10 @@ class FormalTop(Component):
         m.submodules.cpu = self.cpu
 
         connect(m, self.cpu.bus, flipped(self.bus))
-        m.d.comb += self.cpu.irq.eq(self.irq)
+        m.d.comb += [
+            self.cpu.irq.eq(self.irq),
+            self.cpu.timer_irq.eq(self.timer_irq),
+        ]
 
         # rs1/rs2_data helpers.
         w_port = self.cpu.datapath.regfile.w_port
@@ -352,6 +358,36 @@ class FormalTop(Component):
                     ]
                     m.d.comb += mepc_port.en.eq(0)
 
+        # Implemented HPM CSRs. Like MIP/MIE/MSTATUS, but the read data is
+        # registered separately so the loop below can still drive the
+        # mhpmcounter3h half.
+        if self.cpu.num_hpm_counters:
+            m.d.comb += [
+                self.rvfi.csr.mhpmevent3.rmask.eq(-1),
+                self.rvfi.csr.mhpmevent3.wmask.eq(-1),
+            ]
+
+            for adr, rvfi_csr, csr_r, width in [
+                    (CSRFile.MHPMCOUNTER3, self.rvfi.csr.mhpmcounter3,
+                     self.cpu.datapath.csr.mhpmcounter3_r, 32),
+                    (CSRFile.MHPMEVENT3, self.rvfi.csr.mhpmevent3,
+                     self.cpu.datapath.csr.mhpmevent3_r, 3)]:
+                rdata = Signal(32)
+                hold_rd = Signal(1)
+                m.d.comb += rvfi_csr.rdata.eq(rdata)
+
+                with m.If(committed_to_insn):
+                    m.d.sync += hold_rd.eq(0)
+                with m.If(~hold_rd):
+                    m.d.sync += rdata.eq(csr_r)
+                with m.If((self.cpu.control.csr.op == CSROp.WRITE_CSR) &
+                          (self.cpu.datapath.csr.adr == adr)):
+                    m.d.sync += [
+                        rvfi_csr.wdata[:32].eq(
+                            self.cpu.datapath.csr.dat_w[:width]),
+                        hold_rd.eq(1)
+                    ]
+
         # Read-only zero CSRs
         # Read-only ops are optimized, so we can't inspect the datapath for
         # their values. We'll have to manually construct the expected values
@@ -360,9 +396,14 @@ class FormalTop(Component):
         csr_op_shadow = Signal(3)
         doing_csr_decode = Signal()
 
-        # sync, since uPC points one ahead of currently executing insn :).
-        m.d.sync += doing_csr_decode.eq(self.cpu.control.ucoderom.addr ==
-                                        self.CSR_DECODE_VALIDITY_ADDR)
+        # CSR legality is known by the check_int cycle
+        # (just_committed_to_insn).
+        # Wait one more cycle so that RS1_RDATA and TRAP are valid.
+        csr_insn = Signal()
+        m.d.comb += csr_insn.eq((self.rvfi.insn[2:7] ==
+                                 OpcodeType.SYSTEM.value) &
+                                (self.rvfi.insn[12:14] != 0))
+        m.d.sync += doing_csr_decode.eq(just_committed_to_insn & csr_insn)
         with m.If(self.cpu.rvfi.decode.do_decode):
             m.d.sync += [
                 csr_addr_shadow.eq(self.cpu.rvfi.decode.funct12),
@@ -381,10 +422,17 @@ class FormalTop(Component):
                 (0xB82, "minstret", True), (0xB83, "mhpmcounter3", True),
                 (0x320, "mcountinhibit", False), (0x323, "mhpmevent3", False)]:
             rvfi_csr = getattr(self.rvfi.csr, csr_name)
+            # Implemented above, except for mhpmcounter3h.
+            if (csr_name in ("mhpmcounter3", "mhpmevent3") and
+                    self.cpu.num_hpm_counters):
+                if not hiword:
+                    continue
+            else:
+                m.d.comb += rvfi_csr.rdata.eq(0)
+
             m.d.comb += [
                 rvfi_csr.rmask.eq(-1),
                 rvfi_csr.wmask.eq(-1),
-                rvfi_csr.rdata.eq(0)
             ]
 
             # 64-bit registers. These are the only regs where we take
@@ -400,7 +448,7 @@ class FormalTop(Component):
 
             with m.If(doing_csr_decode):
                 # RVFI CSRW Check mandates this.
-                with m.If(self.cpu.rvfi.exception):
+                with m.If(self.rvfi.trap):
                     m.d.sync += self.rvfi.rd_addr.eq(0)
 
                 with m.If(csr_addr_shadow == addr):
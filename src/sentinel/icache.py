@@ -0,0 +1,155 @@
+from amaranth import Cat, Module, Signal
+from amaranth.lib.memory import Memory
+from amaranth.lib.wiring import Component, In, Out
+from amaranth.utils import exact_log2
+from amaranth_soc import wishbone
+
+
+# A direct-mapped, read-only insn cache between Top.bus and the interconnect,
+# for running from memory with many wait states. Insn fetches (as tagged by
+# Top(fetch_tag=True)'s insn_fetch) are looked up in the cache; hits are
+# ACKed after one wait state, like block RAM, and misses refill the whole
+# line from mem first. Everything else passes through to mem.
+#
+# Writes passing through invalidate the line their address maps to, so
+# stores to code are seen by later fetches. flush invalidates every line,
+# e.g. if something other than the core changes memory.
+class ICache(Component):
+    def __init__(self, *, num_lines=16, line_words=4):
+        for name, n in (("num_lines", num_lines),
+                        ("line_words", line_words)):
+            if n < 1 or n & (n - 1):
+                raise ValueError(f"{name} must be a power of 2, not {n}")
+
+        self.num_lines = num_lines
+        self.line_words = line_words
+        self.offset_bits = exact_log2(line_words)
+        self.index_bits = exact_log2(num_lines)
+
+        tag_bits = 30 - self.offset_bits - self.index_bits
+        if tag_bits < 1:
+            raise ValueError("cache covers the whole address space")
+
+        bus_signature = wishbone.Signature(addr_width=30, data_width=32,
+                                           granularity=8)
+        super().__init__({
+            "cpu": In(bus_signature),
+            "insn_fetch": In(1),
+            "mem": Out(bus_signature),
+            "flush": In(1),
+            # Fetches looked up since reset, for profiling.
+            "hits": Out(32),
+            "misses": Out(32),
+        })
+
+        self.data = Memory(shape=32, depth=num_lines * line_words, init=[])
+        self.tags = Memory(shape=tag_bits, depth=num_lines, init=[])
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.data = self.data
+        m.submodules.tags = self.tags
+
+        d_w = self.data.write_port()
+        d_r = self.data.read_port()
+        t_w = self.tags.write_port()
+        t_r = self.tags.read_port()
+
+        ob, ib = self.offset_bits, self.index_bits
+
+        # Fetch being looked up or refilled.
+        req_adr = Signal.like(self.cpu.adr)
+        req_index = req_adr[ob:ob + ib]
+        req_tag = req_adr[ob + ib:]
+        valid = Signal(self.num_lines)
+        # Next word of the line to refill, and the word the CPU asked for.
+        refill_cnt = Signal(ob)
+        refill_dat = Signal.like(self.cpu.dat_r)
+        # Whether the line being refilled was flushed along the way.
+        flushed = Signal()
+
+        fetch = self.cpu.cyc & self.cpu.stb & self.insn_fetch
+
+        m.d.comb += [
+            d_r.addr.eq(self.cpu.adr[:ob + ib]),
+            t_r.addr.eq(self.cpu.adr[ob:ob + ib]),
+            d_w.addr.eq(Cat(refill_cnt, req_index)),
+            d_w.data.eq(self.mem.dat_r),
+            t_w.addr.eq(req_index),
+            t_w.data.eq(req_tag),
+        ]
+
+        with m.FSM():
+            with m.State("IDLE"):
+                with m.If(fetch):
+                    m.d.sync += req_adr.eq(self.cpu.adr)
+                    m.next = "LOOKUP"
+                with m.Else():
+                    m.d.comb += [
+                        self.mem.cyc.eq(self.cpu.cyc),
+                        self.mem.stb.eq(self.cpu.stb),
+                        self.mem.we.eq(self.cpu.we),
+                        self.mem.adr.eq(self.cpu.adr),
+                        self.mem.sel.eq(self.cpu.sel),
+                        self.mem.dat_w.eq(self.cpu.dat_w),
+                        self.cpu.dat_r.eq(self.mem.dat_r),
+                        self.cpu.ack.eq(self.mem.ack),
+                    ]
+
+                    with m.If(self.cpu.cyc & self.cpu.stb & self.cpu.we &
+                              self.mem.ack):
+                        m.d.sync += valid.bit_select(
+                            self.cpu.adr[ob:ob + ib], 1).eq(0)
+
+            with m.State("LOOKUP"):
+                with m.If(valid.bit_select(req_index, 1) &
+                          (t_r.data == req_tag)):
+                    m.d.comb += [
+                        self.cpu.dat_r.eq(d_r.data),
+                        self.cpu.ack.eq(1),
+                    ]
+                    m.d.sync += self.hits.eq(self.hits + 1)
+                    m.next = "IDLE"
+                with m.Else():
+                    m.d.sync += [
+                        self.misses.eq(self.misses + 1),
+                        refill_cnt.eq(0),
+                        flushed.eq(0),
+                    ]
+                    m.next = "REFILL"
+
+            with m.State("REFILL"):
+                m.d.comb += [
+                    self.mem.cyc.eq(1),
+                    self.mem.stb.eq(1),
+                    self.mem.adr.eq(Cat(refill_cnt, req_adr[ob:])),
+                    self.mem.sel.eq(0xf),
+                    d_w.en.eq(self.mem.ack),
+                ]
+
+                with m.If(self.mem.ack):
+                    m.d.sync += refill_cnt.eq(refill_cnt + 1)
+                    with m.If(refill_cnt == req_adr[:ob]):
+                        m.d.sync += refill_dat.eq(self.mem.dat_r)
+
+                    with m.If(refill_cnt == self.line_words - 1):
+                        m.d.comb += t_w.en.eq(1)
+                        m.d.sync += valid.bit_select(req_index, 1).eq(
+                            ~flushed)
+                        m.next = "RESPOND"
+
+            with m.State("RESPOND"):
+                m.d.comb += [
+                    self.cpu.dat_r.eq(refill_dat),
+                    self.cpu.ack.eq(1),
+                ]
+                m.next = "IDLE"
+
+        with m.If(self.flush):
+            m.d.sync += [
+                valid.eq(0),
+                flushed.eq(1),
+            ]
+
+        return m
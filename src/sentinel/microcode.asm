@@ -1,4 +1,19 @@
+// The M extension and user microcode don't fit in 256 words; they need a
+// bigger ROM and a wider target field.
+#ifdef M_EXTENSION
+#define LARGE_ROM
+#endif
+#ifdef CUSTOM_MICROCODE
+#ifndef LARGE_ROM
+#define LARGE_ROM
+#endif
+#endif
+
+#ifdef LARGE_ROM
+space block_ram: width 49, size 512;
+#else
 space block_ram: width 48, size 256;
+#endif
 
 space block_ram;
 origin 0;
@@ -6,7 +21,11 @@ origin 0;
 fields block_ram: {
   // Target field for direct jmp_type. The micropc jumps to here next
   // cycle if the test succeeds.
+#ifdef LARGE_ROM
+  target: width 9, origin 0, default 0;
+#else
   target: width 8, origin 0, default 0;
+#endif
 
   // Various jump types to jump around the microcode program next cycle.
   // cont: Increment upc by 1.
@@ -18,7 +37,13 @@ fields block_ram: {
   //         cont.
   // direct_zero: Conditionally use address supplied by target field. Otherwise,
   //              0.
-  jmp_type: enum { cont = 0; nop = 0; map; direct; direct_zero; }, default cont;
+  // multiway: OR the test result (bit 0) and whether there's an exception
+  //           (bit 1) into the target field, which must be 4-word aligned.
+  //           This shares cont's encoding, so the field (and ROM) needn't be
+  //           wider: a cont whose cond_test is cmp_alu_o_zero or mem_valid,
+  //           which cont would otherwise ignore, is a multiway jump. So
+  //           multiway must use one of those tests, and cont mustn't.
+  jmp_type: enum { cont = 0; nop = 0; multiway = 0; map; direct; direct_zero; }, default cont;
 
   // Various tests (valid current cycle) for conditional jumps:
   // int: Is interrupt line high?
@@ -34,13 +59,17 @@ fields block_ram: {
   pc_action: enum { hold = 0; inc; load_alu_o; }, default hold;
 
   // ALU src latch/selection.
+  // vec_offset: 4*mcause_latch.cause if the CSR read data (MTVEC) is in
+  //             Vectored Mode and the exception is an interrupt, else 0.
   latch_a: bool, default 0;
   latch_b: bool, default 0;
-  a_src: enum { gp = 0; imm; alu_o; zero; four; neg_one; thirty_one; }, default gp;
+  a_src: enum { gp = 0; imm; alu_o; zero; four; neg_one; thirty_one; vec_offset; }, default gp;
   b_src: enum { gp = 0; pc; imm; one; dat_r; csr_imm; csr; mcause_latch }, default gp;
   // Latch the A/B inputs into the ALU. Contents vaid next cycle.
 
-  alu_op: enum { add = 0; sub; and; or; xor; sll; srl; sra; cmp_ltu; }, default add;
+  // mul*: Only implemented by the ALU if it has a hardware multiplier.
+  alu_op: enum { add = 0; sub; and; or; xor; sll; srl; sra; cmp_ltu; mul; \
+                 mulh; mulhsu; mulhu; }, default add;
   // Modify inputs and outputs to ALU.
   alu_i_mod: enum { none = 0; inv_msb_a_b; }, default none;
   alu_o_mod: enum { none = 0; inv_lsb_o; clear_lsb_o }, default none;
@@ -78,7 +107,7 @@ fields block_ram: {
   insn_fetch: bool, default 0;
 
   except_ctl: enum { none; latch_decoder; latch_jal; latch_store_adr; \
-                     latch_load_adr; enter_int; leave_int; }, default none;
+                     latch_load_adr; enter_int; leave_int; latch_branch; }, default none;
 };
 
 #define INSN_FETCH insn_fetch => 1, mem_req => 1
@@ -99,14 +128,21 @@ fields block_ram: {
 // to reuse the conditional meant for shift ops.
 #define CONDTEST_ALU_CMP_FAILED cond_test => cmp_alu_o_zero
 #define CONDTEST_ALU_NONZERO invert_test => 1, cond_test => cmp_alu_o_zero
+// Scratch registers live in the unused CSR addresses of the register file.
+// CSR reads share the GP read port, so a_src/b_src => gp latch whatever
+// scratch register was read last. Note that CSR writes clobber the read port
+// with RS1 as a side effect.
+#define READ_SCRATCH(n) csr_op => read_csr, csr_sel => trg_csr, target => n
+#define WRITE_SCRATCH(n) csr_op => write_csr, csr_sel => trg_csr, target => n
 
 fetch:
 wait_for_ack: INSN_FETCH_EAGER_READ_RS1, invert_test => 1, cond_test => mem_valid, \
                   jmp_type => direct, target => wait_for_ack;
               // Illegal insn or insn misaligned exception possible
-check_int:    jmp_type => map, a_src => gp, latch_a => 1, READ_RS2, \
-                  except_ctl => latch_decoder, cond_test => exception, \
-                  target => save_pc;
+              // RS1 is latched into both A and B; CSR ops rely on B.
+check_int:    jmp_type => map, a_src => gp, latch_a => 1, b_src => gp, \
+                  latch_b => 1, READ_RS2, except_ctl => latch_decoder, \
+                  cond_test => exception, target => save_pc;
 origin 2;
        // Make sure x0 is initialized with 0.
 reset: latch_a => 1, latch_b => 1, b_src => one, a_src => zero;
@@ -123,56 +159,70 @@ lbu_1: latch_b => 1, b_src => imm, pc_action => inc, jmp_type => direct, \
                 target => lbu;
 lhu_1: latch_b => 1, b_src => imm, jmp_type => direct, target => lhu;
 
+// Loads start the bus request in the same cycle they latch the address (and
+// check it for misalignment), and then multiway jump to a table:
+// +0: No ack yet; wait for it.
+// +1: Ack; pass through the loaded data.
+// +2: Misaligned; the request was never started.
+// +3: (Can't happen; the request isn't started for misaligned addresses.)
 lb: alu_op => add;
-    latch_adr => 1;
+lb_req:   latch_adr => 1, a_src => zero, b_src => dat_r, latch_a => 1, latch_b => 1, \
+              mem_req => 1, cond_test => mem_valid, mem_sel => byte, mem_extend => sign, \
+              jmp_type => multiway, target => lb_wait;
+// Byte loads can't be misaligned, so +2/+3 of their tables are free.
 lb_wait:  a_src => zero, b_src => dat_r, latch_a => 1, latch_b => 1, mem_req => 1, invert_test => 1, \
               cond_test => mem_valid, mem_sel => byte, mem_extend => sign, jmp_type => direct, \
               target => lb_wait;
           alu_op => add, JUMP_TO_OP_END(fast_epilog);
 
+lbu: alu_op => add;
+lbu_req:  latch_adr => 1, a_src => zero, b_src => dat_r, latch_a => 1, latch_b => 1, \
+              mem_req => 1, cond_test => mem_valid, mem_sel => byte, \
+              jmp_type => multiway, target => lbu_wait;
+lbu_wait:  a_src => zero, b_src => dat_r, latch_a => 1, latch_b => 1, mem_req => 1, invert_test => 1, \
+              cond_test => mem_valid, mem_sel => byte, jmp_type => direct, \
+              target => lbu_wait;
+           alu_op => add, JUMP_TO_OP_END(fast_epilog);
+
 lh: alu_op => add;
-    latch_adr => 1, except_ctl => latch_load_adr, mem_sel => hword, \
-            jmp_type => direct, cond_test => exception, target => save_pc;
+lh_req:   latch_adr => 1, except_ctl => latch_load_adr, a_src => zero, b_src => dat_r, \
+              latch_a => 1, latch_b => 1, mem_req => 1, cond_test => mem_valid, \
+              mem_sel => hword, mem_extend => sign, jmp_type => multiway, target => lh_wait;
 lh_wait:  a_src => zero, b_src => dat_r, latch_a => 1, latch_b => 1, mem_req => 1, invert_test => 1, \
               cond_test => mem_valid, mem_sel => hword, mem_extend => sign, jmp_type => direct, \
               target => lh_wait;
           alu_op => add, pc_action => inc, JUMP_TO_OP_END(fast_epilog);
+          jmp_type => direct, target => save_pc;
 
-lw: alu_op => add;
-    latch_adr => 1, except_ctl => latch_load_adr, mem_sel => word, \
-            jmp_type => direct, cond_test => exception, target => save_pc;
+lw: alu_op => add, jmp_type => direct, target => lw_req;
 lw_wait:  a_src => zero, b_src => dat_r, latch_a => 1, latch_b => 1, mem_req => 1, invert_test => 1, \
               cond_test => mem_valid, mem_sel => word, jmp_type => direct, \
               target => lw_wait;
           alu_op => add, pc_action => inc, JUMP_TO_OP_END(fast_epilog);
+          jmp_type => direct, target => save_pc;
+lw_req:   latch_adr => 1, except_ctl => latch_load_adr, a_src => zero, b_src => dat_r, \
+              latch_a => 1, latch_b => 1, mem_req => 1, cond_test => mem_valid, \
+              mem_sel => word, jmp_type => multiway, target => lw_wait;
 
-lbu: alu_op => add;
-     latch_adr => 1;
-lbu_wait:  a_src => zero, b_src => dat_r, latch_a => 1, latch_b => 1, mem_req => 1, invert_test => 1, \
-              cond_test => mem_valid, mem_sel => byte, jmp_type => direct, \
-              target => lbu_wait;
-           alu_op => add, JUMP_TO_OP_END(fast_epilog);
-
-lhu: alu_op => add;
-     latch_adr => 1, except_ctl => latch_load_adr, mem_sel => hword, \
-            jmp_type => direct, cond_test => exception, target => save_pc;
 lhu_wait:  a_src => zero, b_src => dat_r, latch_a => 1, latch_b => 1, mem_req => 1, invert_test => 1, \
               cond_test => mem_valid, mem_sel => hword, jmp_type => direct, \
               target => lhu_wait;
            alu_op => add, pc_action => inc, JUMP_TO_OP_END(fast_epilog);
+           jmp_type => direct, target => save_pc;
+lhu: alu_op => add;
+lhu_req:  latch_adr => 1, except_ctl => latch_load_adr, a_src => zero, b_src => dat_r, \
+              latch_a => 1, latch_b => 1, mem_req => 1, cond_test => mem_valid, \
+              mem_sel => hword, jmp_type => multiway, target => lhu_wait;
 
-origin 0x24;
-// CSR ops take two cycles to decode. This is effectively a no-op in case
-// there's an illegal CSR access or something.
-csr_trampoline: READ_RS1, jmp_type => map, except_ctl => latch_decoder, \
-                     cond_test => exception, target => save_pc;
+origin 0x25;
+// CSR legality is checked by check_int like any other insn. B holds RS1
+// on entry.
 csrro0_1: a_src => zero, b_src => one, latch_a => 1, latch_b => 1, pc_action => inc, \
             jmp_type => direct, target => csrro0;
-csrw_1: a_src => zero, b_src => gp, latch_a => 1, latch_b => 1, pc_action => inc, \
+csrw_1: a_src => zero, latch_a => 1, pc_action => inc, \
             jmp_type => direct, target => csrwi;
 csrrw_1: csr_op => read_csr, csr_sel => insn_csr, a_src => zero, latch_a => 1, \
-            b_src => gp, latch_b => 1, pc_action => inc, jmp_type => direct, \
-            target => csrrwi;  
+            pc_action => inc, jmp_type => direct, target => csrrwi;
 csrr_1: csr_op => read_csr, csr_sel => insn_csr, a_src => zero, latch_a => 1, \
             pc_action => inc, jmp_type => direct, target => csrr;   
 csrrs_1: csr_op => read_csr, csr_sel => insn_csr, a_src => zero, latch_a => 1, \
@@ -251,7 +301,6 @@ xori:         alu_op => xor, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
 ori:          alu_op => or, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
 andi:         alu_op => and, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
 
-              // Need 3-way jump! alu_op => sll, jmp_type => direct, cond_test => alu_ready, target => imm_ops_end;
 slli:
               // Re: READ_RS1... the reg values read out of the GP file are
               // sticky, but as part of pipelining, we read out RS2's value
@@ -259,48 +308,72 @@ slli:
               // This was a bad assumption, so we need to latch RS1 from the
               // file again.
               READ_RS1, a_src => zero, latch_a => 1;
-              // Bail if shift count was initially zero.
               a_src => gp, b_src => imm, latch_a => 1, latch_b => 1, alu_op => add;
+              // Start the loop, or bail if shift count was initially zero.
               READ_RS1, a_src => imm, b_src => one, latch_a => 1, latch_b => 1, alu_op => sll, \
-                  jmp_type => direct, cond_test => cmp_alu_o_zero, target => shift_zero;
+                  cond_test => cmp_alu_o_zero, jmp_type => multiway, target => sll_loop;
+
+srli:
+              // Same comments as slli apply here.
+              READ_RS1, a_src => zero, latch_a => 1;
+              a_src => gp, b_src => imm, latch_a => 1, latch_b => 1, alu_op => add;
+              READ_RS1, a_src => imm, b_src => one, latch_a => 1, latch_b => 1, alu_op => srl, \
+                  cond_test => cmp_alu_o_zero, jmp_type => multiway, target => srl_loop;
+
+srai:
+              // Same comments as slli apply here.
+              // We AND here because imm12 will have a hardcoded "1" outside
+              // the 5 LSBs.
+              READ_RS1, a_src => thirty_one, latch_a => 1;
+              a_src => gp, latch_a => 1, alu_op => and;
+              READ_RS1, a_src => alu_o, b_src => one, latch_a => 1, latch_b => 1, alu_op => sra, \
+                  cond_test => cmp_alu_o_zero, jmp_type => multiway, target => sra_loop;
+
+// Shift loops are multiway jump tables, entered with the shift count in
+// alu_o:
+// +0: Nonzero shift count; loop.
+// +1: Zero shift count; pass RS1 through unmodified.
+// +2: Second half of the loop.
+origin 0x64;
 sll_loop:
               // Subtract 1 from shift cnt, preliminarily save shift results
               // in case we bail (microcode cannot be interrupted, so user
               // will never see this intermediate result).
               // Also write the previous shift, either from prolog or last
               // loop iteration.
-              alu_op => sub, a_src => alu_o, latch_a => 1, WRITE_RD;
+              alu_op => sub, a_src => alu_o, latch_a => 1, WRITE_RD, \
+                  jmp_type => direct, cond_test => true, target => sll_loop_2;
+              a_src => zero, b_src => gp, latch_a => 1, latch_b => 1, \
+                  jmp_type => direct, cond_test => true, target => shift_zero;
+sll_loop_2:
               // Then, do the shift, and bail if the shift cnt reached zero.
               alu_op => sll, a_src => alu_o, b_src => one, latch_a => 1, latch_b => 1, \
                   jmp_type => direct_zero, CONDTEST_ALU_NONZERO, target => sll_loop;
 
-srli:
-              // Same comments as slli apply here.
-              READ_RS1, a_src => zero, latch_a => 1;
-              a_src => gp, b_src => imm, latch_a => 1, latch_b => 1, alu_op => add;
-              READ_RS1, a_src => imm, b_src => one, latch_a => 1, latch_b => 1, alu_op => srl,
-                  jmp_type => direct, cond_test => cmp_alu_o_zero, target => shift_zero;
+shift_zero:   alu_op => add, JUMP_TO_OP_END(fast_epilog);
+
 srl_loop:
-              alu_op => sub, a_src => alu_o, latch_a => 1, WRITE_RD;
+              alu_op => sub, a_src => alu_o, latch_a => 1, WRITE_RD, \
+                  jmp_type => direct, cond_test => true, target => srl_loop_2;
+              a_src => zero, b_src => gp, latch_a => 1, latch_b => 1, \
+                  jmp_type => direct, cond_test => true, target => shift_zero;
+srl_loop_2:
               alu_op => srl, a_src => alu_o, b_src => one, latch_a => 1, latch_b => 1, \
                   jmp_type => direct_zero, CONDTEST_ALU_NONZERO, target => srl_loop;
 
-srai:
-              // Same comments as slli apply here.
-              // We AND here because imm12 will have a hardcoded "1" outside
-              // the 5 LSBs.
-              READ_RS1, a_src => thirty_one, latch_a => 1;
-              a_src => gp, latch_a => 1, alu_op => and;
-              READ_RS1, a_src => alu_o, b_src => one, latch_a => 1, latch_b => 1, alu_op => sra,
-                  jmp_type => direct, cond_test => cmp_alu_o_zero, target => shift_zero;
+origin 0x6c;
 sra_loop:
-              alu_op => sub, a_src => alu_o, latch_a => 1, WRITE_RD;
+              alu_op => sub, a_src => alu_o, latch_a => 1, WRITE_RD, \
+                  jmp_type => direct, cond_test => true, target => sra_loop_2;
+              a_src => zero, b_src => gp, latch_a => 1, latch_b => 1, \
+                  jmp_type => direct, cond_test => true, target => shift_zero;
+sra_loop_2:
               // Then, do the shift, and bail if the shift cnt reached zero.
               alu_op => sra, a_src => alu_o, b_src => one, latch_a => 1, latch_b => 1, \
                   jmp_type => direct_zero, CONDTEST_ALU_NONZERO, target => sra_loop;
 
-shift_zero:   a_src => zero, b_src => gp, latch_a => 1, latch_b => 1;
-              alu_op => add, JUMP_TO_OP_END(fast_epilog);
+// 0x70-0x7f: CUSTOM_0 map slots. UCodeROM fills these in with entry points
+// into user microcode, which is assembled after this file.
 
 origin 0x80;
 sb_1: READ_RS2, latch_b => 1, b_src => imm, pc_action => inc, jmp_type => direct, \
@@ -308,6 +381,15 @@ sb_1: READ_RS2, latch_b => 1, b_src => imm, pc_action => inc, jmp_type => direct
 sh_1: READ_RS2, latch_b => 1, b_src => imm, jmp_type => direct, target => sh;
 sw_1: READ_RS2, latch_b => 1, b_src => imm, jmp_type => direct, target => sw;
 
+// Branches multiway jump here once the comparison's done:
+// +0: Taken.
+// +1: Not taken.
+// +2: Taken, but the target is misaligned.
+origin 0x84;
+taken:  jmp_type => direct, cond_test => true, target => fetch, pc_action => load_alu_o;
+not_taken: pc_action => inc, jmp_type => direct, target => fetch;
+        jmp_type => direct, target => save_pc;
+
 origin 0x88;
 branch_ops:
 beq_1: latch_b => 1, b_src => gp, jmp_type => direct, target => beq;
@@ -329,10 +411,10 @@ bltu: a_src => imm, b_src => pc, latch_a => 1, latch_b => 1, alu_op => cmp_ltu,
 bgeu: a_src => imm, b_src => pc, latch_a => 1, latch_b => 1, CMP_GEU, \
         jmp_type => direct, target => branch_epilog;
 
-branch_epilog: alu_op => add, CONDTEST_ALU_CMP_FAILED, jmp_type => direct, target => not_taken;
-taken:  except_ctl => latch_jal, jmp_type => direct, cond_test => exception, target => save_pc;
-        jmp_type => direct, cond_test => true, target => fetch, pc_action => load_alu_o;
-not_taken: pc_action => inc, jmp_type => direct, target => fetch;
+// Compute the target while checking the comparison, and whether the target
+// is misaligned if we're taking the branch.
+branch_epilog: alu_op => add, except_ctl => latch_branch, CONDTEST_ALU_CMP_FAILED, \
+                   jmp_type => multiway, target => taken;
 
 origin 0x98;
 jalr: b_src => imm, latch_b => 1; 
@@ -369,10 +451,8 @@ sw_wait:  mem_req => 1, invert_test => 1, cond_test => mem_valid, \
               mem_sel => word, write_mem => 1, jmp_type => direct_zero, target => sw_wait;
 
 beq: a_src => imm, b_src => pc, latch_a => 1, latch_b => 1, alu_op => sub;
-     alu_op => add, invert_test => 1, cond_test => cmp_alu_o_zero, jmp_type => direct, \
-         target => not_taken;
-     except_ctl => latch_jal, jmp_type => direct, cond_test => exception, target => save_pc;
-     jmp_type => direct, cond_test => true, target => fetch, pc_action => load_alu_o;
+     alu_op => add, except_ctl => latch_branch, invert_test => 1, \
+         cond_test => cmp_alu_o_zero, jmp_type => multiway, target => taken;
 
 bne: a_src => imm, b_src => pc, latch_a => 1, latch_b => 1, alu_op => sub, \
         jmp_type => direct, target => branch_epilog;
@@ -426,29 +506,66 @@ or:           alu_op => or, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
 and:          alu_op => and, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
 sub:          alu_op => sub, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
 
-             // Re: add; pass through RS2 unmodified, and check whether 5 LSBs
-             // were zero. The shift loops above can be reused once we do
-             // the initial zero check.
+             // Mask RS2 to its 5 LSBs; the shift loops above then check
+             // whether it's zero.
 sll:
              READ_RS1, a_src => thirty_one, latch_a => 1;
              READ_RS2, a_src => gp, latch_a => 1, alu_op => and;
-             a_src => alu_o, b_src => one, latch_a => 1, latch_b => 1, alu_op => sll,
-                  jmp_type => direct, CONDTEST_ALU_NONZERO, target => sll_loop;
-             READ_RS1, jmp_type => direct, target => shift_zero;
+             READ_RS1, a_src => alu_o, b_src => one, latch_a => 1, latch_b => 1, alu_op => sll, \
+                  cond_test => cmp_alu_o_zero, jmp_type => multiway, target => sll_loop;
 
-srl:  
+srl:
              READ_RS1, a_src => thirty_one, latch_a => 1;
              READ_RS2, a_src => gp, latch_a => 1, alu_op => and;
-             a_src => alu_o, b_src => one, latch_a => 1, latch_b => 1, alu_op => srl,
-                  jmp_type => direct, CONDTEST_ALU_NONZERO, target => srl_loop;
-             READ_RS1, jmp_type => direct, target => shift_zero;
+             READ_RS1, a_src => alu_o, b_src => one, latch_a => 1, latch_b => 1, alu_op => srl, \
+                  cond_test => cmp_alu_o_zero, jmp_type => multiway, target => srl_loop;
 
-sra:  
+sra:
              READ_RS1, a_src => thirty_one, latch_a => 1;
              READ_RS2, a_src => gp, latch_a => 1, alu_op => and;
-             a_src => alu_o, b_src => one, latch_a => 1, latch_b => 1, alu_op => sra,
-                  jmp_type => direct, CONDTEST_ALU_NONZERO, target => sra_loop;
-             READ_RS1, jmp_type => direct, target => shift_zero;
+             READ_RS1, a_src => alu_o, b_src => one, latch_a => 1, latch_b => 1, alu_op => sra, \
+                  cond_test => cmp_alu_o_zero, jmp_type => multiway, target => sra_loop;
+
+#ifdef M_EXTENSION
+// M extension. On entry, RS1 is latched into A and B, and RS2 is on the GP
+// read port. Routines without a hardware multiplier keep their state in
+// scratch registers.
+
+#ifdef HW_MULTIPLIER
+origin 0xe4;
+mul:          alu_op => mul, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
+mulh:         alu_op => mulh, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
+mulhsu:       alu_op => mulhsu, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
+mulhu:        alu_op => mulhu, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
+
+mul_1:        latch_b => 1, b_src => gp, pc_action => inc, jmp_type => direct, \
+                    target => mul;
+mulh_1:       latch_b => 1, b_src => gp, pc_action => inc, jmp_type => direct, \
+                    target => mulh;
+mulhsu_1:     latch_b => 1, b_src => gp, pc_action => inc, jmp_type => direct, \
+                    target => mulhsu;
+mulhu_1:      latch_b => 1, b_src => gp, pc_action => inc, jmp_type => direct, \
+                    target => mulhu;
+#else
+origin 0xe8;
+mul_1:        alu_op => and, a_src => zero, latch_a => 1, b_src => gp, latch_b => 1, \
+                    pc_action => inc, jmp_type => direct, target => mul;
+mulh_1:       a_src => gp, latch_a => 1, b_src => gp, latch_b => 1, \
+                    pc_action => inc, jmp_type => direct, target => mulh;
+mulhsu_1:     alu_op => xor, pc_action => inc, jmp_type => direct, \
+                    target => mulh_corr;
+mulhu_1:      alu_op => xor, pc_action => inc, jmp_type => direct, \
+                    target => mulhu;
+#endif
+div_1:        a_src => zero, latch_a => 1, b_src => gp, latch_b => 1, \
+                    pc_action => inc, jmp_type => direct, target => div;
+divu_1:       a_src => zero, latch_a => 1, b_src => gp, latch_b => 1, \
+                    pc_action => inc, jmp_type => direct, target => divu;
+rem_1:        a_src => zero, latch_a => 1, b_src => gp, latch_b => 1, \
+                    pc_action => inc, jmp_type => direct, target => rem;
+remu_1:       a_src => zero, latch_a => 1, b_src => gp, latch_b => 1, \
+                    pc_action => inc, jmp_type => direct, target => remu;
+#endif
 
 // Interrupt handler.
 #define MSTATUS 0
@@ -462,12 +579,13 @@ sra:
 origin 0xf0;
 save_pc: except_ctl => enter_int, csr_op => read_csr, csr_sel => trg_csr, \
             a_src => zero, b_src => pc, latch_a => 1, latch_b => 1, target => MTVEC;
-         // Latch MTVEC, pass thru PC.
-         alu_op => add, b_src => csr, latch_b => 1;
-         // Read mcause_latch, write MEPC, pass thru MTVEC.
-         alu_op => add, b_src => mcause_latch, latch_b => 1, csr_op => write_csr, \
-            csr_sel => trg_csr, target => MEPC;
-         // Write PC, pass thru mcause_latch
+         // Latch MTVEC and the vector offset, pass thru PC.
+         alu_op => add, a_src => vec_offset, latch_a => 1, b_src => csr, \
+            latch_b => 1;
+         // Read mcause_latch, write MEPC, add MTVEC BASE and vector offset.
+         alu_op => add, a_src => zero, latch_a => 1, b_src => mcause_latch, \
+            latch_b => 1, csr_op => write_csr, csr_sel => trg_csr, target => MEPC;
+         // Write PC (MODE bits are dropped), pass thru mcause_latch
          alu_op => add, pc_action => load_alu_o;
          // Write MCAUSE, and start exception handler.
          INSN_FETCH, jmp_type => direct_zero, invert_test => 1, cond_test => true, \
@@ -489,3 +607,261 @@ origin 254;
 halt: jmp_type => direct, target => halt;
 origin 255;
 panic: jmp_type => direct, target => panic;
+
+#ifdef M_EXTENSION
+#define MUL_Q 0x1
+#define MUL_M 0x2
+#define MUL_P 0x3
+#define MUL_MH 0x6
+#define MUL_PH 0x7
+
+#define DIV_N 0x1
+#define DIV_R 0x2
+#define DIV_D 0x3
+#define DIV_CNT 0x6
+#define DIV_NEG 0x7
+#define DIV_REM 0xB
+
+origin 0x100;
+#ifndef HW_MULTIPLIER
+// Shift-and-add multiply. The multiplier (RS2) is shifted right, and the
+// multiplicand (RS1) left, until the multiplier runs out of set bits.
+mul:          WRITE_SCRATCH(MUL_M), alu_op => and;
+              WRITE_SCRATCH(MUL_P), alu_op => add;
+mul_loop:     a_src => alu_o, latch_a => 1, b_src => one, latch_b => 1, \
+                  jmp_type => direct, cond_test => cmp_alu_o_zero, target => mul_done;
+              alu_op => and, READ_SCRATCH(MUL_M);
+              // A holds the multiplicand from here on.
+              alu_op => srl, a_src => gp, latch_a => 1, jmp_type => direct, \
+                  cond_test => cmp_alu_o_zero, target => mul_skip;
+              WRITE_SCRATCH(MUL_Q);
+              READ_SCRATCH(MUL_P);
+              b_src => gp, latch_b => 1;
+              alu_op => add;
+              WRITE_SCRATCH(MUL_P), alu_op => sll;
+              WRITE_SCRATCH(MUL_M);
+              READ_SCRATCH(MUL_Q);
+              a_src => zero, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => add, jmp_type => direct, target => mul_loop;
+mul_skip:     WRITE_SCRATCH(MUL_Q), alu_op => sll;
+              WRITE_SCRATCH(MUL_M);
+              READ_SCRATCH(MUL_Q);
+              a_src => zero, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => add, jmp_type => direct, target => mul_loop;
+mul_done:     READ_SCRATCH(MUL_P);
+              a_src => zero, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => add, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
+
+// The high multiplies are done unsigned with a 64-bit product and
+// multiplicand. Signed operands are corrected for by subtracting the other
+// operand from the high word of the product for each negative operand;
+// the correction is the initial value of the product's high word.
+//
+// x < 0 iff (x << 1) <u x.
+mulh:         alu_op => add;
+              a_src => alu_o, latch_a => 1;
+              alu_op => cmp_ltu, a_src => zero, latch_a => 1, READ_RS1;
+              b_src => gp, latch_b => 1, jmp_type => direct, \
+                  cond_test => cmp_alu_o_zero, target => mulh_rs2_pos;
+              alu_op => sub, jmp_type => direct, target => mulh_corr;
+mulh_rs2_pos: alu_op => and;
+mulh_corr:    WRITE_SCRATCH(MUL_PH);
+              READ_RS1;
+              a_src => gp, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => add;
+              a_src => alu_o, latch_a => 1;
+              alu_op => cmp_ltu, READ_SCRATCH(MUL_PH);
+              a_src => gp, latch_a => 1, READ_RS2, jmp_type => direct, \
+                  cond_test => cmp_alu_o_zero, target => mulhu_setup;
+              b_src => gp, latch_b => 1;
+              alu_op => sub, jmp_type => direct, target => mulhu;
+mulhu:        WRITE_SCRATCH(MUL_PH);
+mulhu_setup:  READ_RS1, a_src => zero, latch_a => 1;
+              b_src => gp, latch_b => 1;
+              alu_op => add, READ_RS2;
+              WRITE_SCRATCH(MUL_M), alu_op => and, b_src => gp, latch_b => 1;
+              WRITE_SCRATCH(MUL_MH), alu_op => and;
+              WRITE_SCRATCH(MUL_P), alu_op => add;
+mulh_loop:    a_src => alu_o, latch_a => 1, b_src => one, latch_b => 1, \
+                  jmp_type => direct, cond_test => cmp_alu_o_zero, target => mulh_done;
+              alu_op => and;
+              alu_op => srl, jmp_type => direct, cond_test => cmp_alu_o_zero, \
+                  target => mulh_skip;
+              // Add the multiplicand to the product, carrying into the
+              // high word.
+              WRITE_SCRATCH(MUL_Q);
+              READ_SCRATCH(MUL_M);
+              a_src => gp, latch_a => 1, READ_SCRATCH(MUL_P);
+              b_src => gp, latch_b => 1;
+              alu_op => add;
+              WRITE_SCRATCH(MUL_P), a_src => alu_o, latch_a => 1;
+              alu_op => cmp_ltu, READ_SCRATCH(MUL_PH);
+              a_src => alu_o, latch_a => 1, b_src => gp, latch_b => 1, \
+                  READ_SCRATCH(MUL_MH);
+              alu_op => add, b_src => gp, latch_b => 1;
+              a_src => alu_o, latch_a => 1;
+              alu_op => add;
+              WRITE_SCRATCH(MUL_PH);
+              // Shift the 64-bit multiplicand left.
+              READ_SCRATCH(MUL_M);
+mulh_shift:   a_src => gp, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => add;
+              WRITE_SCRATCH(MUL_M), a_src => alu_o, latch_a => 1;
+              alu_op => cmp_ltu, READ_SCRATCH(MUL_MH);
+              a_src => alu_o, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => add;
+              a_src => alu_o, latch_a => 1;
+              alu_op => add;
+              WRITE_SCRATCH(MUL_MH);
+              READ_SCRATCH(MUL_Q);
+              a_src => zero, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => add, jmp_type => direct, target => mulh_loop;
+mulh_skip:    WRITE_SCRATCH(MUL_Q);
+              READ_SCRATCH(MUL_M);
+              jmp_type => direct, target => mulh_shift;
+mulh_done:    READ_SCRATCH(MUL_PH);
+              a_src => zero, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => add, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
+#endif
+
+// Restoring division on the magnitudes of the operands. Quotient bits are
+// shifted into the dividend as it's shifted out into the remainder.
+// Division by zero is handled up front. Divisors with the MSB set would
+// overflow the shifted remainder, and have a quotient of 0 or 1 anyway, so
+// they're special-cased too.
+//
+// DIV_REM is nonzero if the remainder is wanted, and DIV_NEG is a mask
+// (0 or -1) for negating the result. x <s 1 is good enough for a sign test
+// since the magnitude of 0 is 0 anyway.
+div:          alu_op => add;
+              alu_op => and, jmp_type => direct, cond_test => cmp_alu_o_zero, \
+                  target => div_by_zero;
+              WRITE_SCRATCH(DIV_REM), alu_op => add;
+              a_src => alu_o, latch_a => 1, b_src => one, latch_b => 1;
+              CMP_LT, a_src => zero, latch_a => 1, READ_RS2;
+              b_src => gp, latch_b => 1, jmp_type => direct, \
+                  cond_test => cmp_alu_o_zero, target => div_pos_d;
+              alu_op => sub;
+              WRITE_SCRATCH(DIV_D), a_src => neg_one, latch_a => 1;
+              alu_op => or, jmp_type => direct, target => div_sign_n;
+div_pos_d:    alu_op => add;
+              WRITE_SCRATCH(DIV_D), alu_op => and;
+              alu_op => and, jmp_type => direct, target => div_sign_n;
+
+rem:          alu_op => add;
+              alu_op => add, jmp_type => direct, cond_test => cmp_alu_o_zero, \
+                  target => rem_by_zero;
+              WRITE_SCRATCH(DIV_REM), alu_op => add;
+              a_src => alu_o, latch_a => 1, b_src => one, latch_b => 1;
+              CMP_LT, a_src => zero, latch_a => 1, READ_RS2;
+              b_src => gp, latch_b => 1, jmp_type => direct, \
+                  cond_test => cmp_alu_o_zero, target => rem_pos_d;
+              alu_op => sub;
+              WRITE_SCRATCH(DIV_D), alu_op => and;
+              alu_op => and, jmp_type => direct, target => div_sign_n;
+rem_pos_d:    alu_op => add;
+              WRITE_SCRATCH(DIV_D), alu_op => and;
+              alu_op => and;
+
+div_sign_n:   WRITE_SCRATCH(DIV_NEG);
+              READ_RS1;
+              a_src => gp, latch_a => 1, b_src => one, latch_b => 1;
+              CMP_LT, a_src => zero, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => add, jmp_type => direct, cond_test => cmp_alu_o_zero, \
+                  target => div_pos_n;
+              alu_op => sub, READ_SCRATCH(DIV_NEG);
+              WRITE_SCRATCH(DIV_N), a_src => neg_one, latch_a => 1, b_src => gp, \
+                  latch_b => 1;
+              alu_op => sub;
+              WRITE_SCRATCH(DIV_NEG);
+div_setup:    a_src => zero, latch_a => 1;
+div_setup_1:  alu_op => and;
+              WRITE_SCRATCH(DIV_R), a_src => thirty_one, latch_a => 1, b_src => one, \
+                  latch_b => 1;
+              alu_op => add;
+              WRITE_SCRATCH(DIV_CNT);
+              READ_SCRATCH(DIV_D);
+              a_src => gp, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => add;
+              a_src => alu_o, latch_a => 1;
+              alu_op => cmp_ltu;
+              jmp_type => direct, CONDTEST_ALU_NONZERO, target => div_big;
+div_loop:     READ_SCRATCH(DIV_N);
+              a_src => gp, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => add;
+              WRITE_SCRATCH(DIV_N), a_src => alu_o, latch_a => 1;
+              // Shift the dividend's MSB into the remainder.
+              alu_op => cmp_ltu, READ_SCRATCH(DIV_R);
+              a_src => alu_o, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => add;
+              a_src => alu_o, latch_a => 1;
+              alu_op => add, READ_SCRATCH(DIV_D);
+              WRITE_SCRATCH(DIV_R), a_src => alu_o, latch_a => 1, b_src => gp, \
+                  latch_b => 1;
+              alu_op => cmp_ltu;
+              alu_op => sub, jmp_type => direct, CONDTEST_ALU_NONZERO, \
+                  target => div_count;
+              WRITE_SCRATCH(DIV_R);
+              READ_SCRATCH(DIV_N);
+              a_src => gp, latch_a => 1, b_src => one, latch_b => 1;
+              alu_op => or;
+              WRITE_SCRATCH(DIV_N);
+div_count:    READ_SCRATCH(DIV_CNT);
+              a_src => gp, latch_a => 1, b_src => one, latch_b => 1;
+              alu_op => sub;
+              WRITE_SCRATCH(DIV_CNT), alu_op => sub;
+              jmp_type => direct, CONDTEST_ALU_NONZERO, target => div_loop;
+div_done:     READ_SCRATCH(DIV_REM);
+              a_src => zero, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => add;
+              jmp_type => direct, cond_test => cmp_alu_o_zero, target => div_quo;
+              READ_SCRATCH(DIV_R);
+              b_src => gp, latch_b => 1, jmp_type => direct, target => div_negate;
+div_quo:      READ_SCRATCH(DIV_N);
+              b_src => gp, latch_b => 1;
+div_negate:   READ_SCRATCH(DIV_NEG);
+              a_src => gp, latch_a => 1;
+              alu_op => xor;
+              a_src => alu_o, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => sub, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
+
+div_pos_n:    WRITE_SCRATCH(DIV_N);
+              a_src => zero, latch_a => 1, jmp_type => direct, target => div_setup_1;
+
+divu:         alu_op => add;
+              alu_op => and, jmp_type => direct, cond_test => cmp_alu_o_zero, \
+                  target => div_by_zero;
+              WRITE_SCRATCH(DIV_REM), alu_op => add;
+divu_d:       WRITE_SCRATCH(DIV_D), alu_op => and;
+              WRITE_SCRATCH(DIV_NEG);
+              READ_RS1;
+              b_src => gp, latch_b => 1;
+              alu_op => add, jmp_type => direct, target => div_pos_n;
+remu:         alu_op => add;
+              alu_op => add, jmp_type => direct, cond_test => cmp_alu_o_zero, \
+                  target => rem_by_zero;
+              WRITE_SCRATCH(DIV_REM), alu_op => add;
+              alu_op => add, jmp_type => direct, target => divu_d;
+
+div_big:      READ_SCRATCH(DIV_N);
+              a_src => gp, latch_a => 1, READ_SCRATCH(DIV_D);
+              b_src => gp, latch_b => 1;
+              CMP_GEU;
+              alu_op => sub, jmp_type => direct, cond_test => cmp_alu_o_zero, \
+                  target => div_big_lt;
+              WRITE_SCRATCH(DIV_R), CMP_GEU;
+              WRITE_SCRATCH(DIV_N);
+              jmp_type => direct, target => div_done;
+div_big_lt:   READ_SCRATCH(DIV_N);
+              a_src => zero, latch_a => 1, b_src => gp, latch_b => 1;
+              alu_op => add;
+              WRITE_SCRATCH(DIV_R), alu_op => and;
+              WRITE_SCRATCH(DIV_N);
+              jmp_type => direct, target => div_done;
+
+div_by_zero:  a_src => neg_one, latch_a => 1;
+              alu_op => or, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
+rem_by_zero:  READ_RS1, a_src => zero, latch_a => 1;
+              b_src => gp, latch_b => 1;
+              alu_op => add, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
+#endif
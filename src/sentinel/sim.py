@@ -0,0 +1,152 @@
+import argparse
+import sys
+from dataclasses import dataclass
+
+from amaranth.sim import Simulator
+
+from .top import Top
+
+
+# Same protocol as the riscv-tests binaries in tests/upstream: firmware
+# writes (exit_code << 1) | 1 to HOST_ADDR to stop the simulation.
+HOST_ADDR = 0x4000000
+# Same registers as AttoSoC's WBSerial on the Wishbone peripheral bus:
+# rxtx at +0, and irq status (TX << 1 | RX) at +4. Bytes are sent instantly
+# and none are received, so the other registers just read as 0.
+SERIAL_ADDR = 0x80000000
+
+
+@dataclass
+class SimResult:
+    cycles: int
+    insns: int
+    # None if max_cycles ran out first.
+    exit_code: int | None
+
+    @property
+    def cpi(self):
+        return self.cycles / self.insns if self.insns else float("nan")
+
+
+def load_elf(fn, mem_size):
+    # Defer import; pyelftools is only needed for this CLI and the examples.
+    from elftools.elf.elffile import ELFFile
+
+    mem = bytearray(mem_size)
+    with open(fn, "rb") as fp:
+        for seg in ELFFile(fp).iter_segments(type="PT_LOAD"):
+            data = seg.data()
+            start = seg["p_paddr"]
+            if start + len(data) > mem_size:
+                raise ValueError(f"segment at {start:#010x} doesn't fit in "
+                                 f"{mem_size:#x} bytes of RAM")
+            mem[start:start + len(data)] = data
+
+    return mem
+
+
+# RAM, the host write port, and the serial port are modeled in Python, with
+# the same timing as AttoSoC's WBMemory (ack one cycle after stb). This is
+# much faster than simulating the peripherals' gateware; the UART alone would
+# take ~10k cycles per character.
+def run(mem, *, top=None, max_cycles=10_000_000, console=sys.stdout,
+        vcd=None):
+    if top is None:
+        top = Top()
+    mem = bytearray(mem)
+    bus = top.bus
+    res = SimResult(cycles=0, insns=0, exit_code=None)
+
+    async def bus_model(ctx):
+        ack = False
+        # Like WBSerial, a TX interrupt is pending out of reset (the idle UART
+        # holds tx_ack high), which firmware uses to detect a Wishbone
+        # peripheral bus.
+        rx_rdy_irq, tx_ack_irq = False, True
+        ctx.set(top.irq, 1)
+
+        while res.cycles < max_cycles:
+            _, _, cyc, stb, we, adr, sel, dat_w, fetched = \
+                await ctx.tick().sample(bus.cyc, bus.stb, bus.we, bus.adr,
+                                        bus.sel, bus.dat_w,
+                                        top.decode.do_decode)
+            res.cycles += 1
+            res.insns += fetched
+
+            if not (cyc and stb) or ack:
+                ack = False
+                ctx.set(bus.ack, 0)
+                continue
+
+            byte_adr = adr << 2
+            dat_r = 0
+            if byte_adr + 4 <= len(mem):
+                if we:
+                    for i in range(4):
+                        if sel & (1 << i):
+                            mem[byte_adr + i] = (dat_w >> (8 * i)) & 0xff
+                else:
+                    dat_r = int.from_bytes(mem[byte_adr:byte_adr + 4],
+                                           "little")
+            elif byte_adr == HOST_ADDR and we:
+                if dat_w & 1:
+                    res.exit_code = dat_w >> 1
+                    return
+            elif byte_adr == SERIAL_ADDR and sel & 1:
+                if we:
+                    console.write(chr(dat_w & 0xff))
+                    console.flush()
+                    tx_ack_irq = True
+            elif byte_adr == SERIAL_ADDR + 4 and sel & 1 and not we:
+                dat_r = tx_ack_irq << 1 | rx_rdy_irq
+                rx_rdy_irq, tx_ack_irq = False, False
+
+            ack = True
+            ctx.set(bus.ack, 1)
+            ctx.set(bus.dat_r, dat_r)
+            ctx.set(top.irq, rx_rdy_irq | tx_ack_irq)
+
+    sim = Simulator(top)
+    sim.add_clock(1.0 / 12e6)
+    sim.add_testbench(bus_model)
+
+    if vcd:
+        with sim.write_vcd(vcd):
+            sim.run()
+    else:
+        sim.run()
+
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run firmware on a "
+                                     "simulated Sentinel core")
+    parser.add_argument("elf", help="firmware ELF file, linked at address 0")
+    parser.add_argument("-c", help="stop after this many cycles (default "
+                        "%(default)s)", type=int, default=10_000_000,
+                        metavar="CYCLES")
+    parser.add_argument("-m", help="RAM size in bytes (default %(default)s)",
+                        type=lambda s: int(s, 0), default=0x10000,
+                        metavar="BYTES")
+    parser.add_argument("-f", action="store_true", help="use the "
+                        "fmax-oriented microcode sequencer")
+    parser.add_argument("-v", help="write a VCD file", metavar="VCD")
+    args = parser.parse_args()
+
+    mem = load_elf(args.elf, args.m)
+    res = run(mem, top=Top(fast_sequencer=args.f), max_cycles=args.c,
+              vcd=args.v)
+
+    if res.exit_code is None:
+        print(f"\nstopped after {args.c} cycles", file=sys.stderr)
+    print(f"cycles: {res.cycles}, insns: {res.insns}, CPI: {res.cpi:.2f}",
+          file=sys.stderr)
+
+    if res.exit_code is None:
+        sys.exit(1)
+    sys.exit(res.exit_code)
+
+
+if __name__ == "__main__":
+    main()
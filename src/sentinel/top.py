@@ -1,19 +1,48 @@
-from amaranth import Signal, Module, Cat, C
+from amaranth import Signal, Module, Cat, C, Mux
+from amaranth.lib.data import View
 from amaranth.lib.wiring import Component, Signature, Out, In, connect, flipped
 from amaranth_soc import wishbone
 
 from .alu import ALU
 from .control import Control
+from .csr import MTVec, MHPMEvent
 from .datapath import DataPath
 from .decode import Decode
 from .exception import ExceptionRouter
 from .ucodefields import ASrc, BSrc, RegRSel, RegWSel, MemSel, \
-    MemExtend, CSRSel
+    MemExtend, CSRSel, ExceptCtl, OpType, PcAction, CondTest
 
 
 class Top(Component):
-    def __init__(self, *, formal=False):
+    def __init__(self, *, formal=False, num_local_irqs=0, m_extension=False,
+                 hw_multiplier=False, custom_ucode=None,
+                 fast_sequencer=False, ucode_placeholder=False,
+                 num_hpm_counters=0, early_fetch_adr=False,
+                 wb_burst=False, harvard=False, fetch_tag=False):
+        if not 0 <= num_local_irqs <= 16:
+            raise ValueError("num_local_irqs must be between 0 and 16, not "
+                             f"{num_local_irqs}")
+        # mhpmcounter3-7; the CSR address encoding has room for no more.
+        if not 0 <= num_hpm_counters <= 5:
+            raise ValueError("num_hpm_counters must be between 0 and 5, not "
+                             f"{num_hpm_counters}")
+        if hw_multiplier and not m_extension:
+            raise ValueError("hw_multiplier requires m_extension")
+        if harvard and (early_fetch_adr or wb_burst or fetch_tag):
+            raise ValueError("early_fetch_adr, wb_burst, and fetch_tag only "
+                             "apply to the shared bus, not harvard")
+        if harvard and formal:
+            raise ValueError("FormalTop doesn't support harvard")
+
         self.formal = formal
+        self.num_local_irqs = num_local_irqs
+        self.num_hpm_counters = num_hpm_counters
+        self.early_fetch_adr = early_fetch_adr
+        self.wb_burst = wb_burst
+        self.harvard = harvard
+        self.fetch_tag = fetch_tag
+        self.m_extension = m_extension
+        self.hw_multiplier = hw_multiplier
 
         self.req_next = Signal()
         self.insn_fetch_curr = Signal()
@@ -21,11 +50,32 @@ class Top(Component):
 
         ###
 
-        self.alu = ALU(32)
-        self.control = Control()
-        self.datapath = DataPath(formal=formal)
-        self.decode = Decode(formal=formal)
-        self.exception_router = ExceptionRouter()
+        # The M extension's microcode only fits in the larger ROM, so it's
+        # opt-in.
+        defines = []
+        if m_extension:
+            defines.append("M_EXTENSION")
+        if hw_multiplier:
+            defines.append("HW_MULTIPLIER")
+
+        self.alu = ALU(32, multiplier=hw_multiplier)
+        # User microcode for CUSTOM_0 insns; see examples/custom.asm.
+        # fast_sequencer trades ROM width for a shorter microcode sequencing
+        # critical path; see PredecodedSequencer. ucode_placeholder builds a
+        # bitstream whose microcode can be replaced later using icebram; the
+        # core won't run until then.
+        self.control = Control(defines=defines, custom_ucode=custom_ucode,
+                               fast_sequencer=fast_sequencer,
+                               ucode_placeholder=ucode_placeholder)
+        self.datapath = DataPath(formal=formal,
+                                 num_local_irqs=num_local_irqs,
+                                 num_hpm_counters=num_hpm_counters)
+        self.decode = Decode(
+            formal=formal, m_extension=m_extension,
+            custom_slots=self.control.ucoderom.custom_slots,
+            num_hpm_counters=num_hpm_counters)
+        self.exception_router = ExceptionRouter(
+            num_local_irqs=num_local_irqs)
 
         # ALU
         self.a_input = Signal(32)
@@ -35,11 +85,39 @@ class Top(Component):
         self.reg_r_adr = Signal(6)
         self.reg_w_adr = Signal(6)
 
-        sig = {
-                "bus": Out(wishbone.Signature(addr_width=30, data_width=32,
-                                              granularity=8)),
-                "irq": In(1)
-        }
+        # With wb_burst, insn fetches carry Wishbone registered feedback
+        # cycle types; see below.
+        features = {"cti", "bte"} if wb_burst else set()
+        bus_signature = wishbone.Signature(addr_width=30, data_width=32,
+                                           granularity=8, features=features)
+        # With harvard, insn fetches and data accesses have their own buses
+        # instead of sharing bus; see below.
+        if harvard:
+            sig = {
+                "ibus": Out(bus_signature),
+                "dbus": Out(bus_signature),
+                "irq": In(1),
+                "timer_irq": In(1)
+            }
+        else:
+            sig = {
+                "bus": Out(bus_signature),
+                "irq": In(1),
+                "timer_irq": In(1)
+            }
+        # Platform-specific interrupts, which go to mip/mie bits 16 and up.
+        if self.num_local_irqs:
+            sig["local_irq"] = In(self.num_local_irqs)
+        # The address an insn fetch would use if it started next cycle, so
+        # that synchronous memory can read it a cycle early and ACK a fetch in
+        # the same cycle it's requested. Not part of Wishbone; see WBMemory in
+        # examples/attosoc.py.
+        if self.early_fetch_adr:
+            sig["fetch_adr_next"] = Out(30)
+        # Whether the current bus cycle is an insn fetch, for sentinel.icache.
+        # Like fetch_adr_next, not part of Wishbone.
+        if self.fetch_tag:
+            sig["insn_fetch"] = Out(1)
         if self.formal:
             sig["rvfi"] = Out(Signature({
                     "exception": Out(1),
@@ -58,12 +136,27 @@ class Top(Component):
         m.submodules.exception_router = self.exception_router
 
         data_adr = Signal.like(self.alu.o)
+        # The address for the current memory access; bypass data_adr in the
+        # cycle it's latched so a request can start in the same cycle.
+        mem_adr = Signal.like(data_adr)
+        # SEL for the current data access.
+        data_sel = Signal(4)
+
+        if self.harvard:
+            data_bus = self.dbus
+        else:
+            data_bus = self.bus
 
         m.d.comb += [
             self.datapath.csr.mip_w.meip.eq(self.irq),
+            self.datapath.csr.mip_w.mtip.eq(self.timer_irq),
             self.datapath.csr.ctrl.exception.eq(self.control.except_ctl)
         ]
 
+        if self.num_local_irqs:
+            m.d.comb += self.datapath.csr.mip_w.platform[
+                :self.num_local_irqs].eq(self.local_irq)
+
         # ALU conns
         connect(m, self.alu.ctrl, self.control.alu)
 
@@ -90,6 +183,16 @@ class Top(Component):
                     m.d.sync += self.a_input.eq(C(-1, 32))
                 with m.Case(ASrc.THIRTY_ONE):
                     m.d.sync += self.a_input.eq(31)
+                with m.Case(ASrc.VEC_OFFSET):
+                    # Only meaningful while MTVEC is on the CSR read bus.
+                    mtvec = View(MTVec, self.datapath.csr.dat_r)
+                    mcause = self.exception_router.out.mcause
+                    with m.If((mtvec.mode == MTVec.Mode.VECTORED) &
+                              mcause.interrupt):
+                        m.d.sync += self.a_input.eq(
+                            Cat(C(0, 2), mcause.cause.as_value()))
+                    with m.Else():
+                        m.d.sync += self.a_input.eq(0)
 
         raw_dat_r = Signal.like(self.b_input)
         with m.If(self.control.latch_b):
@@ -106,31 +209,31 @@ class Top(Component):
                 with m.Case(BSrc.DAT_R):
                     with m.Switch(self.control.mem_sel):
                         with m.Case(MemSel.BYTE):
-                            with m.If(data_adr[0:2] == 0):
-                                m.d.comb += raw_dat_r.eq(self.bus.dat_r[0:8])
-                            with m.Elif(data_adr[0:2] == 1):
-                                m.d.comb += raw_dat_r.eq(self.bus.dat_r[8:16])
-                            with m.Elif(data_adr[0:2] == 2):
-                                m.d.comb += raw_dat_r.eq(self.bus.dat_r[16:24])
+                            with m.If(mem_adr[0:2] == 0):
+                                m.d.comb += raw_dat_r.eq(data_bus.dat_r[0:8])
+                            with m.Elif(mem_adr[0:2] == 1):
+                                m.d.comb += raw_dat_r.eq(data_bus.dat_r[8:16])
+                            with m.Elif(mem_adr[0:2] == 2):
+                                m.d.comb += raw_dat_r.eq(data_bus.dat_r[16:24])
                             with m.Else():
-                                m.d.comb += raw_dat_r.eq(self.bus.dat_r[24:])
+                                m.d.comb += raw_dat_r.eq(data_bus.dat_r[24:])
 
                             with m.If(self.control.mem_extend == MemExtend.SIGN):  # noqa: E501
                                 m.d.sync += self.b_input.eq(raw_dat_r[0:8].as_signed())  # noqa: E501
                             with m.Else():
                                 m.d.sync += self.b_input.eq(raw_dat_r[0:8])
                         with m.Case(MemSel.HWORD):
-                            with m.If(data_adr[1] == 0):
-                                m.d.comb += raw_dat_r.eq(self.bus.dat_r[0:16])
+                            with m.If(mem_adr[1] == 0):
+                                m.d.comb += raw_dat_r.eq(data_bus.dat_r[0:16])
                             with m.Else():
-                                m.d.comb += raw_dat_r.eq(self.bus.dat_r[16:])
+                                m.d.comb += raw_dat_r.eq(data_bus.dat_r[16:])
 
                             with m.If(self.control.mem_extend == MemExtend.SIGN):  # noqa: E501
                                 m.d.sync += self.b_input.eq(raw_dat_r[0:16].as_signed())  # noqa: E501
                             with m.Else():
                                 m.d.sync += self.b_input.eq(raw_dat_r[0:16])
                         with m.Case(MemSel.WORD):
-                            m.d.sync += self.b_input.eq(self.bus.dat_r)
+                            m.d.sync += self.b_input.eq(data_bus.dat_r)
                 with m.Case(BSrc.CSR_IMM):
                     m.d.sync += self.b_input.eq(self.decode.src_a)
                 with m.Case(BSrc.CSR):
@@ -145,7 +248,6 @@ class Top(Component):
             self.control.requested_op.eq(self.decode.requested_op),
             self.req_next.eq(self.control.mem_req),
             self.insn_fetch_next.eq(self.control.insn_fetch),
-            self.control.mem_valid.eq(self.bus.ack),
 
             # TODO: Spin out into a register of exception sources.
             self.control.exception.eq(self.exception_router.out.exception)
@@ -153,11 +255,30 @@ class Top(Component):
 
         # An ACK stops the request b/c the microcode's to avoid a 1-cycle delay
         # due to registered REQ/FETCH signal.
-        m.d.comb += [
-            self.bus.cyc.eq(self.control.mem_req),
-            self.bus.stb.eq(self.control.mem_req),
-            # self.insn_fetch.eq(self.control.insn_fetch)
-        ]
+        # Loads start their request in the same cycle they check for a
+        # misaligned address, so hold off the request if it's misaligned.
+        if not self.harvard:
+            m.d.comb += [
+                self.control.mem_valid.eq(self.bus.ack),
+                self.bus.cyc.eq(self.control.mem_req &
+                                ~self.exception_router.out.exception),
+                self.bus.stb.eq(self.control.mem_req &
+                                ~self.exception_router.out.exception),
+                # self.insn_fetch.eq(self.control.insn_fetch)
+            ]
+
+        # Microinstructions that don't test mem_valid only request memory a
+        # cycle early to hide the wait state of registered-ACK memory, and
+        # would miss a same-cycle ACK (fast_epilog's WRITE_RD would then see
+        # the next insn's rd). Memory that uses fetch_adr_next, or that ACKs
+        # burst fetches from a prefetched word, has no wait state to hide, so
+        # only request when the ACK can be seen.
+        if self.early_fetch_adr or self.wb_burst:
+            with m.If(self.control.cond_test != CondTest.MEM_VALID):
+                m.d.comb += [
+                    self.bus.cyc.eq(0),
+                    self.bus.stb.eq(0),
+                ]
 
         m.d.comb += [
             self.datapath.gp.ctrl.reg_read.eq(self.control.gp.reg_read),
@@ -169,7 +290,7 @@ class Top(Component):
         # connect(m, self.datapath.gp.ctrl, self.control.gp)
         # connect(m, self.datapath.pc.ctrl, self.control.pc)
 
-        write_data = Signal.like(self.bus.dat_w)
+        write_data = Signal.like(data_bus.dat_w)
         with m.If(self.control.latch_data):
             # TODO: Misaligned accesses
             with m.Switch(self.control.mem_sel):
@@ -190,9 +311,13 @@ class Top(Component):
                 with m.Case(MemSel.WORD):
                     m.d.sync += write_data.eq(self.alu.o)
 
+        if not self.harvard:
+            m.d.comb += [
+                self.bus.we.eq(self.control.write_mem),
+                self.bus.dat_w.eq(write_data),
+            ]
+
         m.d.comb += [
-            self.bus.we.eq(self.control.write_mem),
-            self.bus.dat_w.eq(write_data),
             self.datapath.gp.dat_w.eq(self.alu.o),
             self.datapath.gp.adr_r.eq(self.reg_r_adr),
             self.datapath.gp.adr_w.eq(self.reg_w_adr),
@@ -203,42 +328,206 @@ class Top(Component):
 
         with m.If(self.control.latch_adr):
             m.d.sync += data_adr.eq(self.alu.o)
+            m.d.comb += mem_adr.eq(self.alu.o)
+        with m.Else():
+            m.d.comb += mem_adr.eq(data_adr)
+
+        # Fetches always use the PC, so the next fetch address is the PC
+        # after this cycle's pc_action.
+        if self.early_fetch_adr:
+            with m.Switch(self.control.pc.action):
+                with m.Case(PcAction.INC):
+                    m.d.comb += self.fetch_adr_next.eq(
+                        self.datapath.pc.dat_r + 1)
+                with m.Case(PcAction.LOAD_ALU_O):
+                    m.d.comb += self.fetch_adr_next.eq(self.alu.o[2:])
+                with m.Default():
+                    m.d.comb += self.fetch_adr_next.eq(
+                        self.datapath.pc.dat_r)
+
+        if self.fetch_tag:
+            m.d.comb += self.insn_fetch.eq(self.insn_fetch_next)
+
+        # Sentinel releases CYC between most fetches, so a "burst" spans bus
+        # cycles: a fetch is an INCR_BURST beat if it's at the word after the
+        # previous fetch, i.e. the PC has only been incremented since. The
+        # first fetch after the PC is loaded (taken branches, jumps, traps
+        # and mret) is END_OF_BURST, telling memory not to use its prefetched
+        # word. Data accesses are CLASSIC.
+        if self.wb_burst:
+            fetch_seq = Signal()
+
+            with m.If(self.control.pc.action == PcAction.LOAD_ALU_O):
+                m.d.sync += fetch_seq.eq(0)
+            with m.Elif(self.decode.do_decode):
+                m.d.sync += fetch_seq.eq(1)
+
+            m.d.comb += self.bus.bte.eq(wishbone.BurstTypeExt.LINEAR)
+            with m.If(self.insn_fetch_next & fetch_seq):
+                m.d.comb += self.bus.cti.eq(wishbone.CycleType.INCR_BURST)
+            with m.Elif(self.insn_fetch_next):
+                m.d.comb += self.bus.cti.eq(wishbone.CycleType.END_OF_BURST)
+            with m.Else():
+                m.d.comb += self.bus.cti.eq(wishbone.CycleType.CLASSIC)
+
+        # TODO: Misaligned accesses
+        with m.Switch(self.control.mem_sel):
+            with m.Case(MemSel.BYTE):
+                with m.If(mem_adr[0:2] == 0):
+                    m.d.comb += data_sel.eq(1)
+                with m.Elif(mem_adr[0:2] == 1):
+                    m.d.comb += data_sel.eq(2)
+                with m.Elif(mem_adr[0:2] == 2):
+                    m.d.comb += data_sel.eq(4)
+                with m.Else():
+                    m.d.comb += data_sel.eq(8)
+            with m.Case(MemSel.HWORD):
+                with m.If(mem_adr[1] == 0):
+                    m.d.comb += data_sel.eq(3)
+                with m.Else():
+                    m.d.comb += data_sel.eq(0xc)
+            with m.Case(MemSel.WORD):
+                m.d.comb += data_sel.eq(0xf)
 
         # DataPath.dat_w constantly has traffic. We only want to latch
         # the address once per mem access, and we want it the address to be
         # valid synchronous with ready assertion.
-        with m.If(self.bus.cyc & self.bus.stb):
-            with m.If(self.insn_fetch_next):
-                m.d.comb += [self.bus.adr.eq(self.datapath.pc.dat_r),
-                             self.bus.sel.eq(0xf)]
+        if not self.harvard:
+            with m.If(self.bus.cyc & self.bus.stb):
+                with m.If(self.insn_fetch_next):
+                    m.d.comb += [self.bus.adr.eq(self.datapath.pc.dat_r),
+                                 self.bus.sel.eq(0xf)]
+                with m.Else():
+                    m.d.comb += [self.bus.adr.eq(mem_adr[2:]),
+                                 self.bus.sel.eq(data_sel)]
+
+            # Decode conns
+            m.d.comb += [
+                self.decode.insn.eq(self.bus.dat_r),
+                # Decode begins automatically.
+                self.decode.do_decode.eq(self.control.insn_fetch &
+                                         self.bus.ack),
+            ]
+        else:
+            exception = self.exception_router.out.exception
+            fetch = (self.control.mem_req & self.control.insn_fetch &
+                     ~exception)
+            load = (self.control.mem_req & ~self.control.insn_fetch &
+                    ~self.control.write_mem & ~exception)
+            store = (self.control.mem_req & ~self.control.insn_fetch &
+                     self.control.write_mem & ~exception)
+
+            # Stores are posted: the microcode sees a store complete as soon
+            # as dbus is free, and goes on to fetch the next insn on ibus
+            # while dbus holds the store until ACK. Later data accesses wait
+            # for it.
+            wr_pending = Signal()
+            wr_adr = Signal.like(self.dbus.adr)
+            wr_sel = Signal.like(self.dbus.sel)
+            wr_dat = Signal.like(self.dbus.dat_w)
+
+            with m.If(wr_pending):
+                m.d.comb += [
+                    self.dbus.cyc.eq(1),
+                    self.dbus.stb.eq(1),
+                    self.dbus.we.eq(1),
+                    self.dbus.adr.eq(wr_adr),
+                    self.dbus.sel.eq(wr_sel),
+                    self.dbus.dat_w.eq(wr_dat),
+                ]
+                with m.If(self.dbus.ack):
+                    m.d.sync += wr_pending.eq(0)
+            with m.Elif(load):
+                m.d.comb += [
+                    self.dbus.cyc.eq(1),
+                    self.dbus.stb.eq(1),
+                    self.dbus.adr.eq(mem_adr[2:]),
+                    self.dbus.sel.eq(data_sel),
+                ]
+            with m.Elif(store):
+                m.d.sync += [
+                    wr_pending.eq(1),
+                    wr_adr.eq(mem_adr[2:]),
+                    wr_sel.eq(data_sel),
+                    wr_dat.eq(write_data),
+                ]
+
+            # A one-word fetch buffer, which ibus fills with the word after
+            # the last fetched insn when a fetch isn't in progress. Fetches
+            # of straight-line code then don't wait on ibus at all.
+            buf_adr = Signal.like(self.ibus.adr)
+            buf_dat = Signal.like(self.ibus.dat_r)
+            buf_valid = Signal()
+            # Prefetch of buf_adr in progress, and whether a store to buf_adr
+            # happened meanwhile.
+            pf_busy = Signal()
+            pf_stale = Signal()
+            last_fetch_adr = Signal.like(self.ibus.adr)
+
+            buf_hit = buf_valid & (buf_adr == self.datapath.pc.dat_r)
+            # Like the shared bus, ibus can start a fetch a cycle before the
+            # microcode looks for its ACK, but a hit is only useful to
+            # microinstructions that test mem_valid (see wb_burst).
+            fetch_ack = Signal()
+
+            with m.If(pf_busy):
+                m.d.comb += [
+                    self.ibus.cyc.eq(1),
+                    self.ibus.stb.eq(1),
+                    self.ibus.adr.eq(buf_adr),
+                ]
+                with m.If(self.ibus.ack):
+                    m.d.sync += [
+                        buf_dat.eq(self.ibus.dat_r),
+                        buf_valid.eq(~pf_stale),
+                        pf_busy.eq(0),
+                    ]
+            with m.Elif(fetch & ~buf_hit &
+                        ~(wr_pending & (wr_adr == self.datapath.pc.dat_r))):
+                m.d.comb += [
+                    self.ibus.cyc.eq(1),
+                    self.ibus.stb.eq(1),
+                    self.ibus.adr.eq(self.datapath.pc.dat_r),
+                    fetch_ack.eq(self.ibus.ack),
+                ]
+            with m.Elif(~(buf_valid & (buf_adr == last_fetch_adr + 1))):
+                m.d.sync += [
+                    buf_adr.eq(last_fetch_adr + 1),
+                    buf_valid.eq(0),
+                    pf_busy.eq(1),
+                    pf_stale.eq(0),
+                ]
+
+            with m.If(fetch & buf_hit &
+                      (self.control.cond_test == CondTest.MEM_VALID)):
+                m.d.comb += fetch_ack.eq(1)
+
+            # Keep fetches coherent with stores; the above also holds off
+            # fetching an insn until a store to it finishes.
+            with m.If((wr_pending & (wr_adr == buf_adr)) |
+                      (store & (mem_adr[2:] == buf_adr))):
+                m.d.sync += [
+                    buf_valid.eq(0),
+                    pf_stale.eq(1),
+                ]
+
+            with m.If(self.decode.do_decode):
+                m.d.sync += last_fetch_adr.eq(self.datapath.pc.dat_r)
+
+            with m.If(self.control.insn_fetch):
+                m.d.comb += self.control.mem_valid.eq(fetch_ack)
+            with m.Elif(self.control.write_mem):
+                m.d.comb += self.control.mem_valid.eq(~wr_pending &
+                                                      ~exception)
             with m.Else():
-                m.d.comb += self.bus.adr.eq(data_adr[2:])
-
-                # TODO: Misaligned accesses
-                with m.Switch(self.control.mem_sel):
-                    with m.Case(MemSel.BYTE):
-                        with m.If(data_adr[0:2] == 0):
-                            m.d.comb += self.bus.sel.eq(1)
-                        with m.Elif(data_adr[0:2] == 1):
-                            m.d.comb += self.bus.sel.eq(2)
-                        with m.Elif(data_adr[0:2] == 2):
-                            m.d.comb += self.bus.sel.eq(4)
-                        with m.Else():
-                            m.d.comb += self.bus.sel.eq(8)
-                    with m.Case(MemSel.HWORD):
-                        with m.If(data_adr[1] == 0):
-                            m.d.comb += self.bus.sel.eq(3)
-                        with m.Else():
-                            m.d.comb += self.bus.sel.eq(0xc)
-                    with m.Case(MemSel.WORD):
-                        m.d.comb += self.bus.sel.eq(0xf)
-
-        # Decode conns
-        m.d.comb += [
-            self.decode.insn.eq(self.bus.dat_r),
-            # Decode begins automatically.
-            self.decode.do_decode.eq(self.control.insn_fetch & self.bus.ack),
-        ]
+                m.d.comb += self.control.mem_valid.eq(self.dbus.ack &
+                                                      ~wr_pending)
+
+            m.d.comb += [
+                self.ibus.sel.eq(0xf),
+                self.decode.insn.eq(Mux(buf_hit, buf_dat, self.ibus.dat_r)),
+                self.decode.do_decode.eq(self.control.insn_fetch & fetch_ack),
+            ]
 
         with m.Switch(self.control.reg_r_sel):
             with m.Case(RegRSel.INSN_RS1):
@@ -269,6 +558,10 @@ class Top(Component):
         # Exception Router sources
         m.d.comb += [
             self.exception_router.src.alu_lo.eq(self.alu.o[0:2]),
+            self.exception_router.src.imm_lo.eq(self.decode.imm[0:2]),
+            # Branches that compare equal to zero for "taken" invert the test.
+            self.exception_router.src.branch_taken.eq(
+                ~(self.alu.ctrl.zero ^ self.control.invert_test)),
             self.exception_router.src.csr.mstatus.eq(
                 self.datapath.csr.mstatus_r),
             self.exception_router.src.csr.mip.eq(self.datapath.csr.mip_r),
@@ -279,6 +572,31 @@ class Top(Component):
             self.exception_router.src.decode.eq(self.decode.exception),
         ]
 
+        # Performance events for mhpmcounter3 and up.
+        if self.num_hpm_counters:
+            hpm_events = self.datapath.csr.hpm_events
+            if self.harvard:
+                mem_wait = (self.control.mem_req &
+                            ~self.exception_router.out.exception &
+                            ~self.control.mem_valid)
+            else:
+                mem_wait = self.bus.cyc & self.bus.stb & ~self.bus.ack
+            enter_int = self.control.except_ctl == ExceptCtl.ENTER_INT
+            interrupt = self.exception_router.out.mcause.interrupt
+            m.d.comb += [
+                hpm_events[MHPMEvent.MEM_WAIT.value].eq(mem_wait),
+                hpm_events[MHPMEvent.FETCH_WAIT.value].eq(
+                    mem_wait & self.control.insn_fetch),
+                hpm_events[MHPMEvent.SHIFT.value].eq(
+                    (self.control.alu.op == OpType.SLL) |
+                    (self.control.alu.op == OpType.SRL) |
+                    (self.control.alu.op == OpType.SRA)),
+                hpm_events[MHPMEvent.EXCEPTION.value].eq(
+                    enter_int & ~interrupt),
+                hpm_events[MHPMEvent.INTERRUPT.value].eq(
+                    enter_int & interrupt),
+            ]
+
         if self.formal:
             m.d.comb += self.rvfi.exception.eq(
                 self.exception_router.out.exception)
@@ -0,0 +1,110 @@
+import argparse
+import re
+import sys
+from dataclasses import dataclass
+
+from .disasm import disassemble
+
+# Host-side decoder for the AttoSoC trace buffer peripheral (see TraceBuffer
+# in examples/attosoc.py). Each 32-bit entry holds an address in the low
+# PAYLOAD_BITS bits, and the number of cycles since the previous entry in the
+# remaining DELTA_BITS bits, saturating at DELTA_MAX.
+#
+# In PC mode, an entry is written whenever an insn is fetched, and the
+# address is the insn's word address. In uPC mode, an entry is written
+# whenever the microcode address changes; stalls (e.g. waiting for ACK) only
+# show up as a larger delta.
+
+
+PAYLOAD_BITS = 22
+DELTA_BITS = 10
+DELTA_MAX = (1 << DELTA_BITS) - 1
+
+
+@dataclass
+class TraceEntry:
+    # Cycles since the first entry. A lower bound if any earlier entry was
+    # saturated.
+    cycle: int
+    # Byte address of the insn in PC mode; microcode address in uPC mode.
+    adr: int
+    # Cycles spent until the next entry, or None for the last entry.
+    cycles: int | None
+    # cycles hit DELTA_MAX, so is only a lower bound.
+    saturated: bool = False
+
+
+def decode(words, *, upc=False):
+    entries = []
+    cycle = 0
+
+    for word in words:
+        adr = word & ((1 << PAYLOAD_BITS) - 1)
+        delta = word >> PAYLOAD_BITS
+
+        # The first entry's delta counts from when tracing started, which
+        # isn't interesting.
+        if entries:
+            cycle += delta
+            entries[-1].cycles = delta
+            entries[-1].saturated = delta == DELTA_MAX
+
+        entries.append(TraceEntry(cycle=cycle, adr=adr if upc else adr << 2,
+                                  cycles=None))
+
+    return entries
+
+
+# Firmware dumps the buffer over UART however it likes; take any hex words
+# that appear one per line, and ignore everything else.
+def read_dump(fp):
+    words = []
+
+    for line in fp:
+        if m := re.fullmatch(r"\s*(?:0x)?([0-9a-fA-F]{1,8})\s*", line):
+            words.append(int(m.group(1), 16))
+
+    return words
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode a Sentinel AttoSoC "
+                                     "trace buffer dump")
+    parser.add_argument("dump", help="trace entries as hex words, one per "
+                        "line, oldest first (- for stdin)")
+    parser.add_argument("-u", action="store_true", help="entries are "
+                        "microcode addresses instead of PCs")
+    parser.add_argument("-e", help="firmware ELF file, to disassemble traced "
+                        "insns", metavar="ELF")
+    args = parser.parse_args()
+
+    if args.dump == "-":
+        words = read_dump(sys.stdin)
+    else:
+        with open(args.dump) as fp:
+            words = read_dump(fp)
+
+    mem = None
+    if args.e and not args.u:
+        # Defer import; pyelftools is only needed for this option.
+        from .sim import load_elf
+        mem = load_elf(args.e, 1 << (PAYLOAD_BITS + 2))
+
+    for e in decode(words, upc=args.u):
+        if e.cycles is None:
+            cycles = "?"
+        else:
+            cycles = f"{e.cycles}{'+' if e.saturated else ''}"
+
+        if args.u:
+            print(f"{e.cycle:>10} {e.adr:#05x} {cycles:>6}")
+        elif mem:
+            insn = int.from_bytes(mem[e.adr:e.adr + 4], "little")
+            print(f"{e.cycle:>10} {e.adr:#010x} {cycles:>6}  "
+                  f"{disassemble(insn, e.adr)}")
+        else:
+            print(f"{e.cycle:>10} {e.adr:#010x} {cycles:>6}")
+
+
+if __name__ == "__main__":
+    main()
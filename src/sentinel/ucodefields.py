@@ -6,6 +6,8 @@ from amaranth.lib import enum
 class JmpType(enum.Enum):
     CONT = 0
     NOP = 0
+    # Told apart from CONT by its cond_test; see MULTIWAY_TESTS.
+    MULTIWAY = 0
     MAP = 1
     DIRECT = 2
     DIRECT_ZERO = 3
@@ -21,6 +23,10 @@ class OpType(enum.Enum):
     SRL = 6
     SRA = 7
     CMP_LTU = 8
+    MUL = 9
+    MULH = 10
+    MULHSU = 11
+    MULHU = 12
 
 
 class CondTest(enum.Enum):
@@ -30,6 +36,10 @@ class CondTest(enum.Enum):
     TRUE = 3
 
 
+# Tests that make a JmpType.CONT uinsn a multiway jump.
+MULTIWAY_TESTS = (CondTest.CMP_ALU_O_ZERO, CondTest.MEM_VALID)
+
+
 class PcAction(enum.Enum):
     HOLD = 0
     INC = 1
@@ -44,6 +54,7 @@ class ASrc(enum.Enum):
     FOUR = 4
     NEG_ONE = 5
     THIRTY_ONE = 6
+    VEC_OFFSET = 7
 
 
 class BSrc(enum.Enum):
@@ -109,3 +120,4 @@ class ExceptCtl(enum.Enum):
     LATCH_LOAD_ADR = 4
     ENTER_INT = 5
     LEAVE_INT = 6
+    LATCH_BRANCH = 7
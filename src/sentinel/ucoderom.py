@@ -1,6 +1,8 @@
-from io import IOBase
+from io import IOBase, StringIO
 from pathlib import Path
 from itertools import tee, zip_longest
+from random import Random
+import re
 
 from amaranth import unsigned, Module
 from amaranth.lib.data import StructLayout
@@ -12,7 +14,7 @@ from m5meta import M5Meta
 
 from .ucodefields import OpType, CondTest, JmpType, PcAction, ASrc, BSrc, \
     ALUIMod, ALUOMod, RegRSel, RegWSel, MemSel, MemExtend, ExceptCtl, \
-    CSROp, CSRSel
+    CSROp, CSRSel, MULTIWAY_TESTS
 
 
 def ucoderom_signature(ucoderom):
@@ -41,18 +43,40 @@ class UCodeROM(Component):
         "except_ctl": ExceptCtl
     }
 
+    # CUSTOM_0 insns are dispatched to one of 16 map slots starting here,
+    # indexed by Cat(funct3, funct7[0]).
+    custom_0_base = 0x70
+    num_custom_0_slots = 16
+
+    # Seed for placeholder ROM contents, fixed so that a placeholder
+    # bitstream and its hex file can be regenerated independently.
+    placeholder_seed = 0x5e7714e1
+
     @staticmethod
     def main_microcode_file():
         return (Path(__file__).parent / "microcode.asm").resolve()
 
     def __init__(self, *, main_file=None, field_defs=None, hex=None,
-                 enum_map=None):
+                 enum_map=None, defines=(), custom_file=None, predecode=False,
+                 placeholder=False):
         if not main_file:
             self.main_file = UCodeROM.main_microcode_file()
         else:
             self.main_file = main_file
+        # User microcode for CUSTOM_0 insns, assembled after main_file.
+        self.custom_file = custom_file
+        self.custom_slots = ()
         self.field_defs = field_defs
         self.hex = hex
+        # Macros to predefine before preprocessing, used to select optional
+        # microcode (e.g. "#ifdef M_EXTENSION").
+        self.defines = tuple(defines)
+        # Add pre-decoded next address fields for PredecodedSequencer.
+        self.predecode = predecode
+        # Fill the ROM with a pseudo-random pattern instead of the microcode,
+        # so that icebram can find the ROM in a bitstream and swap in new
+        # microcode without resynthesizing.
+        self.placeholder = placeholder
 
         if enum_map:
             self.enum_map = enum_map
@@ -83,11 +107,11 @@ class UCodeROM(Component):
     def assemble(self):
         if isinstance(self.main_file, IOBase):
             self.m5meta = M5Meta(self.main_file, obj_base_fn="anonymous")
-            self.m5meta.src = M5Pre(self.main_file).read()
+            self.m5meta.src = self.preprocess(self.main_file)
         else:
             with open(self.main_file) as mfp:
                 self.m5meta = M5Meta(mfp, obj_base_fn=self.main_file.stem)
-                self.m5meta.src = M5Pre(mfp).read()
+                self.m5meta.src = self.preprocess(mfp)
 
         passes = [None,
                   self.m5meta.pass12,
@@ -108,14 +132,62 @@ class UCodeROM(Component):
 
         self.create_mem_init(space)
         self.create_field_layout(space)
+        self.check_multiway(space)
+        if self.predecode:
+            self.predecode_jumps(space)
+        if self.placeholder:
+            self.fill_placeholder()
 
         if self.hex:
-            space.write_hex_file(self.hex)
+            self.write_hex(self.hex)
 
         if self.field_defs:
             with open(self.field_defs, 'w') as f:
                 space.write_fdef(f)
 
+    def preprocess(self, fp):
+        defines = list(self.defines)
+        src = fp.read()
+
+        if self.custom_file:
+            defines.append("CUSTOM_MICROCODE")
+            src += "\n" + self.custom_source()
+
+        # M5Pre has no way to predefine macros, so prepend them to the
+        # source instead.
+        prelude = "".join(f"#define {d}\n" for d in defines)
+        return M5Pre(StringIO(prelude + src)).read()
+
+    # User microcode marks the routine for map slot n with the label
+    # "custom0_<n>". Generate an entry point in each used map slot that
+    # increments the PC and jumps to the routine, so that users don't have
+    # to know (or be able to clobber) the map layout.
+    _custom_label_re = re.compile(r"^\s*custom0_(\d+)\s*:", re.MULTILINE)
+
+    def custom_source(self):
+        if isinstance(self.custom_file, IOBase):
+            src = self.custom_file.read()
+        else:
+            with open(self.custom_file) as cfp:
+                src = cfp.read()
+
+        slots = [int(n) for n in self._custom_label_re.findall(src)]
+        for n in slots:
+            if n >= self.num_custom_0_slots:
+                raise ValueError(f"custom0_{n} is not a valid map slot; "
+                                 "slots must be between 0 and "
+                                 f"{self.num_custom_0_slots - 1}")
+        if len(set(slots)) != len(slots):
+            raise ValueError("custom microcode defines a map slot more than "
+                             "once")
+        self.custom_slots = tuple(sorted(slots))
+
+        entries = "".join(f"origin {self.custom_0_base + n};\n"
+                          f"custom0_{n}_1: pc_action => inc, "
+                          f"jmp_type => direct, target => custom0_{n};\n"
+                          for n in self.custom_slots)
+        return src + "\n" + entries
+
     def create_mem_init(self, space):
         self.width = space.width
         self.depth = space.size
@@ -127,6 +199,20 @@ class UCodeROM(Component):
         for addr in sorted(space.data.keys()):
             self.ucode_contents[int(addr)] = space.data[addr]
 
+    # icebram matches each 256-word bit column of the ROM separately, so
+    # every column needs to be distinct from those of any other BRAM.
+    def fill_placeholder(self):
+        rng = Random(self.placeholder_seed)
+        self.ucode_contents = [rng.getrandbits(self.width)
+                               for _ in range(self.depth)]
+
+    # Unlike m5meta's hex files, write every word of the ROM (including
+    # holes and pre-decoded fields), one per line, as icebram expects.
+    def write_hex(self, fn):
+        digits = (self.width + 3) // 4
+        with open(fn, "w") as f:
+            f.writelines(f"{w:0{digits}x}\n" for w in self.ucode_contents)
+
     def create_field_layout(self, space):
         layout = dict()
         padding_id = 0
@@ -149,6 +235,82 @@ class UCodeROM(Component):
 
         self.field_layout = StructLayout(layout)
 
+    @staticmethod
+    def field_value(word, f):
+        return (word >> f.origin) & ((1 << f.width) - 1)
+
+    # Multiway jumps share cont's encoding, and are told apart by a
+    # cond_test in MULTIWAY_TESTS.
+    def is_multiway(self, space, word):
+        jmp_type = space.fields.get("jmp_type")
+        cond_test = space.fields.get("cond_test")
+        if not (jmp_type and cond_test and jmp_type.enum and
+                "multiway" in jmp_type.enum and cond_test.enum):
+            return False
+
+        tests = [cond_test.enum[t.name.lower()] for t in MULTIWAY_TESTS]
+        return (self.field_value(word, jmp_type) ==
+                jmp_type.enum["multiway"] and
+                self.field_value(word, cond_test) in tests)
+
+    # A multiway jump ORs 2 bits into its target, so the target must be the
+    # start of a 4-aligned table. m5meta doesn't know this, so check it here.
+    def check_multiway(self, space):
+        target = space.fields.get("target")
+        if not target:
+            return
+
+        field = self.field_value
+        for addr, word in enumerate(self.ucode_contents):
+            if not self.is_multiway(space, word):
+                continue
+            if field(word, target) % 4:
+                raise ValueError(f"multiway jump at {addr:#x} targets "
+                                 f"{field(word, target):#x}, which is not "
+                                 "4-aligned")
+
+    # Each uinsn's possible next addresses only depend on its own contents
+    # and address, so work them out ahead of time and store them in extra
+    # fields after the assembled ones:
+    # seq_taken: Next address if the test succeeds.
+    # seq_fall: Next address if the test fails (unless seq_map).
+    # seq_map: Use the address supplied by the decoder if the test fails.
+    # seq_multiway: OR the test vector into target.
+    def predecode_jumps(self, space):
+        jmp_type = space.fields["jmp_type"]
+        target = space.fields["target"]
+        types = {v: k for k, v in jmp_type.enum.items()}
+        adr_width = ceil_log2(self.depth)
+        mask = (1 << adr_width) - 1
+
+        for addr, word in enumerate(self.ucode_contents):
+            jt = types[self.field_value(word, jmp_type)]
+            trg = self.field_value(word, target)
+            taken, fall, map_, multiway = trg, (addr + 1) & mask, 0, 0
+
+            # cont, nop and multiway share an encoding.
+            if self.is_multiway(space, word):
+                fall, multiway = 0, 1
+            elif jt in ("cont", "nop", "multiway"):
+                taken = fall
+            elif jt == "direct_zero":
+                fall = 0
+            elif jt == "map":
+                fall, map_ = 0, 1
+
+            self.ucode_contents[addr] |= (
+                taken | fall << adr_width | map_ << 2*adr_width |
+                multiway << 2*adr_width + 1) << self.width
+
+        self.field_layout = StructLayout({
+            **self.field_layout.members,
+            "seq_taken": unsigned(adr_width),
+            "seq_fall": unsigned(adr_width),
+            "seq_map": unsigned(1),
+            "seq_multiway": unsigned(1)
+        })
+        self.width += 2*adr_width + 2
+
     def check_and_convert_dynamic_enum(self, field):
         try:
             se_class = self.enum_map[field.name]
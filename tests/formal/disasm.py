@@ -1,45 +1,53 @@
 #!/usr/bin/env python3
 
 from Verilog_VCD.Verilog_VCD import parse_vcd
-from os import system
 from sys import argv
-from pathlib import Path
-
-rvfi_valid = None
-rvfi_order = None
-rvfi_insn = None
-
-for netinfo in parse_vcd(argv[1]).values():
-    for net in netinfo['nets']:
-        # print(net["hier"], net["name"])
-        if net["hier"] == "rvfi_testbench.wrapper" and net["name"] == "rvfi_valid":  # noqa: E501
-            rvfi_valid = netinfo['tv']
-        if net["hier"] == "rvfi_testbench.wrapper" and net["name"] == "rvfi_order":  # noqa: E501
-            rvfi_order = netinfo['tv']
-        if net["hier"] == "rvfi_testbench.wrapper" and net["name"] == "rvfi_insn":  # noqa: E501
-            rvfi_insn = netinfo['tv']
-
-assert len(rvfi_valid) == len(rvfi_order)
-assert len(rvfi_valid) == len(rvfi_insn)
-
-prog = list()
-
-for tv_valid, tv_order, tv_insn in zip(rvfi_valid, rvfi_order, rvfi_insn):
-    if tv_valid[1] == '1':
-        prog.append((int(tv_order[1], 2), int(tv_insn[1], 2)))
-
-# These are my local modifications to disasm.py- potentially attach a unique
-# suffix, so that disasm generation can be parallelized.
-if len(argv) > 1:
-    disasm = Path(f"disasm-{argv[2]}.s")
-else:
-    disasm = Path("disasm.s")
-with open(disasm, "w") as f:
-    for tv_order, tv_insn in sorted(prog):
-        if tv_insn & 3 != 3 and tv_insn & 0xffff0000 == 0:
-            print(".hword 0x%04x # %d" % (tv_insn, tv_order), file=f)
-        else:
-            print(".word 0x%08x # %d" % (tv_insn, tv_order), file=f)
-
-system(f"riscv64-unknown-elf-gcc -c {disasm}")
-system(f"""riscv64-unknown-elf-objdump -d -M numeric,no-aliases {disasm.with_suffix(".o")}""")  # noqa: E501
+
+from sentinel.disasm import disassemble
+
+
+RVFI_NETS = ("rvfi_valid", "rvfi_order", "rvfi_insn", "rvfi_pc_rdata")
+
+
+# Disassemble the retired insns in a RISC-V Formal counterexample, in
+# rvfi_order. This runs in-process (dodo.py imports it for every failing
+# trace), so no cross-toolchain or per-trace subprocesses are required.
+def disasm_vcd(vcd):
+    tvs = dict()
+    for netinfo in parse_vcd(vcd).values():
+        for net in netinfo['nets']:
+            if net["hier"] == "rvfi_testbench.wrapper" and \
+                    net["name"] in RVFI_NETS:
+                tvs[net["name"]] = netinfo['tv']
+
+    # rvfi_pc_rdata changes at different times than the other nets, so
+    # look up its value at each time rvfi_valid is asserted.
+    def value_at(tv, time):
+        val = None
+        for t, v in tv:
+            if t > time:
+                break
+            val = v
+        return int(val, 2) if val is not None and "x" not in val else None
+
+    prog = list()
+    for time, valid in tvs["rvfi_valid"]:
+        if valid != '1':
+            continue
+        order = value_at(tvs["rvfi_order"], time)
+        insn = value_at(tvs["rvfi_insn"], time)
+        pc = value_at(tvs.get("rvfi_pc_rdata", []), time)
+        if order is not None and insn is not None:
+            prog.append((order, pc, insn))
+
+    lines = list()
+    for order, pc, insn in sorted(prog):
+        pc_str = "????????" if pc is None else f"{pc:08x}"
+        lines.append(f"{order:>4}  {pc_str}:  {insn:08x}  "
+                     f"{disassemble(insn, pc)}")
+
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    print(disasm_vcd(argv[1]), end="")
@@ -14,6 +14,7 @@ module rvfi_wrapper (
 
 	(* keep *) `rvformal_rand_reg bus__ack;
     (* keep *) `rvformal_rand_reg irq;
+    (* keep *) `rvformal_rand_reg timer_irq;
 	(* keep *) `rvformal_rand_reg [31:0] bus__dat_r;
 
 	(* keep *) wire        bus__cyc;
@@ -37,6 +38,7 @@ module rvfi_wrapper (
                  .bus__ack (bus__ack),
 
                  .irq (irq),
+                 .timer_irq (timer_irq),
 
                  `RVFI_AMARANTH_PORT(valid),
                  `RVFI_AMARANTH_PORT(order),
@@ -0,0 +1,32 @@
+import pytest
+
+from sentinel.disasm import disassemble
+
+
+# Encodings from bronzebeard; expected output matches
+# "objdump -M numeric,no-aliases".
+@pytest.mark.parametrize("insn,pc,asm", [
+    (0xfff00093, None, "addi\tx1,x0,-1"),
+    (0x00311093, None, "slli\tx1,x2,3"),
+    (0x41f15093, None, "srai\tx1,x2,31"),
+    (0x023100b3, None, "mul\tx1,x2,x3"),
+    (0x123450b7, None, "lui\tx1,0x12345"),
+    (0x00001197, None, "auipc\tx3,0x1"),
+    (0x0040a103, None, "lw\tx2,4(x1)"),
+    (0xfe20ae23, None, "sw\tx2,-4(x1)"),
+    (0x00008067, None, "jalr\tx0,0(x1)"),
+    (0x00208463, None, "beq\tx1,x2,.+8"),
+    (0x00208463, 0x100, "beq\tx1,x2,0x108"),
+    (0xffdff0ef, 0x100, "jal\tx1,0xfc"),
+    (0x340110f3, None, "csrrw\tx1,mscratch,x2"),
+    (0x3402d0f3, None, "csrrwi\tx1,mscratch,5"),
+    (0x0ff0000f, None, "fence\tiorw,iorw"),
+    (0x00000073, None, "ecall"),
+    (0x00100073, None, "ebreak"),
+    (0x30200073, None, "mret"),
+    (0x10500073, None, "wfi"),
+    (0x00000000, None, ".word\t0x00000000"),
+    (0x0000202f, None, ".word\t0x0000202f"),  # AMO
+])
+def test_disassemble(insn, pc, asm):
+    assert disassemble(insn, pc) == asm
@@ -0,0 +1,58 @@
+from io import StringIO
+
+from bronzebeard import asm
+
+from sentinel.sim import run
+
+
+def test_run():
+    prog = asm.assemble("""
+        lui     x1, %hi(0x80000000)
+        addi    x2, x0, 104
+        sb      x2, 0(x1)
+        addi    x2, x0, 105
+        sb      x2, 0(x1)
+        lw      x3, 4(x1)  # TX irq pending: 2.
+        slli    x3, x3, 1
+        ori     x3, x3, 1
+        lui     x4, %hi(0x4000000)
+        sw      x3, 0(x4)
+    """)
+    console = StringIO()
+
+    res = run(prog.ljust(0x1000, b"\0"), console=console)
+
+    assert console.getvalue() == "hi"
+    assert res.exit_code == 2
+    assert res.insns == 10
+    assert res.cycles > res.insns
+
+
+def test_run_reset_irq():
+    prog = asm.assemble("""
+        lui     x1, %hi(0x80000000)
+        lw      x3, 4(x1)  # TX irq pending out of reset: 0b10.
+        lw      x5, 4(x1)  # Cleared by the first read.
+        slli    x3, x3, 1
+        or      x3, x3, x5
+        slli    x3, x3, 1
+        ori     x3, x3, 1
+        lui     x4, %hi(0x4000000)
+        sw      x3, 0(x4)
+    """)
+
+    res = run(prog.ljust(0x1000, b"\0"))
+
+    assert res.exit_code == 0b100
+
+
+def test_run_max_cycles():
+    prog = asm.assemble("""
+    loop:
+        jal     x0, loop
+    """)
+
+    res = run(prog.ljust(0x1000, b"\0"), max_cycles=1000)
+
+    assert res.exit_code is None
+    assert res.cycles == 1000
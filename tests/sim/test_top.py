@@ -9,7 +9,7 @@ from elftools.elf.elffile import ELFFile
 
 # FIXME: Eventually drop the need for SoC and simulate memory purely with
 # a process like in RISCOF tests? This will be pretty invasive.
-from examples.attosoc import AttoSoC
+from examples.attosoc import AttoSoC, BusType, BufferedUART, IRQController
 
 from conftest import RV32Regs, CSRRegs
 
@@ -303,17 +303,13 @@ bgeu_dst2:
     sim.run(testbenches=[cpu_proc], sync_processes=[ucode_panic])
 
 
-@pytest.mark.module(AttoSoC(sim=True))
-@pytest.mark.clks((1.0 / 12e6,))
-def test_primes(sim_mod, ucode_panic):
-    sim, m = sim_mod
-
+def run_primes(sim, m, ucode_panic, processes=(), flash=False):
     # This is a prime-counting program. It is provided with/disassembled from
     # nextpnr-ice40's examples (https://github.com/YosysHQ/nextpnr/tree/master/ice40/smoketest/attosoc),  # noqa: E501
     # but I don't know about its origins otherwise.
     # I have modified a hardcoded delay from 360000 to 2, as well as stopping
     # after 17 for simulation speed.
-    m.rom = """
+    primes = """
         li      s0,2
         lui     s1,0x2000  # IO port at 0x2000000
         li      s3,18  #  Originally 256
@@ -350,6 +346,17 @@ countdown:
         ret
 """
 
+    if flash:
+        m.flash_rom = primes
+        m.rom = """
+        lui     t0,0x20000  # FLASH_ADDR
+        jalr    x0,0(t0)
+"""
+    else:
+        m.rom = primes
+
+    bus = m.cpu.dbus if m.cpu.harvard else m.cpu.bus
+
     def io_proc():
         primes = [3, 5, 7, 11, 13, 17, 2]
         # 19, 23, 29, 31, 37, 41, 43, 47, 53,
@@ -360,11 +367,11 @@ countdown:
 
         for p in primes:
             for _ in range(65536):
-                if ((yield m.cpu.bus.adr == 0x2000000 >> 2) and
-                        (yield m.cpu.bus.cyc) and
-                        (yield m.cpu.bus.stb) and
-                        (yield m.cpu.bus.ack)):
-                    assert (yield m.cpu.bus.dat_w) == p
+                if ((yield bus.adr == 0x2000000 >> 2) and
+                        (yield bus.cyc) and
+                        (yield bus.stb) and
+                        (yield bus.ack)):
+                    assert (yield bus.dat_w) == p
                     break
                 else:
                     yield Tick()
@@ -373,7 +380,192 @@ countdown:
                                      "in infinite loop")
             yield Tick()
 
+    sim.run(testbenches=[io_proc],
+            sync_processes=[ucode_panic, *processes])
+
+
+# Model slow memory by holding off WBMemory's ACK for ws cycles per access.
+def wait_states(m, ws):
+    def wait_states_proc():
+        yield Passive()
+
+        waited = 0
+        while True:
+            yield m.mem.ctrl.force_ws.eq(waited < ws)
+            yield Tick()
+
+            bus = m.mem.bus
+            if (yield bus.cyc & bus.stb & ~bus.ack):
+                waited += 1
+            else:
+                waited = 0
+
+    return wait_states_proc
+
+
+@pytest.mark.module(AttoSoC(sim=True))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_primes(sim_mod, ucode_panic):
+    sim, m = sim_mod
+    run_primes(sim, m, ucode_panic)
+
+
+@pytest.mark.module(AttoSoC(sim=True, fast_sequencer=True))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_primes_fast_sequencer(sim_mod, ucode_panic):
+    sim, m = sim_mod
+    run_primes(sim, m, ucode_panic)
+
+
+@pytest.mark.module(AttoSoC(sim=True, zero_ws=True))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_primes_zero_ws(sim_mod, ucode_panic):
+    sim, m = sim_mod
+    run_primes(sim, m, ucode_panic)
+
+
+@pytest.mark.module(AttoSoC(sim=True, burst=True))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_primes_burst(sim_mod, ucode_panic):
+    sim, m = sim_mod
+    run_primes(sim, m, ucode_panic)
+
+
+@pytest.mark.module(AttoSoC(sim=True, harvard=True))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_primes_harvard(sim_mod, ucode_panic):
+    sim, m = sim_mod
+    run_primes(sim, m, ucode_panic)
+
+
+@pytest.mark.module(AttoSoC(sim=True, icache_lines=4, icache_line_words=2))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_primes_icache(sim_mod, ucode_panic):
+    sim, m = sim_mod
+    run_primes(sim, m, ucode_panic, [wait_states(m, 3)])
+
+
+@pytest.mark.module(AttoSoC(sim=True, flash_offset=0x100000))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_primes_flash(sim_mod, ucode_panic):
+    sim, m = sim_mod
+    run_primes(sim, m, ucode_panic, flash=True)
+
+
+@pytest.mark.module(AttoSoC(sim=True, flash_offset=0x100000, flash_width=1,
+                            icache_lines=4))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_primes_flash_single_icache(sim_mod, ucode_panic):
+    sim, m = sim_mod
+    run_primes(sim, m, ucode_panic, flash=True)
+
+
+@pytest.mark.module(AttoSoC(sim=True, csr_data_width=32))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_primes_csr32(sim_mod, ucode_panic):
+    sim, m = sim_mod
+    run_primes(sim, m, ucode_panic)
+
+
+def run_icache_bench(sim, m, ucode_panic):
+    stats = {"cycles": 0}
+
+    def stats_proc():
+        yield Passive()
+
+        while True:
+            yield Tick()
+            stats["cycles"] += 1
+            if m.icache:
+                stats["hits"] = (yield m.icache.hits)
+                stats["misses"] = (yield m.icache.misses)
+
+    run_primes(sim, m, ucode_panic, [wait_states(m, 8), stats_proc])
+    return stats
+
+
+@pytest.mark.module(AttoSoC(sim=True))
+@pytest.mark.clks((1.0 / 12e6,))
+@pytest.mark.bench
+def test_icache_bench_baseline(sim_mod, ucode_panic):
+    sim, m = sim_mod
+    stats = run_icache_bench(sim, m, ucode_panic)
+    print(f"no icache: {stats['cycles']} cycles")
+
+
+@pytest.mark.module(AttoSoC(sim=True, icache_lines=16))
+@pytest.mark.clks((1.0 / 12e6,))
+@pytest.mark.bench
+def test_icache_bench(sim_mod, ucode_panic):
+    sim, m = sim_mod
+    stats = run_icache_bench(sim, m, ucode_panic)
+    print(f"16x4 icache: {stats['cycles']} cycles, {stats['hits']} hits, "
+          f"{stats['misses']} misses")
+    assert stats["hits"] > stats["misses"]
+
+
+# Cycles per access to the GPIO/LED registers, from the request until ACK.
+def run_periph_bench(sim, m, ucode_panic):
+    m.rom = """
+        lui     x1,0x2000
+        addi    x2,x0,16
+loop:
+        lw      x3,4(x1)  # inout
+        sw      x3,0(x1)  # leds
+        addi    x2,x2,-1
+        bnez    x2,loop
+        sw      x0,8(x1)  # oe
+"""
+
+    stats = {"cycles": 0, "accesses": 0}
+
+    def io_proc():
+        bus = m.cpu.bus
+
+        for _ in range(65536):
+            # Anywhere in the LEDs' 32 MiB window at 0x2000000.
+            if ((yield bus.adr[23:] == 1) and
+                    (yield bus.cyc) and
+                    (yield bus.stb)):
+                stats["cycles"] += 1
+                if (yield bus.ack):
+                    stats["accesses"] += 1
+                    if (yield bus.adr == 0x2000008 >> 2):
+                        break
+            yield Tick()
+        else:
+            raise AssertionError("benchmark didn't finish")
+
     sim.run(testbenches=[io_proc], sync_processes=[ucode_panic])
+    assert stats["accesses"] == 2 * 16 + 1
+    return stats["cycles"] / stats["accesses"]
+
+
+@pytest.mark.module(AttoSoC(sim=True, bus_type=BusType.WB))
+@pytest.mark.clks((1.0 / 12e6,))
+@pytest.mark.bench
+def test_periph_bench_wb(sim_mod, ucode_panic):
+    sim, m = sim_mod
+    print(f"WB: {run_periph_bench(sim, m, ucode_panic):.2f} cycles/access")
+
+
+@pytest.mark.module(AttoSoC(sim=True))
+@pytest.mark.clks((1.0 / 12e6,))
+@pytest.mark.bench
+def test_periph_bench_csr8(sim_mod, ucode_panic):
+    sim, m = sim_mod
+    print(f"8-bit CSR: {run_periph_bench(sim, m, ucode_panic):.2f} "
+          "cycles/access")
+
+
+@pytest.mark.module(AttoSoC(sim=True, csr_data_width=32))
+@pytest.mark.clks((1.0 / 12e6,))
+@pytest.mark.bench
+def test_periph_bench_csr32(sim_mod, ucode_panic):
+    sim, m = sim_mod
+    cycles = run_periph_bench(sim, m, ucode_panic)
+    print(f"32-bit CSR: {cycles:.2f} cycles/access")
+    assert cycles == 2
 
 
 @pytest.mark.module(AttoSoC(sim=True))
@@ -618,6 +810,586 @@ handler:
     sim.run(testbenches=[cpu_proc], sync_processes=[ucode_panic])
 
 
+@pytest.mark.module(AttoSoC(sim=True))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_vectored_int(sim_mod, ucode_panic, cpu_proc_aux, basic_ports):
+    sim, m = sim_mod
+
+    # Interrupts go to BASE + 4 * cause in Vectored Mode, but synchronous
+    # exceptions still go to BASE.
+    m.rom = """
+         csrrwi x0, 17, 0x305  # mtvec, BASE 0x10, Vectored
+         addi x1, x0, 1
+         slli x1, x1, 11
+         csrrs x0, x1, 0x304  # mie
+         csrrsi x0, 8, 0x300  # mstatus  # 0x10
+         nop
+         nop
+         nop
+         nop  # 0x20
+         nop
+         nop
+         nop
+         nop  # 0x30
+         nop
+         nop
+meint_handler:
+         ecall
+"""
+
+    regs = [
+        RV32Regs(),
+        RV32Regs(PC=4 >> 2),
+        RV32Regs(R1=1, PC=8 >> 2),
+        RV32Regs(R1=0x800, PC=0xC >> 2),
+        RV32Regs(R1=0x800, PC=0x10 >> 2),
+        RV32Regs(R1=0x800, PC=0x14 >> 2),
+        RV32Regs(R1=0x800, PC=0x3C >> 2),
+        RV32Regs(R1=0x800, PC=0x10 >> 2),
+    ]
+
+    ram = [None]*len(regs)
+
+    csrs = [
+        CSRRegs(MIP=0x800),  # 0x0
+        CSRRegs(MIP=0x800, MTVEC=0x11),
+        CSRRegs(MIP=0x800, MTVEC=0x11),
+        CSRRegs(MIP=0x800, MTVEC=0x11),
+        CSRRegs(MIP=0x800, MIE=0x800, MTVEC=0x11),
+        CSRRegs(MSTATUS=0b11000_0000_1000, MIP=0x800, MIE=0x800,
+                MTVEC=0x11),
+        CSRRegs(MSTATUS=0b11000_1000_0000, MIP=0x800, MIE=0x800,
+                MTVEC=0x11, MCAUSE=0x8000000B, MEPC=0x14),
+        CSRRegs(MIP=0x800, MIE=0x800, MTVEC=0x11, MCAUSE=11, MEPC=0x3C),
+    ]
+
+    def cpu_proc():
+        yield m.cpu.irq.eq(1)
+        yield from cpu_proc_aux(regs, ram, csrs)
+
+    sim.ports = basic_ports
+    sim.run(testbenches=[cpu_proc], sync_processes=[ucode_panic])
+
+
+@pytest.mark.module(AttoSoC(sim=True, local_irqs=True))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_local_int(sim_mod, ucode_panic, cpu_proc_aux, basic_ports):
+    sim, m = sim_mod
+
+    # Local interrupt 1 is enabled, but local interrupt 0 is not.
+    m.rom = """
+         csrrwi x0, 16, 0x305  # mtvec
+         addi x1, x0, 1
+         slli x1, x1, 17
+         csrrs x0, x1, 0x304  # mie
+         csrrsi x0, 8, 0x300  # mstatus  # 0x10
+         nop
+"""
+
+    regs = [
+        RV32Regs(),
+        RV32Regs(PC=4 >> 2),
+        RV32Regs(R1=1, PC=8 >> 2),
+        RV32Regs(R1=0x20000, PC=0xC >> 2),
+        RV32Regs(R1=0x20000, PC=0x10 >> 2),
+        RV32Regs(R1=0x20000, PC=0x14 >> 2),
+        RV32Regs(R1=0x20000, PC=0x10 >> 2),
+    ]
+
+    ram = [None]*len(regs)
+
+    csrs = [
+        CSRRegs(MIP=0x30000),  # 0x0
+        CSRRegs(MIP=0x30000, MTVEC=0x10),
+        CSRRegs(MIP=0x30000, MTVEC=0x10),
+        CSRRegs(MIP=0x30000, MTVEC=0x10),
+        CSRRegs(MIP=0x30000, MIE=0x20000, MTVEC=0x10),
+        CSRRegs(MSTATUS=0b11000_0000_1000, MIP=0x30000, MIE=0x20000,
+                MTVEC=0x10),
+        CSRRegs(MSTATUS=0b11000_1000_0000, MIP=0x30000, MIE=0x20000,
+                MTVEC=0x10, MCAUSE=0x80000011, MEPC=0x14),
+    ]
+
+    def cpu_proc():
+        yield m.cpu.local_irq.eq(0b11)
+        yield from cpu_proc_aux(regs, ram, csrs)
+
+    sim.ports = basic_ports
+    sim.run(testbenches=[cpu_proc], sync_processes=[ucode_panic])
+
+
+@pytest.mark.module(AttoSoC(sim=True))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_timer_int(sim_mod, ucode_panic, cpu_proc_aux, basic_ports):
+    sim, m = sim_mod
+
+    # Both the timer and external interrupts are pending, but only the timer
+    # interrupt is enabled.
+    m.rom = """
+         csrrwi x0, 16, 0x305  # mtvec
+         addi x1, x0, 0x80
+         nop
+         csrrs x0, x1, 0x304  # mie
+         csrrsi x0, 8, 0x300  # mstatus  # 0x10
+         nop
+"""
+
+    regs = [
+        RV32Regs(),
+        RV32Regs(PC=4 >> 2),
+        RV32Regs(R1=0x80, PC=8 >> 2),
+        RV32Regs(R1=0x80, PC=0xC >> 2),
+        RV32Regs(R1=0x80, PC=0x10 >> 2),
+        RV32Regs(R1=0x80, PC=0x14 >> 2),
+        RV32Regs(R1=0x80, PC=0x10 >> 2),
+    ]
+
+    ram = [None]*len(regs)
+
+    csrs = [
+        CSRRegs(MIP=0x880),  # 0x0
+        CSRRegs(MIP=0x880, MTVEC=0x10),
+        CSRRegs(MIP=0x880, MTVEC=0x10),
+        CSRRegs(MIP=0x880, MTVEC=0x10),
+        CSRRegs(MIP=0x880, MIE=0x80, MTVEC=0x10),
+        CSRRegs(MSTATUS=0b11000_0000_1000, MIP=0x880, MIE=0x80,
+                MTVEC=0x10),
+        CSRRegs(MSTATUS=0b11000_1000_0000, MIP=0x880, MIE=0x80,
+                MTVEC=0x10, MCAUSE=0x80000007, MEPC=0x14),
+    ]
+
+    def cpu_proc():
+        yield m.cpu.irq.eq(1)
+        yield m.cpu.timer_irq.eq(1)
+        yield from cpu_proc_aux(regs, ram, csrs)
+
+    sim.ports = basic_ports
+    sim.run(testbenches=[cpu_proc], sync_processes=[ucode_panic])
+
+
+@pytest.mark.module(AttoSoC(sim=True, bus_type=BusType.WB, mtimer=True))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_mtimer(sim_mod, ucode_panic):
+    sim, m = sim_mod
+
+    # Machine timer is right after the LEDs in simulation. Set a deadline,
+    # wait for the interrupt, and report mcause, mtime, and then mip after
+    # pushing the deadline back out to the LEDs.
+    m.rom = """
+        lui     x1,%hi(0x4000000)
+        lui     x4,%hi(0x2000000)
+        addi    x2,x0,%lo(handler)
+        csrrw   x0,x2,0x305  # mtvec
+        sw      x0,12(x1)  # mtimecmph
+        addi    x2,x0,200
+        sw      x2,8(x1)  # mtimecmp
+        addi    x2,x0,0x80
+        csrrs   x0,x2,0x304  # mie
+        csrrsi  x0,8,0x300  # mstatus
+loop:
+        j       loop
+handler:
+        csrrs   x3,x0,0x342  # mcause
+        sw      x3,0(x4)
+        lw      x5,0(x1)  # mtime
+        sw      x5,0(x4)
+        addi    x2,x0,-1
+        sw      x2,12(x1)  # mtimecmph
+        csrrs   x3,x0,0x344  # mip
+        sw      x3,0(x4)
+"""
+
+    def io_proc():
+        bus = m.cpu.bus
+        writes = []
+
+        while len(writes) < 3:
+            for _ in range(1000):
+                if ((yield bus.adr == 0x2000000 >> 2) and
+                        (yield bus.cyc) and
+                        (yield bus.stb) and
+                        (yield bus.we) and
+                        (yield bus.ack)):
+                    writes.append((yield bus.dat_w))
+                    break
+                else:
+                    yield Tick()
+            else:
+                raise AssertionError("timer interrupt not taken")
+            yield Tick()
+
+        mcause, mtime, mip = writes
+        assert mcause == 0x80000007
+        assert mtime >= 200
+        assert mip == 0
+
+    sim.run(testbenches=[io_proc], sync_processes=[ucode_panic])
+
+
+@pytest.mark.module(AttoSoC(sim=True, m_extension=True))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_m_extension(sim_mod, ucode_panic, cpu_proc_aux, basic_ports):
+    sim, m = sim_mod
+
+    m.rom = """
+         addi x1, x0, -7
+         addi x2, x0, 3
+         mul x3, x1, x2
+         mulh x4, x1, x2
+         mulhu x5, x1, x2
+         div x6, x1, x2
+         rem x7, x1, x2
+         divu x8, x1, x0
+         remu x9, x2, x1
+         nop
+"""
+
+    # Operands are -7 and 3.
+    ops = dict(R1=0xFFFFFFF9, R2=3)
+    regs = [
+        RV32Regs(),
+        RV32Regs(R1=0xFFFFFFF9, PC=4 >> 2),
+        RV32Regs(**ops, PC=8 >> 2),
+        RV32Regs(**ops, R3=0xFFFFFFEB, PC=0xC >> 2),
+        RV32Regs(**ops, R3=0xFFFFFFEB, R4=0xFFFFFFFF, PC=0x10 >> 2),
+        RV32Regs(**ops, R3=0xFFFFFFEB, R4=0xFFFFFFFF, R5=2, PC=0x14 >> 2),
+        RV32Regs(**ops, R3=0xFFFFFFEB, R4=0xFFFFFFFF, R5=2, R6=0xFFFFFFFE,
+                 PC=0x18 >> 2),
+        RV32Regs(**ops, R3=0xFFFFFFEB, R4=0xFFFFFFFF, R5=2, R6=0xFFFFFFFE,
+                 R7=0xFFFFFFFF, PC=0x1C >> 2),
+        # Division by zero.
+        RV32Regs(**ops, R3=0xFFFFFFEB, R4=0xFFFFFFFF, R5=2, R6=0xFFFFFFFE,
+                 R7=0xFFFFFFFF, R8=0xFFFFFFFF, PC=0x20 >> 2),
+        RV32Regs(**ops, R3=0xFFFFFFEB, R4=0xFFFFFFFF, R5=2, R6=0xFFFFFFFE,
+                 R7=0xFFFFFFFF, R8=0xFFFFFFFF, R9=3, PC=0x24 >> 2),
+    ]
+
+    ram = [None]*len(regs)
+    csrs = [CSRRegs()]*len(regs)
+
+    def cpu_proc():
+        yield from cpu_proc_aux(regs, ram, csrs)
+
+    sim.ports = basic_ports
+    sim.run(testbenches=[cpu_proc], sync_processes=[ucode_panic])
+
+
+@pytest.mark.module(AttoSoC(sim=True, num_hpm_counters=1))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_hpm_counters(sim_mod, ucode_panic, cpu_proc_aux, basic_ports):
+    sim, m = sim_mod
+
+    # Count exceptions taken, then read back mhpmcounter3 and mhpmevent3.
+    m.rom = """
+         csrrwi x0, 16, 0x305  # mtvec
+         csrrwi x0, 4, 0x323  # mhpmevent3
+         ecall
+         nop
+handler:
+         csrrs x1, x0, -0x4FD  # mhpmcounter3
+         csrrs x2, x0, 0x323  # mhpmevent3
+         nop
+"""
+
+    regs = [
+        RV32Regs(),
+        RV32Regs(PC=4 >> 2),
+        RV32Regs(PC=8 >> 2),
+        RV32Regs(PC=0x10 >> 2),
+        RV32Regs(R1=1, PC=0x14 >> 2),
+        RV32Regs(R1=1, R2=4, PC=0x18 >> 2),
+    ]
+
+    ram = [None]*len(regs)
+
+    csrs = [
+        CSRRegs(),
+        CSRRegs(MTVEC=0x10),
+        CSRRegs(MTVEC=0x10),
+        *[CSRRegs(MTVEC=0x10, MCAUSE=11, MEPC=0x8)]*3
+    ]
+
+    def cpu_proc():
+        yield from cpu_proc_aux(regs, ram, csrs)
+
+    sim.ports = basic_ports
+    sim.run(testbenches=[cpu_proc], sync_processes=[ucode_panic])
+
+
+@pytest.mark.module(AttoSoC(sim=True, bus_type=BusType.WB, trace=True))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_trace(sim_mod, ucode_panic, cpu_proc_aux, basic_ports):
+    sim, m = sim_mod
+
+    # Trace buffer is right after the LEDs in simulation.
+    m.rom = """
+         lui x1, %hi(0x4000000)
+         addi x2, x0, 1
+         sw x2, 0(x1)  # Start tracing PCs.
+         nop
+         sw x0, 0(x1)  # Stop.
+         lw x3, 4(x1)  # status
+         lw x4, 12(x1)  # data
+         lw x5, 12(x1)
+         nop
+"""
+
+    regs = [
+        RV32Regs(),
+        RV32Regs(R1=0x4000000, PC=4 >> 2),
+        RV32Regs(R1=0x4000000, R2=1, PC=8 >> 2),
+        RV32Regs(R1=0x4000000, R2=1, PC=0xC >> 2),
+        RV32Regs(R1=0x4000000, R2=1, PC=0x10 >> 2),
+        RV32Regs(R1=0x4000000, R2=1, PC=0x14 >> 2),
+        # Two entries, and no longer recording.
+        RV32Regs(R1=0x4000000, R2=1, R3=0x20000, PC=0x18 >> 2),
+        # nop at 0xC, 2 cycles after tracing started.
+        RV32Regs(R1=0x4000000, R2=1, R3=0x20000, R4=(2 << 22) | 3,
+                 PC=0x1C >> 2),
+        # sw at 0x10, 4 cycles after the nop.
+        RV32Regs(R1=0x4000000, R2=1, R3=0x20000, R4=(2 << 22) | 3,
+                 R5=(4 << 22) | 4, PC=0x20 >> 2),
+    ]
+
+    ram = [None]*len(regs)
+    csrs = [CSRRegs()]*len(regs)
+
+    def cpu_proc():
+        yield from cpu_proc_aux(regs, ram, csrs)
+
+    sim.ports = basic_ports
+    sim.run(testbenches=[cpu_proc], sync_processes=[ucode_panic])
+
+
+@pytest.mark.module(AttoSoC(sim=True, bus_type=BusType.WB, dma=True))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_dma(sim_mod, ucode_panic):
+    sim, m = sim_mod
+
+    # DMA engine is right after the LEDs in simulation. Copy the first four
+    # words of the program to 0x300 and store the last to the LEDs, then
+    # copy bytes 1-3 of the program to the LEDs directly.
+    m.rom = """
+        lui     x1,%hi(0x4000000)
+        sw      x0,0(x1)  # src
+        addi    x3,x0,0x300
+        sw      x3,4(x1)  # dst
+        addi    x4,x0,4
+        sw      x4,8(x1)  # count
+        addi    x5,x0,1
+        sw      x5,12(x1)  # start, words
+wait1:
+        lw      x6,16(x1)
+        andi    x6,x6,2
+        beqz    x6,wait1
+        lw      x7,12(x3)
+        lui     x8,%hi(0x2000000)
+        sw      x7,0(x8)
+        addi    x2,x0,1
+        sw      x2,0(x1)  # src
+        sw      x8,4(x1)  # dst
+        addi    x4,x0,3
+        sw      x4,8(x1)  # count
+        addi    x5,x0,0b1011
+        sw      x5,12(x1)  # start, bytes, fixed dst
+wait2:
+        lw      x6,16(x1)
+        andi    x6,x6,2
+        beqz    x6,wait2
+        sw      x4,0(x8)
+"""
+
+    first = m.rom[0].to_bytes(4, byteorder="little")
+    expected = [
+        (m.rom[3], 0xf),
+        *((b * 0x01010101, 0x1) for b in first[1:]),
+        (3, 0xf),
+    ]
+
+    def io_proc():
+        bus = m.arbiter.bus
+
+        for dat_w, sel in expected:
+            for _ in range(1000):
+                if ((yield bus.adr == 0x2000000 >> 2) and
+                        (yield bus.cyc) and
+                        (yield bus.stb) and
+                        (yield bus.we) and
+                        (yield bus.ack)):
+                    assert (yield bus.dat_w) == dat_w
+                    assert (yield bus.sel) == sel
+                    break
+                else:
+                    yield Tick()
+            else:
+                raise AssertionError("DMA transfer didn't complete")
+            yield Tick()
+
+    sim.run(testbenches=[io_proc], sync_processes=[ucode_panic])
+
+
+@pytest.mark.module(AttoSoC(sim=True, custom_ucode=Path(__file__).parents[2] /
+                            "examples" / "custom.asm"))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_custom_insns(sim_mod, ucode_panic, cpu_proc_aux, basic_ports):
+    sim, m = sim_mod
+
+    # bronzebeard doesn't know about the custom insns, so encode them by hand.
+    m.rom = """
+         addi x1, x0, 0x5A
+         addi x2, x0, 0x0F
+         pack <I, 0x0020818B  # andn x3, x1, x2
+         pack <I, 0x0000920B  # brev x4, x1
+         nop
+"""
+
+    regs = [
+        RV32Regs(),
+        RV32Regs(R1=0x5A, PC=4 >> 2),
+        RV32Regs(R1=0x5A, R2=0x0F, PC=8 >> 2),
+        RV32Regs(R1=0x5A, R2=0x0F, R3=0x50, PC=0xC >> 2),
+        RV32Regs(R1=0x5A, R2=0x0F, R3=0x50, R4=0x5A000000, PC=0x10 >> 2),
+    ]
+
+    ram = [None]*len(regs)
+    csrs = [CSRRegs()]*len(regs)
+
+    def cpu_proc():
+        yield from cpu_proc_aux(regs, ram, csrs)
+
+    sim.ports = basic_ports
+    sim.run(testbenches=[cpu_proc], sync_processes=[ucode_panic])
+
+
+@pytest.mark.module(BufferedUART(divisor=4, depth=4))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_buffered_uart(sim_mod):
+    sim, m = sim_mod
+
+    def loopback():
+        yield Passive()
+        yield m.rx_i.eq(1)
+        while True:
+            yield Tick()
+            yield m.rx_i.eq((yield m.tx_o))
+
+    def strobe(stb, data=0):
+        yield m.w_data.eq(data)
+        yield stb.eq(1)
+        yield Tick()
+        yield stb.eq(0)
+        yield Tick()
+
+    def wait_for(cond, limit):
+        for _ in range(limit):
+            if (yield from cond()):
+                return
+            yield Tick()
+        raise AssertionError("timed out")
+
+    def rx_level_is(n):
+        def cond():
+            return (yield m.rx_level) == n
+        return cond
+
+    def uart_proc():
+        assert (yield m.irq_status) == 0
+
+        # Don't interrupt until all 3 bytes have arrived.
+        yield from strobe(m.rx_thresh_w_stb, 3)
+        for b in b"abc":
+            yield from strobe(m.tx_w_stb, b)
+            assert (yield m.irq_status) == 0
+        yield from wait_for(rx_level_is(3), 3 * 10 * 4 + 20)
+        # RX level, and TX FIFO drained.
+        assert (yield m.irq_status) == 0b011
+
+        yield from strobe(m.irq_r_stb)
+        assert (yield m.irq_status) == 0b001
+        assert (yield m.rx_data) == ord("a")
+        yield from strobe(m.rx_r_stb)
+        assert (yield m.irq_status) == 0
+
+        # The remaining 2 bytes time out after 4 character times.
+        for _ in range(4 * 10 * 4 - 10):
+            yield Tick()
+        assert (yield m.irq_status) == 0
+        for _ in range(20):
+            yield Tick()
+        assert (yield m.irq_status) == 0b001
+
+        # Overflow the RX FIFO.
+        for b in b"defg":
+            yield from strobe(m.tx_w_stb, b)
+        yield from wait_for(lambda: (yield m.irq_status[2]), 4 * 10 * 4 + 20)
+        received = []
+        while (yield m.rx_level):
+            received.append((yield m.rx_data))
+            yield from strobe(m.rx_r_stb)
+        assert bytes(received) == b"bcde"
+
+    sim.run(testbenches=[uart_proc], sync_processes=[loopback])
+
+
+@pytest.mark.module(IRQController(num_sources=3, priority_bits=2))
+@pytest.mark.clks((1.0 / 12e6,))
+def test_irq_controller(sim_mod):
+    sim, m = sim_mod
+
+    def write(stb, data, stb_value=1):
+        yield m.w_data.eq(data)
+        yield stb.eq(stb_value)
+        yield Tick()
+        yield stb.eq(0)
+
+    def claim():
+        yield m.claim_r_stb.eq(1)
+        source = yield m.claim
+        yield Tick()
+        yield m.claim_r_stb.eq(0)
+        return source
+
+    def irqc_proc():
+        # Nothing is enabled out of reset.
+        yield m.sources.eq(0b111)
+        yield Tick()
+        assert (yield m.pending) == 0b111
+        assert not (yield m.irq)
+
+        # Ties go to the lowest-numbered source.
+        yield from write(m.enable_w_stb, 0b110)
+        assert (yield m.irq)
+        assert (yield m.claim) == 2
+
+        # Raise source 3 above source 2.
+        yield from write(m.priority_w_stb, 2, 0b100)
+        assert (yield m.claim) == 3
+
+        # Claiming source 3 leaves source 2.
+        assert (yield from claim()) == 3
+        assert (yield m.pending) == 0b011
+        assert (yield m.claim) == 2
+
+        # Source 2 is masked by the threshold.
+        yield from write(m.threshold_w_stb, 1)
+        assert not (yield m.irq)
+        assert (yield from claim()) == 0
+
+        # Source 3 is still asserted, so pends again once completed.
+        yield from write(m.complete_w_stb, 3)
+        assert (yield m.pending) == 0b111
+        assert (yield m.claim) == 3
+
+        # Completing a source that wasn't claimed does nothing.
+        yield from write(m.complete_w_stb, 2)
+        assert (yield m.pending) == 0b111
+        yield m.sources.eq(0b011)
+        yield Tick()
+        assert not (yield m.irq)
+
+    sim.run(testbenches=[irqc_proc])
+
+
 # Infrequently-used test mostly for testing address decoding. Should not cause
 # failure if user does not have Rust installed.
 @pytest.mark.module(AttoSoC(sim=False, num_bytes=0x1000))
@@ -0,0 +1,30 @@
+from io import StringIO
+
+from sentinel.trace import decode, read_dump, DELTA_MAX, PAYLOAD_BITS
+
+
+def test_decode():
+    words = [(2 << PAYLOAD_BITS) | 3, (4 << PAYLOAD_BITS) | 4,
+             (DELTA_MAX << PAYLOAD_BITS) | 5, (1 << PAYLOAD_BITS) | 6]
+
+    entries = decode(words)
+
+    assert [e.adr for e in entries] == [0xC, 0x10, 0x14, 0x18]
+    assert [e.cycle for e in entries] == [0, 4, 4 + DELTA_MAX,
+                                          5 + DELTA_MAX]
+    assert [e.cycles for e in entries] == [4, DELTA_MAX, 1, None]
+    assert [e.saturated for e in entries] == [False, True, False, False]
+
+
+def test_decode_upc():
+    entries = decode([(1 << PAYLOAD_BITS) | 0x30, (3 << PAYLOAD_BITS) | 0x31],
+                     upc=True)
+
+    assert [e.adr for e in entries] == [0x30, 0x31]
+    assert [e.cycles for e in entries] == [3, None]
+
+
+def test_read_dump():
+    dump = StringIO("trace:\n00800003\n0x1000004\n\n  abc  \nok\n")
+
+    assert read_dump(dump) == [0x800003, 0x1000004, 0xabc]
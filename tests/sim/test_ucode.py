@@ -54,3 +54,84 @@ def test_twice_init(sim_mod, dummy):
         yield
 
     sim.run(sync_processes=[ucode_proc])
+
+
+def test_custom_slots():
+    custom = StringIO("""
+custom0_9: alu_op => and, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
+custom0_0: alu_op => or, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
+""")
+    rom = UCodeROM(custom_file=custom)
+
+    assert rom.custom_slots == (0, 9)
+    assert rom.m5meta.symtab["custom0_0_1"] == UCodeROM.custom_0_base
+    assert rom.m5meta.symtab["custom0_9_1"] == UCodeROM.custom_0_base + 9
+    # User microcode lives after the main microcode in the larger ROM.
+    assert rom.m5meta.symtab["custom0_9"] >= 0x100
+
+
+def test_custom_bad_slot():
+    custom = StringIO("""
+custom0_16: alu_op => and, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
+""")
+
+    with pytest.raises(ValueError, match="custom0_16"):
+        UCodeROM(custom_file=custom)
+
+
+def test_multiway_misaligned():
+    custom = StringIO("""
+custom0_0: alu_op => and, cond_test => cmp_alu_o_zero, jmp_type => multiway, \
+               target => custom0_0_2;
+custom0_0_2: alu_op => and, INSN_FETCH, JUMP_TO_OP_END(fast_epilog);
+""")
+
+    with pytest.raises(ValueError, match="not 4-aligned"):
+        UCodeROM(custom_file=custom)
+
+
+def test_predecode():
+    rom = UCodeROM()
+    pre = UCodeROM(predecode=True)
+    symtab = pre.m5meta.symtab
+
+    def fields(addr):
+        return pre.field_layout.from_bits(pre.ucode_contents[addr])
+
+    assert pre.width == rom.width + 2*8 + 2
+    # Predecoding only adds fields.
+    assert all(w & ((1 << rom.width) - 1) == v
+               for w, v in zip(pre.ucode_contents, rom.ucode_contents))
+
+    # reset continues to the next uinsn regardless of the test.
+    reset = fields(symtab["reset"])
+    assert reset.seq_taken == reset.seq_fall == symtab["reset"] + 1
+    # check_int dispatches through the decoder.
+    check_int = fields(symtab["check_int"])
+    assert check_int.seq_map == 1
+    assert check_int.seq_taken == symtab["save_pc"]
+    # lb_wait loops until ack.
+    lb_wait = fields(symtab["lb_wait"])
+    assert lb_wait.seq_taken == symtab["lb_wait"]
+    assert lb_wait.seq_fall == symtab["lb_wait"] + 1
+    assert fields(symtab["lb_req"]).seq_multiway == 1
+
+
+def test_placeholder(tmp_path):
+    rom = UCodeROM(hex=tmp_path / "ucode.hex")
+    rand = UCodeROM(placeholder=True, hex=tmp_path / "rand_ucode.hex")
+
+    assert (rand.width, rand.depth) == (rom.width, rom.depth)
+    assert rand.ucode_contents == \
+        UCodeROM(placeholder=True).ucode_contents
+    # icebram needs all bit columns of each 256-word block to be distinct.
+    for blk in range(0, rand.depth, 256):
+        cols = {tuple(w >> b & 1 for w in rand.ucode_contents[blk:blk + 256])
+                for b in range(rand.width)}
+        assert len(cols) == rand.width
+
+    # Both hex files have a word for each address, so icebram can swap them.
+    ucode_hex = (tmp_path / "ucode.hex").read_text().split()
+    rand_hex = (tmp_path / "rand_ucode.hex").read_text().split()
+    assert len(ucode_hex) == len(rand_hex) == rom.depth
+    assert [int(w, 16) for w in ucode_hex] == rom.ucode_contents